@@ -0,0 +1,135 @@
+"""
+Throughput and tail latency of the async post endpoints against the sync viewset under concurrency.
+
+    python -m benchmarks.async_views [--clients 100] [--requests 2000] [--database postgres://...] [--pool-size 20]
+
+Every scenario is run twice through Django's ASGI handler, once on the
+/api/ routes served by core.async_views and once on /sync/api/, which
+routes the same requests to PostViewSet. N clients send their requests
+concurrently, each waiting for its response before sending the next, and
+requests/s and p50/p99 latency are reported for both.
+
+Everything runs in one process, so the figures include the clients. By
+default the database is a throwaway SQLite file; with --database pointing
+at PostgreSQL, --pool-size enables the psycopg 3 connection pool the
+project runs with. The write scenarios (comment_create, like_toggle) need
+PostgreSQL, as SQLite locks the whole file on concurrent writes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from .common import configure, summarize
+from .suite import SCENARIOS, Workload
+
+PATHS = {'async': '', 'sync': '/sync'}
+
+
+async def request(app, method, url, body, headers):
+    from channels.testing import HttpCommunicator
+
+    communicator = HttpCommunicator(app, method, url, body=body, headers=headers)
+    response = await communicator.get_response(timeout=60)
+    await communicator.wait()
+    return response['status']
+
+
+async def run_scenario(app, load, build, prefix, clients, requests, warmup):
+    headers = [
+        (b'host', b'testserver'),
+        (b'authorization', f'Bearer {load.tokens[load.user.pk]}'.encode()),
+        (b'content-type', b'application/json'),
+    ]
+    latencies, errors = [], 0
+
+    async def client(count, measured=True):
+        nonlocal errors
+        for _ in range(count):
+            method, url, data = build(load)
+            body = json.dumps(data).encode() if data is not None else b''
+            begin = time.perf_counter()
+            status = await request(app, method, prefix + url, body, headers)
+            if measured:
+                latencies.append((time.perf_counter() - begin) * 1e3)
+                errors += status >= 400
+
+    await client(warmup, measured=False)
+
+    shares = [requests // clients + (i < requests % clients) for i in range(clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client(share) for share in shares))
+    elapsed = time.perf_counter() - started
+
+    return {'requests': requests, 'errors': errors, 'throughput_rps': round(requests / elapsed, 1), **summarize(latencies)}
+
+
+async def measure(app, load, args):
+    print(f'{"scenario":<15} {"path":<6} {"rps":>9} {"p50 ms":>9} {"p99 ms":>9} {"errors":>7}')
+    for name in args.scenarios:
+        for path in args.paths:
+            result = await run_scenario(app, load, SCENARIOS[name], PATHS[path], args.clients, args.requests, args.warmup)
+            print(
+                f'{name:<15} {path:<6} {result["throughput_rps"]:>9.1f} {result["p50_ms"]:>9.2f} '
+                f'{result["p99_ms"]:>9.2f} {result["errors"]:>7}'
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', dest='database_url', help='Database URL (defaults to a temporary SQLite file).')
+    parser.add_argument('--pool-size', type=int, help='Maximum size of the psycopg 3 pool (PostgreSQL only).')
+    parser.add_argument('--redis', dest='redis_url', help='Redis URL for the cache (defaults to LocMemCache).')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000, help='Measured requests per scenario and path.')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--comments', type=int, default=5, help='Comments per post.')
+    parser.add_argument(
+        '--scenarios', nargs='+', choices=list(SCENARIOS), default=['post_list', 'post_detail', 'comment_list']
+    )
+    parser.add_argument('--paths', nargs='+', choices=list(PATHS), default=list(PATHS))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    database_file = None
+    if args.database_url is None:
+        handle, database_file = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        args.database_url = f'sqlite:///{database_file}'
+
+    overrides = {}
+    if args.pool_size:
+        import environ
+        database = environ.Env.db_url_config(args.database_url)
+        database.setdefault('OPTIONS', {})['pool'] = {'min_size': 2, 'max_size': args.pool_size}
+        overrides['DATABASES'] = {'default': database}
+
+    try:
+        configure(
+            args.database_url,
+            args.redis_url,
+            ROOT_URLCONF='benchmarks.urls',
+            ALLOWED_HOSTS=['*'],
+            MIDDLEWARE=[
+                'core.middleware.MetricsMiddleware',
+                'core.middleware.ReplicaRoutingMiddleware',
+                'django.middleware.security.SecurityMiddleware',
+                'django.middleware.common.CommonMiddleware',
+            ],
+            LIVE_COUNT_INTERVAL=None,
+            **overrides,
+        )
+        from django.core.asgi import get_asgi_application
+        load = Workload(args.posts, args.comments, random.Random(args.seed))
+        asyncio.run(measure(get_asgi_application(), load, args))
+    finally:
+        if database_file:
+            os.unlink(database_file)
+
+
+if __name__ == '__main__':
+    main()
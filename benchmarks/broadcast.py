@@ -0,0 +1,96 @@
+"""
+CPU cost of one chat group broadcast as the group grows, encoding the frame
+in every receiving consumer versus once at group_send time.
+
+    python -m benchmarks.broadcast [--sizes 10 100 1000] [--broadcasts 200]
+
+For every member of the group the event goes through what the Redis channel
+layer does with it (msgpack on send, again on receive) and then through the
+consumer's handler, down to the ASGI send, which is a no-op here. The
+sockets, the network and Redis itself are left out, so the figures are the
+part of a broadcast that depends on where the JSON is encoded.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import msgpack
+
+from .common import configure
+
+
+def payload(i):
+    return {'id': f'00000000-0000-0000-0000-{i:012d}', 'message': 'Lorem ipsum dolor sit amet, ' * 8, 'sender': 'benchmark'}
+
+
+def consumers(size):
+    from channels.generic.websocket import AsyncWebsocketConsumer
+    from core.consumers import ChatConsumer
+
+    class EncodeEach(AsyncWebsocketConsumer):
+        """What ChatConsumer used to do: the raw event is re-encoded by every socket."""
+
+        async def chat_message(self, event):
+            await self.send(text_data=json.dumps({
+                'id': event['id'],
+                'message': event['message'],
+                'sender': event['sender']
+            }))
+
+    async def discard(message):
+        pass
+
+    groups = {'each': [EncodeEach() for _ in range(size)], 'once': [ChatConsumer() for _ in range(size)]}
+    for group in groups.values():
+        for consumer in group:
+            consumer.base_send = discard
+    return groups
+
+
+async def broadcast(group, event, handler):
+    for consumer in group:
+        received = msgpack.unpackb(msgpack.packb(event))
+        await getattr(consumer, handler)(received)
+
+
+async def measure(groups, broadcasts):
+    from core.frames import frame
+
+    cpu = {'each': 0.0, 'once': 0.0}
+    for i in range(broadcasts):
+        started = time.process_time()
+        await broadcast(groups['each'], {'type': 'chat_message', **payload(i)}, 'chat_message')
+        cpu['each'] += time.process_time() - started
+
+        started = time.process_time()
+        await broadcast(groups['once'], frame(payload(i)), 'broadcast')
+        cpu['once'] += time.process_time() - started
+
+    return {strategy: total / broadcasts * 1e3 for strategy, total in cpu.items()}
+
+
+def run(args):
+    from core import frames
+
+    print(f'encoder: {"orjson" if frames.orjson is not None else "json"}')
+    print(f'{"sockets":>8} {"each ms":>10} {"once ms":>10} {"saved ms":>10} {"saved":>7}')
+
+    for size in args.sizes:
+        result = asyncio.run(measure(consumers(size), args.broadcasts))
+        each, once = result['each'], result['once']
+        print(f'{size:>8} {each:>10.3f} {once:>10.3f} {each - once:>10.3f} {(each - once) / each:>7.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--broadcasts', type=int, default=200)
+    args = parser.parse_args()
+
+    configure(migrate=False)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
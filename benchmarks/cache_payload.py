@@ -0,0 +1,123 @@
+"""
+Micro-benchmark for cache hits: the old jsonpickle entries against the
+pre-rendered payloads written by core.caching.
+
+    python -m benchmarks.cache_payload [--items 20 100 500] [--redis redis://localhost:6379/15]
+
+Without --redis, memory is the size of the pickled value RedisCache would
+store; with it, the entries are written to that Redis and `MEMORY USAGE` is
+reported as well.
+"""
+import argparse
+import pickle
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+
+
+def setup(redis_url):
+    if settings.configured:
+        return
+
+    location = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    if redis_url:
+        location = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': redis_url}
+
+    settings.configure(
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'rest_framework', 'core'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        AUTH_USER_MODEL='core.CustomUser',
+        SECRET_KEY='benchmark',
+        CACHES={'default': location},
+        USE_TZ=True,
+    )
+    django.setup()
+
+
+def sample_page(items):
+    now = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    results = [
+        {
+            'id': str(uuid.uuid4()),
+            'created_at': now,
+            'updated_at': now,
+            'title': f'Post number {i}',
+            'image': None,
+            'content': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 4,
+            'author': {'id': str(uuid.uuid4()), 'username': f'user{i}'},
+        }
+        for i in range(items)
+    ]
+    return {'next': 'http://testserver/api/posts/?cursor=eyJ0IjoiMjAyNiJ9', 'previous': None, 'results': results}
+
+
+def timeit(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples), sorted(samples)[int(rounds * 0.99) - 1]
+
+
+def run(items, rounds, redis_url):
+    import jsonpickle
+    from django.core.cache import cache
+    from rest_framework.renderers import JSONRenderer
+    from core.caching import dump_payload, load_payload
+    from core.redis_client import get_redis_connection
+
+    data = sample_page(items)
+    renderer = JSONRenderer()
+    rendered = renderer.render(data)
+
+    old_key, new_key = f'bench:old:{items}', f'bench:new:{items}'
+    cache.set(old_key, jsonpickle.dumps(data))
+    cache.set(new_key, dump_payload(rendered, renderer.media_type))
+
+    def old_hit():
+        renderer.render(jsonpickle.loads(cache.get(old_key)))
+
+    def new_hit():
+        load_payload(cache.get(new_key))
+
+    report = {'items': items, 'rendered_bytes': len(rendered)}
+    for name, func, key in (('jsonpickle', old_hit, old_key), ('payload', new_hit, new_key)):
+        median, p99 = timeit(func, rounds)
+        stored = len(pickle.dumps(cache.get(key), pickle.HIGHEST_PROTOCOL))
+        report[name] = {'median_us': round(median, 1), 'p99_us': round(p99, 1), 'stored_bytes': stored}
+
+        connection = get_redis_connection()
+        if connection is not None:
+            report[name]['redis_memory_usage'] = connection.memory_usage(cache.make_and_validate_key(key))
+
+    cache.delete_many([old_key, new_key])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[20, 100, 500])
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--redis', dest='redis_url')
+    args = parser.parse_args()
+
+    setup(args.redis_url)
+    for items in args.items:
+        report = run(items, args.rounds, args.redis_url)
+        old, new = report['jsonpickle'], report['payload']
+        print(
+            f"{items:>4} items ({report['rendered_bytes']} B rendered): "
+            f"hit {old['median_us']}us -> {new['median_us']}us median, "
+            f"{old['p99_us']}us -> {new['p99_us']}us p99; "
+            f"stored {old['stored_bytes']} B -> {new['stored_bytes']} B"
+            + (f"; redis {old['redis_memory_usage']} B -> {new['redis_memory_usage']} B" if 'redis_memory_usage' in new else '')
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+Load and latency benchmark for the REST endpoints and ChatConsumer fan-out.
+
+    python -m benchmarks.suite [--requests 300] [--ws-clients 50] [--output run.json] [--baseline baseline.json]
+
+Every REST scenario is driven in-process through the full Django/DRF stack
+with a JWT, and reports throughput, p50/p95/p99 latency, database queries per
+request and the hit ratio of cached responses (tag generation lookups are
+counted separately); with --l1-bytes the per-process tier is enabled and
+the hit ratios of both tiers are reported as well. The WebSocket scenario connects N clients to one chat
+through JWTAuthMiddleware and measures how long each message takes to reach
+every client.
+
+By default the run uses a throwaway SQLite file, LocMemCache and the
+in-memory channel layer; --database points it at a PostgreSQL database
+instead (the data is written there and left). With --baseline, each metric
+is compared with an earlier --output file and regressions beyond
+--tolerance are listed; --fail-on-regression turns them into exit code 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from unittest import mock
+
+from .common import configure, summarize
+
+TAG_KEY_PREFIXES = ('gen:', 'mod:')
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+HIGHER_IS_BETTER = ('throughput_rps', 'cache_hit_ratio', 'deliveries_per_s')
+
+
+class CacheCounter:
+    """Counts hits and misses on the default cache, split into response entries and tag lookups."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def _record(self, key, hit):
+        kind = 'tags' if str(key).startswith(TAG_KEY_PREFIXES) else 'entries'
+        self.counts[f'{kind}_{"hits" if hit else "misses"}'] += 1
+
+    @contextmanager
+    def installed(self):
+        from django.core.cache import caches
+        backend = caches['default']
+        get, get_many = backend.get, backend.get_many
+
+        nested = []
+
+        def counted_get(key, default=None, version=None):
+            value = get(key, default, version)
+            if not nested:
+                self._record(key, value is not default)
+            return value
+
+        # Some backends implement get_many with get; count those keys once.
+        def counted_get_many(keys, version=None):
+            keys = list(keys)
+            nested.append(True)
+            try:
+                found = get_many(keys, version)
+            finally:
+                nested.pop()
+            for key in keys:
+                self._record(key, key in found)
+            return found
+
+        with mock.patch.object(backend, 'get', counted_get), mock.patch.object(backend, 'get_many', counted_get_many):
+            yield self
+
+    def hit_ratio(self, kind='entries'):
+        total = self.counts[f'{kind}_hits'] + self.counts[f'{kind}_misses']
+        return round(self.counts[f'{kind}_hits'] / total, 3) if total else None
+
+
+class Workload:
+    def __init__(self, posts, comments, rng):
+        from rest_framework.test import APIClient
+        from rest_framework_simplejwt.tokens import AccessToken
+        from core.models import CustomUser, Post, Comment, PrivateChat
+
+        self.rng = rng
+        self.user = CustomUser.objects.create_user(username='bench', email='bench@example.com', password='secret')
+        self.peer = CustomUser.objects.create_user(username='peer', email='peer@example.com', password='secret')
+        authors = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'author{i}', email=f'author{i}@example.com', password='!') for i in range(50)]
+        )
+        self.posts = [
+            str(post.pk) for post in Post.objects.bulk_create(
+                [Post(title=f'Post {i}', content='Lorem ipsum dolor sit amet. ' * 8, author=rng.choice(authors)) for i in range(posts)]
+            )
+        ]
+        Comment.objects.bulk_create(
+            [Comment(post_id=pk, author=rng.choice(authors), texto='Nice post!') for pk in self.posts for _ in range(comments)]
+        )
+        self.chat = PrivateChat.objects.create(user1=self.user, user2=self.peer)
+        self.liked = set()
+
+        self.tokens = {user.pk: str(AccessToken.for_user(user)) for user in (self.user, self.peer)}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.tokens[self.user.pk]}')
+
+    def post(self):
+        return self.rng.choice(self.posts)
+
+    def like(self):
+        pk = self.post()
+        if pk in self.liked:
+            self.liked.discard(pk)
+            return 'delete', f'/api/posts/{pk}/like/', None
+        self.liked.add(pk)
+        return 'post', f'/api/posts/{pk}/like/', None
+
+
+# Reads run before writes so that the cached scenarios are measured warm.
+SCENARIOS = {
+    'post_list': lambda load: ('get', '/api/posts/', None),
+    'post_detail': lambda load: ('get', f'/api/posts/{load.post()}/', None),
+    'comment_list': lambda load: ('get', f'/api/posts/{load.post()}/comments/', None),
+    'comment_create': lambda load: ('post', f'/api/posts/{load.post()}/comments/', {'texto': 'benchmark comment'}),
+    'like_toggle': lambda load: load.like(),
+}
+
+
+def tier_hit_ratios(before, after):
+    """Hit ratio of each cache tier for cached responses, from two `metrics.registry.collect()` snapshots."""
+    counts = defaultdict(float)
+    for (name, labels, slot), value in after.items():
+        if name == 'cache_tier_requests_total' and labels[0] != 'tags':
+            counts[labels[1:]] += value - before.get((name, labels, slot), 0)
+
+    ratios = {}
+    for tier in ('l1', 'l2'):
+        total = counts[tier, 'hit'] + counts[tier, 'miss']
+        if total:
+            ratios[f'{tier}_hit_ratio'] = round(counts[tier, 'hit'] / total, 3)
+    return ratios
+
+
+def run_scenario(load, build, requests, warmup):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from core.metrics import registry
+
+    for _ in range(warmup):
+        method, url, data = build(load)
+        getattr(load.client, method)(url, data, format='json')
+
+    latencies, queries, errors = [], [], 0
+    counter = CacheCounter()
+    before = registry.collect()
+
+    with counter.installed():
+        started = time.perf_counter()
+        for _ in range(requests):
+            method, url, data = build(load)
+            with CaptureQueriesContext(connection) as captured:
+                begin = time.perf_counter()
+                response = getattr(load.client, method)(url, data, format='json')
+                latencies.append((time.perf_counter() - begin) * 1e3)
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / elapsed, 1),
+        **summarize(latencies),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+        'cache_hit_ratio': counter.hit_ratio(),
+        'tag_lookups_per_request': round((counter.counts['tags_hits'] + counter.counts['tags_misses']) / requests, 2),
+        **tier_hit_ratios(before, registry.collect()),
+    }
+
+
+async def run_websocket(load, clients, messages, interval):
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from core.authentication import JWTAuthMiddleware
+    from core.buffers import message_buffer
+    from core.routing import websocket_urlpatterns
+
+    application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+    participants = [load.user, load.peer]
+    communicators, connect_ms = [], []
+
+    for i in range(clients):
+        token = load.tokens[participants[i % 2].pk]
+        communicator = WebsocketCommunicator(
+            application, f'/ws/chat/{load.chat.pk}', headers=[(b'authorization', f'Bearer {token}'.encode())]
+        )
+        begin = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=10)
+        connect_ms.append((time.perf_counter() - begin) * 1e3)
+        if not connected:
+            raise RuntimeError('WebSocket connection was rejected')
+        communicators.append(communicator)
+
+    latencies = []
+
+    async def receive(communicator):
+        received = 0
+        while received < messages:
+            event = await communicator.receive_json_from(timeout=30)
+            if 'type' in event:
+                continue
+            latencies.append((time.perf_counter() - float(event['message'])) * 1e3)
+            received += 1
+
+    receivers = [asyncio.ensure_future(receive(communicator)) for communicator in communicators]
+    started = time.perf_counter()
+    for _ in range(messages):
+        await communicators[0].send_to(text_data=json.dumps({'message': repr(time.perf_counter())}))
+        await asyncio.sleep(interval)
+    await asyncio.gather(*receivers)
+    elapsed = time.perf_counter() - started
+
+    for communicator in communicators:
+        await communicator.disconnect()
+    await message_buffer.flush()
+
+    return {
+        'clients': clients,
+        'messages': messages,
+        'deliveries': len(latencies),
+        'deliveries_per_s': round(len(latencies) / elapsed, 1),
+        **summarize(latencies),
+        'connect': summarize(connect_ms),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Yield (section, name, metric, before, after, regressed) for every comparable metric."""
+    sections = [('rest', name) for name in results.get('rest', {})] + [('websocket', None)]
+
+    for section, name in sections:
+        current = results.get(section, {})
+        previous = baseline.get(section, {})
+        if name is not None:
+            current, previous = current.get(name, {}), previous.get(name, {})
+
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            before, after = previous.get(metric), current.get(metric)
+            if before is None or after is None:
+                continue
+            if metric == 'queries_per_request':
+                regressed = after > before
+            elif metric in LOWER_IS_BETTER:
+                regressed = after > before * (1 + tolerance)
+            else:
+                regressed = after < before * (1 - tolerance)
+            yield section, name, metric, before, after, regressed
+
+
+def run(args):
+    from django.db import connection
+
+    rng = random.Random(args.seed)
+    load = Workload(args.posts, args.comments, rng)
+
+    results = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'posts': args.posts,
+            'comments_per_post': args.comments,
+            'seed': args.seed,
+        },
+        'rest': {},
+    }
+
+    for name in args.scenarios:
+        results['rest'][name] = run_scenario(load, SCENARIOS[name], args.requests, args.warmup)
+
+    if args.ws_clients:
+        results['websocket'] = asyncio.run(run_websocket(load, args.ws_clients, args.ws_messages, args.ws_interval))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', dest='database_url', help='Database URL (defaults to a temporary SQLite file).')
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--comments', type=int, default=5, help='Comments per post.')
+    parser.add_argument('--requests', type=int, default=300, help='Measured requests per REST scenario.')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--ws-clients', type=int, default=50)
+    parser.add_argument('--ws-messages', type=int, default=100)
+    parser.add_argument('--ws-interval', type=float, default=0.002, help='Seconds between sent messages.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--l1-bytes', type=int, default=0, help='Size of the per-process cache tier (0 leaves it off).')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown before flagging.')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    # Consumers reach the database from worker threads, which an in-memory
+    # SQLite database would not share.
+    database_file = None
+    if args.database_url is None:
+        handle, database_file = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        args.database_url = f'sqlite:///{database_file}'
+
+    try:
+        configure(
+            args.database_url,
+            ROOT_URLCONF='benchmarks.urls',
+            ALLOWED_HOSTS=['*'],
+            MIDDLEWARE=['django.middleware.security.SecurityMiddleware', 'django.middleware.common.CommonMiddleware'],
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 100000}}},
+            CACHE_L1_MAX_BYTES=args.l1_bytes,
+        )
+        results = run(args)
+    finally:
+        if database_file:
+            os.unlink(database_file)
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            comparisons = list(compare(results, json.load(baseline), args.tolerance))
+
+        regressions = [row for row in comparisons if row[-1]]
+        for section, name, metric, before, after, regressed in comparisons:
+            label = f'{section}.{name}' if name else section
+            print(f"{'REGRESSION' if regressed else 'ok':>10}  {label:<26} {metric:<20} {before:>10} -> {after}")
+
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
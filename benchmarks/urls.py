@@ -0,0 +1,9 @@
+"""URLconf for the benchmarks: the API without the admin, plus the sync viewsets alone under sync/api/."""
+from django.urls import include, path
+
+from core.urls import router
+
+urlpatterns = [
+    path('api/', include('core.urls')),
+    path('sync/api/', include(router.urls)),
+]
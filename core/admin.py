@@ -31,7 +31,7 @@ class CustomUserAdmin(UserAdmin):
     ordering = ('username',)
 
 class PostAdmin(admin.ModelAdmin):
-    list_display = ('image_tag', 'title', 'content', 'author')
+    list_display = ('image_tag', 'title', 'content', 'author', 'image_status')
 
     def image_tag(self, obj):
         if obj.image:
@@ -0,0 +1,97 @@
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+
+class AsyncCache:
+    """
+    Non-blocking access to a Django cache alias for async views.
+
+    For RedisCache it talks to the same server through redis.asyncio, using
+    the backend's own key function and serializer, so entries are shared
+    with the sync code paths. With other backends each call runs the sync
+    method in a thread; Django's own async methods would take one thread
+    hop per key in `aget_many`.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _client(self):
+        # redis.asyncio connections belong to the loop that opened them.
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            import redis.asyncio
+            client = self._clients[loop] = redis.asyncio.Redis.from_url(self.backend._cache._servers[0])
+        return client
+
+    def _redis(self):
+        return isinstance(self.backend, RedisCache)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        if not self._redis():
+            return await sync_to_async(self.backend.get_many)(keys)
+
+        backend = self.backend
+        stored = await self._client().mget([backend.make_and_validate_key(key) for key in keys])
+        return {key: backend._cache._serializer.loads(value) for key, value in zip(keys, stored) if value is not None}
+
+    async def get(self, key, default=None):
+        return (await self.get_many([key])).get(key, default)
+
+    async def set(self, key, value, timeout):
+        if not self._redis():
+            return await sync_to_async(self.backend.set)(key, value, timeout=timeout)
+
+        backend = self.backend
+        timeout = backend.get_backend_timeout(timeout)
+        key = backend.make_and_validate_key(key)
+        if timeout == 0:
+            await self._client().delete(key)
+        else:
+            await self._client().set(key, backend._cache._serializer.dumps(value), ex=timeout)
+
+    async def set_many(self, data, timeout):
+        if not self._redis():
+            return await sync_to_async(self.backend.set_many)(data, timeout=timeout)
+
+        backend = self.backend
+        timeout = backend.get_backend_timeout(timeout)
+        async with self._client().pipeline(transaction=False) as pipe:
+            for key, value in data.items():
+                key = backend.make_and_validate_key(key)
+                if timeout == 0:
+                    pipe.delete(key)
+                else:
+                    pipe.set(key, backend._cache._serializer.dumps(value), ex=timeout)
+            await pipe.execute()
+
+    async def delete(self, key):
+        if not self._redis():
+            return await sync_to_async(self.backend.delete)(key)
+        return bool(await self._client().delete(self.backend.make_and_validate_key(key)))
+
+    async def add(self, key, value, timeout):
+        if not self._redis():
+            return await sync_to_async(self.backend.add)(key, value, timeout=timeout)
+
+        backend = self.backend
+        timeout = backend.get_backend_timeout(timeout)
+        return bool(await self._client().set(
+            backend.make_and_validate_key(key), backend._cache._serializer.dumps(value), ex=timeout, nx=True
+        ))
+
+
+async_cache = AsyncCache()
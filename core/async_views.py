@@ -0,0 +1,208 @@
+"""
+Native async versions of the busiest PostViewSet endpoints.
+
+DRF views are sync only, so under ASGI every request to them occupies a
+thread for its whole duration. These views run on the event loop and use
+the async ORM and `async_cache` for JSON requests authenticated with a
+bearer token (or anonymous, where the action allows it), going through
+the viewset's own permissions, exception handling and rendering. Anything
+else, e.g. the browsable API, other auth schemes, a missing post or
+methods without an async version here, is handed to the router's sync
+view.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from . import live
+from .authentication import get_user_for_token
+from .caching import tag_for, avalidators, acached_response, not_modified, set_validators
+from .models import Post, Comment, Likes
+from .pagination import ChronologicalKeysetPagination
+from .routers import fresh_reads
+from .serializers import CommentSerializer, LikesSerializer
+
+
+async def prepare(request, fallback, kwargs):
+    """
+    An instance of the fallback's viewset set up as DRF's dispatch would,
+    with the user authenticated; None when the request needs the sync view.
+    """
+    viewset = fallback.cls(**fallback.initkwargs)
+    viewset.action_map = fallback.actions
+    for method, action in fallback.actions.items():
+        setattr(viewset, method, getattr(viewset, action))
+    viewset.args, viewset.kwargs = (), kwargs
+
+    request = viewset.request = viewset.initialize_request(request, **kwargs)
+    viewset.headers = viewset.default_response_headers
+    viewset.format_kwarg = viewset.get_format_suffix(**kwargs)
+
+    try:
+        request.accepted_renderer, request.accepted_media_type = viewset.perform_content_negotiation(request)
+    except APIException:
+        return None
+    if request.accepted_renderer.format != 'json':
+        return None
+
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header.startswith('Bearer '):
+        user = await get_user_for_token(header[len('Bearer '):])
+        if not user.is_authenticated:
+            return None
+    elif header:
+        return None
+    else:
+        user = AnonymousUser()
+    request.user = user
+
+    if not all(permission.has_permission(request, viewset) for permission in viewset.get_permissions()):
+        return None
+    return viewset
+
+
+def native(fallback, **handlers):
+    """
+    A view answering with `handlers[method](viewset, request, **kwargs)`,
+    which returns None to hand the request over to the sync `fallback`.
+    """
+    async def view(request, **kwargs):
+        kwargs = {key: str(value) for key, value in kwargs.items()}
+        handler = handlers.get(request.method)
+        viewset = await prepare(request, fallback, kwargs) if handler is not None else None
+        response = None
+
+        if viewset is not None:
+            try:
+                response = await handler(viewset, viewset.request, **kwargs)
+            except APIException as exc:
+                response = viewset.handle_exception(exc)
+
+        if response is None:
+            return await sync_to_async(fallback)(request, **kwargs)
+
+        return viewset.finalize_response(viewset.request, response)
+
+    return csrf_exempt(view)
+
+
+async def get_post(viewset, request, pk):
+    post = await viewset.get_queryset().filter(pk=pk).afirst()
+    if post is not None:
+        viewset.check_object_permissions(request, post)
+    return post
+
+
+async def list_posts(viewset, request):
+    cache_key, etag, last_modified = await avalidators(viewset.get_cache_key(request), viewset.get_cache_tags(request))
+    response = not_modified(request, etag, last_modified)
+
+    if response is None:
+        async def build():
+            with fresh_reads(last_modified):
+                paginator = viewset.paginator
+                page = await paginator.apaginate_queryset(viewset.filter_queryset(viewset.get_queryset()), request, view=viewset)
+            return paginator.get_paginated_response(viewset.get_serializer(page, many=True).data)
+
+        response = await acached_response(cache_key, request, viewset, build, viewset.get_cache_policy())
+
+    return set_validators(response, etag, last_modified)
+
+
+async def retrieve_post(viewset, request, pk):
+    tags = [tag.format_map({'pk': pk}) for tag in viewset.get_object_cache_tags(request)]
+    _, etag, last_modified = await avalidators(f'object:{request.path}', tags)
+    response = not_modified(request, etag, last_modified)
+
+    if response is None:
+        post = await get_post(viewset, request, pk)
+        if post is None:
+            return None
+        response = Response(viewset.get_serializer(post).data)
+
+    return set_validators(response, etag, last_modified)
+
+
+async def list_comments(viewset, request, pk):
+    cache_key, etag, last_modified = await avalidators(viewset.get_cache_key(request), [tag_for(Post, pk)])
+    response = not_modified(request, etag, last_modified)
+
+    if response is None:
+        async def build():
+            with fresh_reads(last_modified):
+                post = await get_post(viewset, request, pk)
+                if post is None:
+                    return None
+                paginator = ChronologicalKeysetPagination()
+                comments = await paginator.apaginate_queryset(post.comments.all(), request, view=viewset)
+            return paginator.get_paginated_response(CommentSerializer(comments, many=True).data)
+
+        response = await acached_response(cache_key, request, viewset, build, viewset.get_cache_policy())
+        if response is None:
+            return None
+
+    return set_validators(response, etag, last_modified)
+
+
+async def create_comment(viewset, request, pk):
+    if not request.user.is_authenticated:
+        return None
+
+    post = await get_post(viewset, request, pk)
+    if post is None:
+        return None
+
+    serializer = CommentSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    comment = await Comment.objects.acreate(**serializer.validated_data, post=post, author=request.user)
+    data = CommentSerializer(comment).data
+    await sync_to_async(live.comment_created)(comment, data)
+    return Response(data, status=status.HTTP_201_CREATED)
+
+
+async def like_post(viewset, request, pk):
+    post = await get_post(viewset, request, pk)
+    if post is None:
+        return None
+
+    like, created = await Likes.objects.aget_or_create(post=post, user=request.user)
+    if not created:
+        return Response({'detail': 'Já curtido.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    await sync_to_async(live.likes_changed)([post.pk])
+    return Response(LikesSerializer(like).data, status=status.HTTP_201_CREATED)
+
+
+async def unlike_post(viewset, request, pk):
+    post = await get_post(viewset, request, pk)
+    if post is None:
+        return None
+
+    like = await Likes.objects.filter(post=post, user=request.user).afirst()
+    if like is None:
+        return Response({'detail': 'Like não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+
+    await like.adelete()
+    await sync_to_async(live.likes_changed)([post.pk])
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def urlpatterns(router):
+    """Async routes for `router`'s post endpoints, to be listed before its own urls."""
+    views = {url.name: url.callback for url in router.urls}
+    return [
+        path('posts/', native(views['post-list'], GET=list_posts), name='post-list'),
+        path('posts/<uuid:pk>/', native(views['post-detail'], GET=retrieve_post), name='post-detail'),
+        path(
+            'posts/<uuid:pk>/comments/',
+            native(views['post-comments'], GET=list_comments, POST=create_comment),
+            name='post-comments',
+        ),
+        path('posts/<uuid:pk>/like/', native(views['post-like'], POST=like_post, DELETE=unlike_post), name='post-like'),
+    ]
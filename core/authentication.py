@@ -0,0 +1,132 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .routers import retry_on_primary
+
+User = get_user_model()
+
+
+class UserCache:
+    """
+    Process-local LRU of authenticated users keyed by ``(user id, token jti)``.
+
+    Entries expire after a short TTL, which bounds how long another worker can
+    keep serving a user that was changed or deactivated elsewhere; in the
+    process that made the change, core.signals evicts the user immediately.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000)
+        self.ttl = ttl or getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+
+    def get(self, user_id, jti):
+        key = (str(user_id), jti)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+        return copy.copy(user)
+
+    def set(self, user_id, jti, user):
+        key = (str(user_id), jti)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.copy(user))
+            self._entries.move_to_end(key)
+            self._tokens_by_user.setdefault(key[0], set()).add(jti)
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            for jti in self._tokens_by_user.get(str(user_id), set()).copy():
+                self._evict((str(user_id), jti))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _evict(self, key):
+        self._entries.pop(key, None)
+        tokens = self._tokens_by_user.get(key[0])
+        if tokens is not None:
+            tokens.discard(key[1])
+            if not tokens:
+                del self._tokens_by_user[key[0]]
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """simplejwt authentication that serves the user from `user_cache`."""
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        user = user_cache.get(user_id, jti)
+
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, jti, user)
+
+        return user
+
+
+def _load_user(user_id):
+    return retry_on_primary(User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}, is_active=True).first)
+
+
+async def get_user_for_token(raw_token):
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return AnonymousUser()
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    jti = token.get(api_settings.JTI_CLAIM)
+    user = user_cache.get(user_id, jti)
+
+    if user is None:
+        user = await database_sync_to_async(_load_user)(user_id)
+        if user is None:
+            return AnonymousUser()
+        user_cache.set(user_id, jti, user)
+
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Sets ``scope['user']`` from an ``Authorization: Bearer <access token>`` header."""
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get('headers', []))
+        auth_header = headers.get(b'authorization', b'').decode()
+        scope = dict(scope)
+
+        if auth_header.startswith('Bearer '):
+            scope['user'] = await get_user_for_token(auth_header[len('Bearer '):])
+        else:
+            scope['user'] = AnonymousUser()
+
+        return await super().__call__(scope, receive, send)
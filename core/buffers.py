@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .caching import tag_for, invalidate_tags
+from .frames import frame
+from .metrics import MeasuredChannelLayer
+from .routers import mark_writers
+from .models import PrivateChat, Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Per-process write-behind buffer for chat messages.
+
+    Messages are broadcast as soon as they are received and persisted here in
+    micro-batches: a batch is written with one `bulk_create` once it reaches
+    `max_batch` messages or `max_delay` seconds after its first message,
+    whichever comes first.
+
+    Ordering: batches are flushed one at a time in arrival order, so messages
+    received by the same process are stored (and get `created_at` and `seq`)
+    in the order they were received. Messages for the same chat handled by
+    different processes are only ordered by their flush time; `seq` is the
+    authoritative per-chat order and is announced to the chat group with a
+    `sequenced` frame once a batch is stored. A crash can lose at most
+    the messages of the batch that was still waiting to be flushed.
+    """
+
+    def __init__(self, max_batch=None, max_delay=None):
+        self.max_batch = max_batch or getattr(settings, 'CHAT_BUFFER_MAX_BATCH', 100)
+        self.max_delay = max_delay or getattr(settings, 'CHAT_BUFFER_MAX_DELAY', 0.05)
+        self._pending = []
+        self._lock = None
+        self._timer = None
+
+    async def add(self, message):
+        self._pending.append(message)
+
+        if len(self._pending) >= self.max_batch:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_delay, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            batch, self._pending = self._pending, []
+            if batch:
+                stored = await database_sync_to_async(self._write)(batch)
+                await self._announce(stored)
+
+    @staticmethod
+    def _write(batch):
+        try:
+            with transaction.atomic():
+                Message.objects.allocate_sequences(batch)
+                Message.objects.bulk_create(batch)
+                PrivateChat.objects.record_last_messages(batch)
+        except DatabaseError:
+            # One bad row (e.g. its chat was deleted) must not drop the rest.
+            stored = []
+            for message in batch:
+                message.seq = None
+                try:
+                    message.save(force_insert=True)
+                    stored.append(message)
+                except DatabaseError:
+                    logger.exception('Dropped chat message %s', message.pk)
+            return stored
+
+        # bulk_create skips post_save, so bump the cache tags here.
+        invalidate_tags([tag_for(Message), *{tag_for(PrivateChat, message.chat_id) for message in batch}])
+        mark_writers({message.sender_id for message in batch})
+        return batch
+
+    @staticmethod
+    async def _announce(messages):
+        by_chat = defaultdict(list)
+        for message in messages:
+            by_chat[message.chat_id].append({'id': str(message.pk), 'seq': message.seq})
+
+        channel_layer = MeasuredChannelLayer(get_channel_layer())
+        for chat_id, sequenced in by_chat.items():
+            await channel_layer.group_send(f'chat_{chat_id}', frame({'type': 'sequenced', 'messages': sequenced}))
+
+
+message_buffer = MessageWriteBuffer()
@@ -0,0 +1,127 @@
+import uuid
+
+from django.db import connections, router, transaction
+from django.db.models import Exists, OuterRef
+
+from . import counters, feed, live
+from .caching import tag_for, invalidate_tags
+from .models import CustomUser, Post, Likes, Follow, SuggestedFollows
+
+# bulk_create and raw deletes skip model signals, so the functions below apply
+# the side effects of core.signals themselves, once per call.
+
+MAX_IDS = 100
+
+INVALID = 'invalid'
+FOUND, NOT_FOUND = 'found', 'not_found'
+LIKED, ALREADY_LIKED = 'liked', 'already_liked'
+UNLIKED, NOT_LIKED = 'unliked', 'not_liked'
+FOLLOWED, ALREADY_FOLLOWING, SELF = 'followed', 'already_following', 'self'
+UNFOLLOWED, NOT_FOLLOWING = 'unfollowed', 'not_following'
+
+
+def parse_ids(values):
+    """Split raw ids into unique UUIDs, in request order, and statuses for the invalid ones."""
+    ids, statuses = {}, {}
+    for value in values:
+        try:
+            ids.setdefault(uuid.UUID(str(value)), None)
+        except ValueError:
+            statuses[str(value)] = INVALID
+    return list(ids), statuses
+
+
+def _insert(objs, column):
+    """bulk_create `objs` skipping conflicts and return `column` of the rows that were actually inserted."""
+    if not objs:
+        return set()
+    model = type(objs[0])
+    model.objects.bulk_create(objs, ignore_conflicts=True)
+    # ignore_conflicts doesn't say which rows went in, but skipped rows never stored their pk.
+    return set(model.objects.filter(pk__in=[obj.pk for obj in objs]).values_list(column, flat=True))
+
+
+def _delete(queryset, column):
+    """Delete `queryset` with a single DELETE and return `column` of the removed rows."""
+    rows = list(queryset.select_for_update().values_list('pk', column))
+    if rows:
+        # QuerySet.delete() would load every row again to send its signals.
+        model = queryset.model
+        connection = connections[router.db_for_write(model)]
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} '
+                f'IN ({", ".join(["%s"] * len(rows))})',
+                [model._meta.pk.get_db_prep_value(pk, connection) for pk, _ in rows],
+            )
+    return [value for _, value in rows]
+
+
+def like(user, post_ids):
+    with transaction.atomic():
+        posts = dict(
+            Post.objects.filter(pk__in=post_ids)
+            .annotate(liked=Exists(Likes.objects.filter(user=user, post=OuterRef('pk'))))
+            .values_list('pk', 'liked')
+        )
+        inserted = _insert([Likes(user=user, post_id=pk) for pk in post_ids if posts.get(pk) is False], 'post_id')
+        new = [pk for pk in post_ids if pk in inserted]
+        counters.increment_many(new, counters.FIELDS[Likes], 1)
+        live.likes_changed(new)
+        transaction.on_commit(lambda: invalidate_tags([tag_for(Likes), *(tag_for(Post, pk) for pk in new)]))
+
+    return {
+        str(pk): NOT_FOUND if pk not in posts else LIKED if pk in inserted else ALREADY_LIKED
+        for pk in post_ids
+    }
+
+
+def unlike(user, post_ids):
+    with transaction.atomic():
+        removed = _delete(Likes.objects.filter(user=user, post_id__in=post_ids), 'post_id')
+        counters.increment_many(removed, counters.FIELDS[Likes], -1)
+        live.likes_changed(removed)
+        transaction.on_commit(lambda: invalidate_tags([tag_for(Likes), *(tag_for(Post, pk) for pk in removed)]))
+
+    removed = set(removed)
+    return {str(pk): UNLIKED if pk in removed else NOT_LIKED for pk in post_ids}
+
+
+def _follows_changed(user):
+    invalidate_tags([tag_for(Follow)])
+    feed.invalidate_home_timeline(user.pk)
+    SuggestedFollows.objects.mark_changed([user.pk])
+
+
+def follow(user, user_ids):
+    with transaction.atomic():
+        targets = dict(
+            CustomUser.objects.filter(pk__in=user_ids, is_active=True)
+            .annotate(is_followed=Exists(Follow.objects.filter(follower=user, followed=OuterRef('pk'))))
+            .values_list('pk', 'is_followed')
+        )
+        new = _insert(
+            [Follow(follower=user, followed_id=pk) for pk in user_ids if targets.get(pk) is False and pk != user.pk],
+            'followed_id',
+        )
+        if new:
+            transaction.on_commit(lambda: _follows_changed(user))
+
+    def status(pk):
+        if pk == user.pk:
+            return SELF
+        if pk not in targets:
+            return NOT_FOUND
+        return FOLLOWED if pk in new else ALREADY_FOLLOWING
+
+    return {str(pk): status(pk) for pk in user_ids}
+
+
+def unfollow(user, user_ids):
+    with transaction.atomic():
+        removed = set(_delete(Follow.objects.filter(follower=user, followed_id__in=user_ids), 'followed_id'))
+        if removed:
+            transaction.on_commit(lambda: _follows_changed(user))
+
+    return {str(pk): UNFOLLOWED if pk in removed else NOT_FOLLOWING for pk in user_ids}
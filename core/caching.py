@@ -0,0 +1,440 @@
+import asyncio
+import hashlib
+import math
+import random
+import time
+import zlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .async_cache import async_cache
+from .local_cache import local_cache
+from .metrics import record_cache_read, record_cache_write, record_tier_read, region_of
+from .routers import fresh_reads
+from .models import CustomUser, Post, Comment, Likes, Follow, PrivateChat, Message
+
+GENERATION_KEY = 'gen:{}'
+MODIFIED_KEY = 'mod:{}'
+LOCK_KEY = 'lock:{}'
+LOCK_POLL_INTERVAL = 0.05
+
+# Rows whose writes must also invalidate entries cached for their parent row,
+# e.g. a new comment changes what `post:<id>` endpoints return.
+PARENT_TAGS = {
+    CustomUser: lambda user: [],
+    Post: lambda post: [],
+    Comment: lambda comment: [tag_for(Post, comment.post_id)],
+    Likes: lambda like: [tag_for(Post, like.post_id)],
+    Follow: lambda follow: [],
+    PrivateChat: lambda chat: [],
+    Message: lambda message: [tag_for(PrivateChat, message.chat_id)],
+}
+TAGGED_MODELS = tuple(PARENT_TAGS)
+
+
+def tag_for(model, pk=None):
+    name = model._meta.model_name
+    return name if pk is None else f'{name}:{pk}'
+
+
+def tags_for_instance(instance):
+    model = type(instance)
+    return [tag_for(model), tag_for(model, instance.pk), *PARENT_TAGS[model](instance)]
+
+
+def tag_ttl():
+    """Seconds a tag's generation is kept; an expired one is reseeded like a tag seen for the first time."""
+    return getattr(settings, 'CACHE_TAG_TTL', 60 * 60 * 24 * 7)
+
+
+def _seed():
+    # Generations start from the clock so that a counter evicted from the cache
+    # never comes back with a value an older entry was stored under.
+    return time.time_ns()
+
+
+def get_tag_state(tags):
+    """
+    Current generation and last-modified time of each tag, in one round trip.
+
+    Modification times are Unix seconds; a tag seen for the first time counts
+    as modified now. They are None when the time was evicted.
+    """
+    keys = {tag: (GENERATION_KEY.format(tag), MODIFIED_KEY.format(tag)) for tag in tags}
+    stored, missing, epoch = _read_local([key for pair in keys.values() for key in pair])
+
+    if missing:
+        fetched = cache.get_many(missing)
+        record_tier_read('tags', 'l2', len(fetched) == len(missing))
+        for key, modified_key in _unseeded(keys, missing, fetched):
+            cache.add(modified_key, time.time(), timeout=tag_ttl())
+            cache.add(key, _seed(), timeout=tag_ttl())
+            fetched.update(cache.get_many([key, modified_key]))
+        stored.update(_fill_local(fetched, epoch))
+
+    return _split_tag_state(keys, stored)
+
+
+async def aget_tag_state(tags):
+    """`get_tag_state` through the async cache client."""
+    keys = {tag: (GENERATION_KEY.format(tag), MODIFIED_KEY.format(tag)) for tag in tags}
+    stored, missing, epoch = _read_local([key for pair in keys.values() for key in pair])
+
+    if missing:
+        fetched = await async_cache.get_many(missing)
+        record_tier_read('tags', 'l2', len(fetched) == len(missing))
+        for key, modified_key in _unseeded(keys, missing, fetched):
+            await async_cache.add(modified_key, time.time(), timeout=tag_ttl())
+            await async_cache.add(key, _seed(), timeout=tag_ttl())
+            fetched.update(await async_cache.get_many([key, modified_key]))
+        stored.update(_fill_local(fetched, epoch))
+
+    return _split_tag_state(keys, stored)
+
+
+def _read_local(keys):
+    """Tag state the local tier has, the keys left for the shared cache, and the epoch to fill them with."""
+    if not local_cache.enabled():
+        return {}, keys, None
+    epoch = local_cache.epoch
+    found = local_cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    record_tier_read('tags', 'l1', not missing)
+    return found, missing, epoch
+
+
+def _fill_local(fetched, epoch):
+    if epoch is not None:
+        local_cache.set_many(fetched, epoch)
+    return fetched
+
+
+def _unseeded(keys, missing, fetched):
+    missing = set(missing)
+    return [(key, modified_key) for key, modified_key in keys.values() if key in missing and key not in fetched]
+
+
+def _split_tag_state(keys, stored):
+    generations, modified = {}, {}
+    for tag, (key, modified_key) in keys.items():
+        generations[tag] = stored[key]
+        modified[tag] = stored.get(modified_key)
+    return generations, modified
+
+
+def get_generations(tags):
+    return get_tag_state(tags)[0]
+
+
+def versioned_key(key, tags):
+    return _versioned(key, tags, get_generations(tags))
+
+
+def _versioned(key, tags, generations):
+    return f"{key}#{'.'.join(str(generations[tag]) for tag in tags)}"
+
+
+def invalidate_tags(tags):
+    # The time goes first so a reader never pairs a new generation with an old
+    # Last-Modified, which could answer 304 for a changed response.
+    cache.set_many({MODIFIED_KEY.format(tag): time.time() for tag in tags}, timeout=tag_ttl())
+
+    for tag in tags:
+        key = GENERATION_KEY.format(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _seed(), timeout=tag_ttl())
+
+    local_cache.invalidate([key for tag in tags for key in (GENERATION_KEY.format(tag), MODIFIED_KEY.format(tag))])
+
+
+# Payloads are the final rendered bytes: one codec byte, the content type, a
+# newline, then the (possibly compressed) body.
+CODEC_RAW, CODEC_ZLIB, CODEC_ZSTD = b'0', b'z', b's'
+
+
+def compress_min_bytes():
+    return getattr(settings, 'CACHE_COMPRESS_MIN_BYTES', 1024)
+
+
+def dump_payload(content, content_type):
+    codec = CODEC_RAW
+
+    if len(content) >= compress_min_bytes():
+        if zstandard is not None:
+            codec, content = CODEC_ZSTD, zstandard.ZstdCompressor(level=3).compress(content)
+        else:
+            codec, content = CODEC_ZLIB, zlib.compress(content, 6)
+
+    return codec + content_type.encode('latin-1') + b'\n' + content
+
+
+def load_payload(payload):
+    codec, rest = payload[:1], payload[1:]
+    content_type, content = rest.split(b'\n', 1)
+
+    if codec == CODEC_ZSTD:
+        content = zstandard.ZstdDecompressor().decompress(content)
+    elif codec == CODEC_ZLIB:
+        content = zlib.decompress(content)
+
+    return content, content_type.decode('latin-1')
+
+
+def validators(key, tags):
+    """
+    The versioned cache key plus an ETag and Last-Modified time for it, derived
+    from the tags alone so that conditional requests skip the body entirely.
+    """
+    generations, modified = get_tag_state(tags)
+    versioned = _versioned(key, tags, generations)
+    return versioned, _etag(versioned), _last_modified(modified)
+
+
+async def avalidators(key, tags):
+    generations, modified = await aget_tag_state(tags)
+    versioned = _versioned(key, tags, generations)
+    return versioned, _etag(versioned), _last_modified(modified)
+
+
+def _etag(versioned):
+    return '"{}"'.format(hashlib.blake2b(versioned.encode(), digest_size=16).hexdigest())
+
+
+def _last_modified(modified):
+    times = list(modified.values())
+    return int(max(times)) if times and None not in times else None
+
+
+def not_modified(request, etag, last_modified):
+    """A 304 (or 412) response when the request's preconditions allow it, else None."""
+    return get_conditional_response(getattr(request, '_request', request), etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def is_cacheable(request):
+    renderer = getattr(request, 'accepted_renderer', None)
+    return request.method == 'GET' and renderer is not None and renderer.format == 'json'
+
+
+def render(request, view, data):
+    renderer = request.accepted_renderer
+    content = renderer.render(data, request.accepted_media_type, {'request': request, 'view': view})
+    content_type = renderer.media_type
+
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+
+    return content, content_type
+
+
+# How a cached response ages: fresh for `timeout` seconds, then served stale
+# for up to `grace` more while one worker rebuilds it. `early_refresh` scales
+# the probabilistic refresh before expiry; 0 turns it off.
+CachePolicy = namedtuple('CachePolicy', ['timeout', 'grace', 'early_refresh'])
+
+
+def stale_grace():
+    return getattr(settings, 'CACHE_STALE_GRACE', 60)
+
+
+def early_refresh():
+    return getattr(settings, 'CACHE_EARLY_REFRESH', 1.0)
+
+
+def lock_timeout():
+    """Seconds a rebuild may hold a key's lock, after which another worker may take over."""
+    return getattr(settings, 'CACHE_LOCK_TIMEOUT', 30)
+
+
+def lock_wait():
+    """Seconds a request without a cached entry waits for another worker's rebuild before doing its own."""
+    return getattr(settings, 'CACHE_LOCK_WAIT', 2)
+
+
+def is_due(entry, policy):
+    """
+    Whether an entry should be rebuilt: always once expired, and before that
+    with a probability that grows as expiry nears and with how long the entry
+    took to build (XFetch), so entries filled together don't expire together.
+    """
+    expires_at, cost, _ = entry
+    return time.time() - cost * policy.early_refresh * math.log(1 - random.random()) >= expires_at
+
+
+def _entry(payload, cost, policy):
+    expires_at = math.inf if policy.timeout is None else time.time() + policy.timeout
+    return expires_at, cost, payload
+
+
+def _entry_timeout(policy):
+    return None if policy.timeout is None else policy.timeout + policy.grace
+
+
+def _entry_response(entry):
+    content, content_type = load_payload(entry[2])
+    return HttpResponse(content, content_type=content_type)
+
+
+def _record_read(key, entry):
+    record_cache_read(key, None if entry is None else entry[2])
+
+
+def _local_entry(key, policy):
+    """A fresh entry for `key` from the local tier, if it has one."""
+    if not local_cache.enabled():
+        return None
+    entry = local_cache.get(key)
+    fresh = entry is not None and not is_due(entry, policy)
+    record_tier_read(region_of(key), 'l1', fresh)
+    return entry if fresh else None
+
+
+def _shared_entry(key, entry):
+    """Account for an entry read from the shared cache and keep a copy locally."""
+    record_tier_read(region_of(key), 'l2', entry is not None)
+    _keep_local(key, entry)
+    return entry
+
+
+def _keep_local(key, entry):
+    # Response keys are versioned, so no invalidation ever has to evict them.
+    if entry is not None and local_cache.enabled():
+        local_cache.set_many({key: entry})
+
+
+def _pack(request, view, response, started, policy):
+    """The entry to cache for a freshly built response, if it can be cached, and the response to send."""
+    if response is None or response.status_code != 200 or not isinstance(getattr(response, 'data', None), (list, dict)):
+        return None, response
+
+    content, content_type = render(request, view, response.data)
+    payload = dump_payload(content, content_type)
+    return _entry(payload, time.perf_counter() - started, policy), HttpResponse(content, content_type=content_type)
+
+
+def cached_response(key, request, view, build, policy):
+    """
+    The response cached under `key`, or the one `build()` returns when the
+    entry is missing or due; it is cached if it is a 200 with list or dict data.
+
+    Only the worker holding the key's lock rebuilds. The others serve the
+    entry they read, even stale, or when there is none (e.g. right after an
+    invalidation) wait for the rebuild for up to CACHE_LOCK_WAIT seconds.
+    """
+    entry = _local_entry(key, policy)
+    if entry is not None:
+        _record_read(key, entry)
+        return _entry_response(entry)
+
+    entry = _shared_entry(key, cache.get(key))
+    _record_read(key, entry)
+    if entry is not None and not is_due(entry, policy):
+        return _entry_response(entry)
+
+    lock = LOCK_KEY.format(key)
+    locked = cache.add(lock, 1, timeout=lock_timeout())
+    if not locked:
+        if entry is None:
+            deadline = time.monotonic() + lock_wait()
+            while entry is None and time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                entry = cache.get(key)
+        if entry is not None:
+            return _entry_response(entry)
+
+    try:
+        started = time.perf_counter()
+        entry, response = _pack(request, view, build(), started, policy)
+        if entry is not None:
+            cache.set(key, entry, timeout=_entry_timeout(policy))
+            _keep_local(key, entry)
+            record_cache_write(key, entry[2])
+        return response
+    finally:
+        if locked:
+            cache.delete(lock)
+
+
+async def acached_response(key, request, view, build, policy):
+    """`cached_response` through the async cache client, for an async `build`, which may return None."""
+    entry = _local_entry(key, policy)
+    if entry is not None:
+        _record_read(key, entry)
+        return _entry_response(entry)
+
+    entry = _shared_entry(key, await async_cache.get(key))
+    _record_read(key, entry)
+    if entry is not None and not is_due(entry, policy):
+        return _entry_response(entry)
+
+    lock = LOCK_KEY.format(key)
+    locked = await async_cache.add(lock, 1, timeout=lock_timeout())
+    if not locked:
+        if entry is None:
+            deadline = time.monotonic() + lock_wait()
+            while entry is None and time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                entry = await async_cache.get(key)
+        if entry is not None:
+            return _entry_response(entry)
+
+    try:
+        started = time.perf_counter()
+        entry, response = _pack(request, view, await build(), started, policy)
+        if entry is not None:
+            await async_cache.set(key, entry, timeout=_entry_timeout(policy))
+            _keep_local(key, entry)
+            record_cache_write(key, entry[2])
+        return response
+    finally:
+        if locked:
+            await async_cache.delete(lock)
+
+
+def cached_objects(request, view, entries, load, timeout):
+    """
+    Rendered bodies for many objects cached one entry each.
+
+    `entries` maps ids to their `(key, tags)`; `load(ids)` is called once
+    with the ids the cache missed and returns `{id: data}` for those that
+    exist. Returns `{id: rendered bytes}`.
+    """
+    generations, modified = get_tag_state({tag for _, tags in entries.values() for tag in tags})
+    keys = {pk: _versioned(key, tags, generations) for pk, (key, tags) in entries.items()}
+    stored = cache.get_many(keys.values())
+    for key in keys.values():
+        record_cache_read(key, stored.get(key))
+    found = {pk: load_payload(stored[key])[0] for pk, key in keys.items() if key in stored}
+
+    missed = [pk for pk in keys if pk not in found]
+    if missed:
+        with fresh_reads(_last_modified(modified)):
+            loaded = load(missed)
+
+        fresh = {}
+        for pk, data in loaded.items():
+            content, content_type = render(request, view, data)
+            fresh[keys[pk]] = dump_payload(content, content_type)
+            record_cache_write(keys[pk], fresh[keys[pk]])
+            found[pk] = content
+        cache.set_many(fresh, timeout=timeout)
+
+    return found
@@ -1,37 +1,36 @@
+import asyncio
 import json
+import time
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from .models import PrivateChat, Message
-from django.contrib.auth import get_user_model
+from django.conf import settings
+from .models import PrivateChat, Message, Post
+from .buffers import message_buffer
+from .metrics import MeasuredConsumerMixin
+from .frames import BroadcastMixin, dumps, loads, frame
+from .live import group_name
+from .routers import primary, retry_on_primary
+from . import presence
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from rest_framework_simplejwt.tokens import AccessToken
+from django.db.models import Q
 
-User = get_user_model()
+class ChatConsumer(MeasuredConsumerMixin, BroadcastMixin, AsyncJsonWebsocketConsumer):
 
-class ChatConsumer(AsyncJsonWebsocketConsumer):
-    
     async def connect(self):
         self.chat_id = self.scope['url_route']['kwargs']['chat_id']
         self.chat_room_group_name = f'chat_{self.chat_id}'
 
-        headers = dict(self.scope.get('headers', []))
-        auth_header = headers.get(b'authorization', b'').decode()
-        token = None
+        self.user = self.scope.get('user', AnonymousUser())
 
-        if auth_header.startswith('Bearer '):
-            token = auth_header[len('Bearer '):]
+        if not self.user.is_authenticated:
+            await self.close()
+            return
 
-        if token:
-            try:
-                access_token = AccessToken(token)
-                user_id = access_token['user_id']
-                self.user = await database_sync_to_async(User.objects.get)(id=user_id)
-            except Exception:
-                self.user = AnonymousUser()
-        else:
-            self.user = AnonymousUser()
+        self.chat = await self.get_chat()
 
-        if not self.user.is_authenticated:
+        if self.chat is None:
             await self.close()
             return
 
@@ -41,44 +40,215 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         )
         await self.accept()
 
+        self.last_typing = 0.0
+        self.pending_read = self.stored_read = 0
+        self.read_timer = None
+        await self.update_presence(online=True)
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+
+        since = parse_qs(self.scope.get('query_string', b'').decode()).get('since', [''])[0]
+        if since.isdigit():
+            await self.replay(int(since))
+
+    @database_sync_to_async
+    def get_chat(self):
+        return retry_on_primary(lambda: PrivateChat.objects.filter(
+            Q(user1=self.user) | Q(user2=self.user), id=self.chat_id
+        ).first())
+
+    @database_sync_to_async
+    def get_messages_after(self, seq, limit):
+        # Replay must include what was just flushed, so it can't lag behind.
+        with primary():
+            rows = list(
+                Message.objects.filter(chat_id=self.chat_id, seq__gt=seq)
+                .order_by('seq')
+                .values('id', 'seq', 'content', 'sender__username', 'created_at')[:limit]
+            )
+        return [
+            {
+                'id': str(row['id']),
+                'seq': row['seq'],
+                'message': row['content'],
+                'sender': row['sender__username'],
+                'created_at': row['created_at'].isoformat()
+            }
+            for row in rows
+        ]
+
+    async def replay(self, since):
+        """Send the messages after `since` in bounded batches before the live stream."""
+        await message_buffer.flush()
+
+        batch_size = getattr(settings, 'CHAT_REPLAY_BATCH', 200)
+        limit = getattr(settings, 'CHAT_REPLAY_LIMIT', 2000)
+        sent, complete = 0, True
+
+        while True:
+            messages = await self.get_messages_after(since, batch_size)
+
+            if messages:
+                await self.send(text_data=dumps({'type': 'replay', 'messages': messages}))
+                since = messages[-1]['seq']
+                sent += len(messages)
+
+            if len(messages) < batch_size:
+                break
+
+            if sent >= limit:
+                complete = False
+                break
+
+        await self.send(text_data=dumps({'type': 'replay_done', 'seq': since, 'complete': complete}))
+
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
             self.chat_room_group_name,
             self.channel_name
         )
 
+        if getattr(self, 'heartbeat_task', None) is not None:
+            self.heartbeat_task.cancel()
+            await self.update_presence(online=False)
+
+        if getattr(self, 'chat', None) is not None:
+            await message_buffer.flush()
+            await self.store_read()
+
+    async def heartbeat(self):
+        store = presence.get_store()
+        while True:
+            await asyncio.sleep(getattr(settings, 'PRESENCE_HEARTBEAT', 30))
+            await sync_to_async(store.touch, thread_sensitive=False)(self.user.pk, self.channel_name)
+
+    async def update_presence(self, online):
+        store = presence.get_store()
+
+        if online:
+            await sync_to_async(store.touch, thread_sensitive=False)(self.user.pk, self.channel_name)
+        else:
+            await sync_to_async(store.leave, thread_sensitive=False)(self.user.pk, self.channel_name)
+            # Another socket of the same user may still be open.
+            online = (await sync_to_async(store.online, thread_sensitive=False)([self.user.pk]))[str(self.user.pk)]
+
+        await self.channel_layer.group_send(
+            self.chat_room_group_name,
+            frame({
+                'type': 'presence',
+                'user': str(self.user.pk),
+                'username': self.user.username,
+                'online': online
+            })
+        )
+
+    async def typing(self):
+        now = time.monotonic()
+
+        if now - self.last_typing < getattr(settings, 'TYPING_INTERVAL', 3):
+            return
+
+        self.last_typing = now
+        await self.channel_layer.group_send(
+            self.chat_room_group_name,
+            frame({
+                'type': 'typing',
+                'sender': self.user.username
+            })
+        )
+
+    async def read(self, seq):
+        # A burst of read events becomes one write and one receipt.
+        self.pending_read = max(self.pending_read, seq)
+
+        if self.read_timer is None:
+            self.read_timer = asyncio.get_running_loop().call_later(
+                getattr(settings, 'READ_RECEIPT_DELAY', 1.0), lambda: asyncio.ensure_future(self.store_read())
+            )
+
+    async def store_read(self):
+        if self.read_timer is not None:
+            self.read_timer.cancel()
+            self.read_timer = None
+
+        seq = self.pending_read
+        if seq <= self.stored_read:
+            return
+
+        self.stored_read = seq
+        await database_sync_to_async(PrivateChat.objects.mark_read)(self.chat_id, self.user.pk, seq)
+        await self.channel_layer.group_send(
+            self.chat_room_group_name,
+            frame({
+                'type': 'read',
+                'user': str(self.user.pk),
+                'seq': seq
+            })
+        )
+
     async def receive(self, text_data):
         try:
-            text_data_json = json.loads(text_data)
+            text_data_json = loads(text_data)
+
+            if text_data_json.get('type') == 'typing':
+                await self.typing()
+                return
+
+            if text_data_json.get('type') == 'read':
+                await self.read(int(text_data_json['seq']))
+                return
+
             message_content = text_data_json['message']
 
-            chat = await database_sync_to_async(PrivateChat.objects.get)(id=self.chat_id)
-            message = Message(chat=chat, sender=self.user, content=message_content)
-            await database_sync_to_async(message.save)()
+            message = Message(chat=self.chat, sender=self.user, content=message_content)
 
             await self.channel_layer.group_send(
                 self.chat_room_group_name,
-                {
-                    'type': 'chat_message',
+                frame({
+                    'id': str(message.id),
                     'message': message_content,
                     'sender': self.user.username
-                }
+                })
             )
+            await message_buffer.add(message)
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'error': 'Invalid JSON'
             }))
         except KeyError:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'error': 'Message key not found'
             }))
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'error': str(e)
             }))
 
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'message': event['message'],
-            'sender': event['sender']
-        }))
\ No newline at end of file
+
+class PostConsumer(MeasuredConsumerMixin, BroadcastMixin, AsyncJsonWebsocketConsumer):
+    """
+    Read-only stream of a post's comment events and like counts, sent by
+    core.live; like counts arrive at most once per LIVE_COUNT_INTERVAL.
+    """
+
+    async def connect(self):
+        self.post_id = self.scope['url_route']['kwargs']['post_id']
+        self.user = self.scope.get('user', AnonymousUser())
+
+        if not self.user.is_authenticated or not await self.post_exists():
+            await self.close()
+            return
+
+        self.post_group_name = group_name(self.post_id)
+        await self.channel_layer.group_add(self.post_group_name, self.channel_name)
+        await self.accept()
+
+    @database_sync_to_async
+    def post_exists(self):
+        return retry_on_primary(Post.objects.filter(pk=self.post_id).exists)
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'post_group_name', None) is not None:
+            await self.channel_layer.group_discard(self.post_group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        pass
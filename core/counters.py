@@ -0,0 +1,150 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .caching import tag_for, invalidate_tags
+from .models import Post, Likes, Comment
+from .redis_client import get_redis_connection
+
+FIELDS = {Likes: 'like_count', Comment: 'comment_count'}
+BUFFER_KEY = 'counters:post:{}'
+FLUSH_BATCH = 500
+
+# Subtracts what was flushed instead of deleting the hash, so increments that
+# land while a flush is running are kept for the next one.
+SETTLE = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) == 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return 1
+"""
+
+
+def is_buffered():
+    return getattr(settings, 'POST_COUNTERS_BUFFERED', False)
+
+
+def increment(post_id, field, delta):
+    increment_many([post_id], field, delta)
+
+
+def increment_many(post_ids, field, delta):
+    """Apply the same `delta` to every post in `post_ids` with one statement (or one pipeline)."""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+
+    connection = get_redis_connection() if is_buffered() else None
+
+    if connection is None:
+        Post.objects.filter(pk__in=post_ids).update(**{field: Greatest(F(field) + delta, 0)})
+        return
+
+    def buffer():
+        pipe = connection.pipeline(transaction=False)
+        for post_id in post_ids:
+            pipe.hincrby(BUFFER_KEY.format(field), str(post_id), delta)
+        pipe.execute()
+
+    transaction.on_commit(buffer)
+
+
+def current(post_ids, field):
+    """`{post id: count}` for the posts that exist, including increments still buffered in Redis."""
+    counts = dict(Post.objects.filter(pk__in=list(post_ids)).values_list('pk', field))
+    connection = get_redis_connection() if is_buffered() else None
+
+    if connection is None or not counts:
+        return counts
+
+    pending = connection.hmget(BUFFER_KEY.format(field), [str(pk) for pk in counts])
+    return {pk: max(count + int(delta or 0), 0) for (pk, count), delta in zip(counts.items(), pending)}
+
+
+def flush():
+    """Apply buffered increments to Postgres; returns how many posts changed."""
+    connection = get_redis_connection()
+    if connection is None:
+        return 0
+
+    settle = connection.register_script(SETTLE)
+    flushed = set()
+
+    for field in FIELDS.values():
+        key = BUFFER_KEY.format(field)
+        pending = [(pk.decode(), int(delta)) for pk, delta in connection.hgetall(key).items() if int(delta)]
+
+        for start in range(0, len(pending), FLUSH_BATCH):
+            batch = pending[start:start + FLUSH_BATCH]
+            delta = Case(*[When(pk=pk, then=Value(value)) for pk, value in batch], default=Value(0))
+
+            with transaction.atomic():
+                Post.objects.filter(pk__in=[pk for pk, _ in batch]).update(**{field: Greatest(F(field) + delta, 0)})
+
+            settle(keys=[key], args=[item for pair in batch for item in pair])
+            flushed.update(pk for pk, _ in batch)
+
+    if flushed:
+        invalidate_tags([tag_for(Post), *(tag_for(Post, pk) for pk in flushed)])
+
+    return len(flushed)
+
+
+def pending_increments():
+    """`{field: {post id: delta}}` of the increments buffered in Redis and not flushed yet."""
+    connection = get_redis_connection() if is_buffered() else None
+    pending = {field: {} for field in FIELDS.values()}
+    if connection is None:
+        return pending
+
+    for field in FIELDS.values():
+        for pk, delta in connection.hgetall(BUFFER_KEY.format(field)).items():
+            if int(delta):
+                pending[field][pk.decode()] = int(delta)
+    return pending
+
+
+def reconcile(dry_run=False):
+    """
+    Recount likes and comments for drifted posts; returns the ids fixed.
+
+    A post has drifted when its column plus its buffered increments differs
+    from the real count. Repairing writes the real count to the column, so
+    those increments are settled first or the next flush would add them
+    again.
+    """
+    pending = pending_increments()
+    buffered = set().union(*pending.values())
+    in_sync = Q(like_count=F('actual_like_count'), comment_count=F('actual_comment_count'))
+    if buffered:
+        in_sync &= ~Q(pk__in=buffered)
+
+    drifted = (
+        Post.objects.with_actual_counts()
+        .exclude(in_sync)
+        .values_list('pk', 'like_count', 'actual_like_count', 'comment_count', 'actual_comment_count')
+    )
+    connection = get_redis_connection() if buffered else None
+    settle = connection.register_script(SETTLE) if connection is not None else None
+    repaired = []
+
+    for pk, like_count, actual_like_count, comment_count, actual_comment_count in drifted.iterator():
+        counts = {'like_count': (like_count, actual_like_count), 'comment_count': (comment_count, actual_comment_count)}
+        deltas = {field: pending[field].get(str(pk), 0) for field in counts}
+        if all(max(column + deltas[field], 0) == actual for field, (column, actual) in counts.items()):
+            continue
+
+        if not dry_run:
+            for field, delta in deltas.items():
+                if delta:
+                    settle(keys=[BUFFER_KEY.format(field)], args=[str(pk), delta])
+            Post.objects.filter(pk=pk).update(like_count=actual_like_count, comment_count=actual_comment_count)
+        repaired.append(pk)
+
+    if repaired and not dry_run:
+        invalidate_tags([tag_for(Post), *(tag_for(Post, pk) for pk in repaired)])
+
+    return repaired
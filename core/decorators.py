@@ -1,23 +1,46 @@
 from functools import wraps
-from django.core.cache import cache
-from rest_framework.response import Response
-import jsonpickle
+from rest_framework import status
+from .caching import is_cacheable, cached_response, validators, not_modified, set_validators
+from .routers import fresh_reads
+
+def cache_action(func=None, *, tags=None):
+    """
+    Cache the GET responses of a viewset action.
+
+    `tags` are templates such as ``'post:{pk}'`` filled from the URL kwargs and
+    query params; the entry is dropped as soon as any of those tags is bumped.
+    Responses carry an ETag and Last-Modified derived from the same tags, so
+    conditional requests are answered with 304 before the cache is read.
+    Expiry follows the viewset's `get_cache_policy()`.
+    """
+    if func is None:
+        return lambda func: cache_action(func, tags=tags)
 
-def cache_action(func):
     @wraps(func)
     def wrapper(viewset, request, *args, **kwargs):
-        cache_key = viewset.get_cache_key(request)
-        cache_data = cache.get(cache_key)
+        if not is_cacheable(request):
+            return func(viewset, request, *args, **kwargs)
+
+        if tags is None:
+            entry_tags = viewset.get_cache_tags(request)
+        else:
+            try:
+                entry_tags = [tag.format_map({**request.query_params.dict(), **kwargs}) for tag in tags]
+            except KeyError:
+                return func(viewset, request, *args, **kwargs)
+
+        cache_key, etag, last_modified = validators(viewset.get_cache_key(request), entry_tags)
+        response = not_modified(request, etag, last_modified)
 
-        if cache_data:
-            print(f'dados retornados do redis {cache_key}')
-            return Response(jsonpickle.loads(cache_data))
+        if response is not None:
+            return set_validators(response, etag, last_modified)
 
-        response = func(viewset, request, *args, **kwargs)
+        # The entry is shared, so it must not be filled from a lagging replica.
+        def build():
+            with fresh_reads(last_modified):
+                return func(viewset, request, *args, **kwargs)
 
-        if isinstance(response.data, (list, dict)):
-            cache.set(cache_key, jsonpickle.dumps(response.data), timeout=viewset.cache_timeout)
-        
-        return response
+        response = cached_response(cache_key, request, viewset, build, viewset.get_cache_policy())
+        return set_validators(response, etag, last_modified) if response.status_code == status.HTTP_200_OK else response
 
-    return wrapper
\ No newline at end of file
+    return wrapper
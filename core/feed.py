@@ -0,0 +1,255 @@
+import heapq
+import math
+import threading
+import uuid
+
+from django.conf import settings
+
+from .models import Follow, Post
+from .redis_client import get_redis_connection
+
+HOME_KEY = 'feed:home:{}'
+AUTHOR_KEY = 'feed:author:{}'
+CELEBRITIES_KEY = 'feed:celebrities'
+
+# Every materialized timeline holds this member at score 0 so that an empty
+# feed still exists and is not rebuilt from the database on every read.
+SENTINEL = '-'
+FANOUT_BATCH = 500
+
+PUSH_IF_EXISTS = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', key, ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', key, 1, -(tonumber(ARGV[3]) + 1))
+    end
+end
+return 1
+"""
+
+
+def feed_max_length():
+    return getattr(settings, 'FEED_MAX_LENGTH', 800)
+
+
+def feed_fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_LIMIT', 5000)
+
+
+def feed_ttl():
+    return getattr(settings, 'FEED_TTL', 60 * 60 * 24 * 7)
+
+
+class RedisTimelineStore:
+    """
+    Timelines kept as Redis sorted sets scored by post creation time.
+
+    `range` returns rows newest first, ties by member descending as Redis
+    orders them, with `before` as an inclusive bound.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._push_if_exists = connection.register_script(PUSH_IF_EXISTS)
+
+    def touch(self, key):
+        return bool(self.connection.expire(key, feed_ttl()))
+
+    def replace(self, key, entries):
+        pipe = self.connection.pipeline()
+        pipe.delete(key)
+        pipe.zadd(key, {SENTINEL: 0, **{member: score for member, score in entries}})
+        pipe.expire(key, feed_ttl())
+        pipe.execute()
+
+    def push(self, keys, member, score):
+        for start in range(0, len(keys), FANOUT_BATCH):
+            self._push_if_exists(keys=keys[start:start + FANOUT_BATCH], args=[score, member, feed_max_length()])
+
+    def range(self, keys, before, count):
+        upper = repr(before) if before is not None else '+inf'
+        pipe = self.connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrevrangebyscore(key, upper, '(0', start=0, num=count, withscores=True)
+        return [[(member.decode(), score) for member, score in rows] for rows in pipe.execute()]
+
+    def remove(self, key, member):
+        self.connection.zrem(key, member)
+
+    def delete(self, key):
+        self.connection.delete(key)
+
+    def celebrities(self):
+        return {member.decode() for member in self.connection.smembers(CELEBRITIES_KEY)}
+
+    def set_celebrity(self, author_id, is_celebrity):
+        if is_celebrity:
+            self.connection.sadd(CELEBRITIES_KEY, str(author_id))
+        else:
+            self.connection.srem(CELEBRITIES_KEY, str(author_id))
+
+
+class LocalTimelineStore:
+    """In-process stand-in for RedisTimelineStore, used when the cache is not Redis."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timelines = {}
+        self._celebrities = set()
+
+    def touch(self, key):
+        return key in self._timelines
+
+    def replace(self, key, entries):
+        with self._lock:
+            self._timelines[key] = dict(entries)
+
+    def push(self, keys, member, score):
+        with self._lock:
+            for key in keys:
+                timeline = self._timelines.get(key)
+                if timeline is None:
+                    continue
+                timeline[member] = score
+                for stale, _ in sorted(timeline.items(), key=lambda item: item[1])[:-feed_max_length()]:
+                    del timeline[stale]
+
+    def range(self, keys, before, count):
+        with self._lock:
+            result = []
+            for key in keys:
+                rows = sorted(self._timelines.get(key, {}).items(), key=lambda item: (item[1], item[0]), reverse=True)
+                rows = [row for row in rows if before is None or row[1] <= before]
+                result.append(rows[:count])
+            return result
+
+    def remove(self, key, member):
+        with self._lock:
+            self._timelines.get(key, {}).pop(member, None)
+
+    def delete(self, key):
+        with self._lock:
+            self._timelines.pop(key, None)
+
+    def celebrities(self):
+        return set(self._celebrities)
+
+    def set_celebrity(self, author_id, is_celebrity):
+        with self._lock:
+            if is_celebrity:
+                self._celebrities.add(str(author_id))
+            else:
+                self._celebrities.discard(str(author_id))
+
+
+_local_store = LocalTimelineStore()
+
+
+def get_store():
+    connection = get_redis_connection()
+    if connection is None:
+        return _local_store
+    return RedisTimelineStore(connection)
+
+
+def _entries(queryset):
+    rows = queryset.order_by('-created_at').values_list('id', 'created_at')[:feed_max_length()]
+    return [(str(pk), created_at.timestamp()) for pk, created_at in rows]
+
+
+def _ensure_author_timeline(store, author_id):
+    key = AUTHOR_KEY.format(author_id)
+    if not store.touch(key):
+        store.replace(key, _entries(Post.objects.filter(author_id=author_id)))
+    return key
+
+
+def _ensure_home_timeline(store, user_id, celebrities):
+    key = HOME_KEY.format(user_id)
+    if not store.touch(key):
+        posts = Post.objects.filter(author__followers__follower_id=user_id).exclude(author_id__in=celebrities)
+        store.replace(key, _entries(posts))
+    return key
+
+
+def encode_cursor(cursor):
+    score, member = cursor
+    return f'{score!r}:{member}'
+
+
+def decode_cursor(value):
+    """
+    The `(score, post id)` a feed page continues after. A bare score, as
+    older clients send, continues strictly before that time.
+    """
+    score, _, member = value.partition(':')
+    score = float(score)
+    if not math.isfinite(score):
+        raise ValueError(f'Invalid feed cursor: {value!r}')
+    return score, str(uuid.UUID(member)) if member else ''
+
+
+def _range_after(store, keys, cursor, count):
+    """Up to `count` rows of each timeline that sort after `cursor`."""
+    if cursor is None:
+        return store.range(keys, None, count)
+
+    score, member = cursor
+    fetch = count
+    while True:
+        rows = store.range(keys, score, fetch)
+        # The bound is inclusive so that posts sharing the cursor's time
+        # aren't skipped; the ones up to the cursor were already served.
+        pages = [[row for row in timeline if row[1] < score or row[0] < member] for timeline in rows]
+        if all(len(timeline) < fetch or len(page) >= count for timeline, page in zip(rows, pages)):
+            return pages
+        fetch *= 2
+
+
+def fan_out_post(post):
+    store = get_store()
+    member, score = str(post.pk), post.created_at.timestamp()
+    store.push([AUTHOR_KEY.format(post.author_id)], member, score)
+
+    limit = feed_fanout_limit()
+    followers = list(
+        Follow.objects.filter(followed_id=post.author_id).values_list('follower_id', flat=True)[:limit + 1]
+    )
+    is_celebrity = len(followers) > limit
+    store.set_celebrity(post.author_id, is_celebrity)
+
+    if not is_celebrity:
+        store.push([HOME_KEY.format(follower_id) for follower_id in followers], member, score)
+
+
+def remove_post(author_id, post_id):
+    get_store().remove(AUTHOR_KEY.format(author_id), str(post_id))
+
+
+def invalidate_home_timeline(user_id):
+    get_store().delete(HOME_KEY.format(user_id))
+
+
+def read_feed(user, before=None, count=20):
+    """Up to `count` posts of the user's feed after the `before` cursor, and the cursor of the next page."""
+    store = get_store()
+    celebrities = store.celebrities()
+    keys = [_ensure_home_timeline(store, user.pk, celebrities)]
+
+    if celebrities:
+        followed = Follow.objects.filter(follower=user, followed_id__in=celebrities).values_list('followed_id', flat=True)
+        keys += [_ensure_author_timeline(store, author_id) for author_id in followed]
+
+    merged = heapq.merge(*_range_after(store, keys, before, count), key=lambda row: (row[1], row[0]), reverse=True)
+    page, seen = [], set()
+    for member, score in merged:
+        if member not in seen:
+            seen.add(member)
+            page.append((member, score))
+        if len(page) == count:
+            break
+
+    posts = Post.objects.select_related('author').in_bulk([member for member, _ in page])
+    posts = {str(pk): post for pk, post in posts.items()}
+    next_before = (page[-1][1], page[-1][0]) if len(page) == count else None
+    return [posts[member] for member, _ in page if member in posts], next_before
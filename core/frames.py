@@ -0,0 +1,36 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def dumps(data):
+    """Compact JSON text, encoded with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return _encoder.encode(data)
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def frame(payload):
+    """
+    A channel layer event that carries `payload` as finished JSON text, so a
+    group broadcast is encoded once by the sender instead of once per socket.
+    Consumers with `BroadcastMixin` write the text as-is.
+    """
+    return {'type': 'broadcast', 'text': dumps(payload)}
+
+
+class BroadcastMixin:
+
+    async def broadcast(self, event):
+        await self.send(text_data=event['text'])
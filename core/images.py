@@ -0,0 +1,143 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': (320, 320),
+    'feed': (1080, 1350),
+    'full': (2048, 2048),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'progressive': True, 'optimize': True}),
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _flatten(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(data):
+    """Encode every rendition of one source image. Runs inside a pool process."""
+    with Image.open(BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        source.load()
+
+    has_alpha = source.mode in ('RGBA', 'LA', 'P')
+    renditions = {}
+
+    for name, size in RENDITIONS.items():
+        image = source.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        encoded = {'width': image.width, 'height': image.height}
+
+        for key, (pil_format, options) in FORMATS.items():
+            target = image.convert('RGBA' if has_alpha else 'RGB') if key == 'webp' else _flatten(image)
+            buffer = BytesIO()
+            target.save(buffer, format=pil_format, **options)
+            encoded[key] = buffer.getvalue()
+
+        renditions[name] = encoded
+
+    return renditions
+
+
+def _store(post, digest, renditions):
+    stored = {}
+
+    for name, encoded in renditions.items():
+        stored[name] = {'width': encoded['width'], 'height': encoded['height']}
+
+        for key, extension in EXTENSIONS.items():
+            path = f'renditions/{post.pk}/{digest[:16]}-{name}.{extension}'
+            if not default_storage.exists(path):
+                path = default_storage.save(path, ContentFile(encoded[key]))
+            stored[name][key] = path
+
+    return stored
+
+
+def _discard(old, new):
+    kept = {rendition.get(key) for rendition in new.values() for key in EXTENSIONS}
+
+    for rendition in old.values():
+        for key in EXTENSIONS:
+            if rendition.get(key) and rendition[key] not in kept:
+                default_storage.delete(rendition[key])
+
+
+def delete_files(renditions, original=None):
+    """Remove a post's rendition files and, when given, its original image from storage."""
+    _discard(renditions, {})
+    if original:
+        default_storage.delete(original)
+
+
+def process_pending(pool, batch_size=8):
+    """
+    Render one batch of posts waiting in the PROCESSING state.
+
+    The posts table is the queue: rows stay locked (SKIP LOCKED) while their
+    batch renders, so several workers can poll it and a crashed worker simply
+    leaves its rows for the next one.
+    """
+    with transaction.atomic():
+        posts = list(
+            Post.objects.select_for_update(skip_locked=True)
+            .filter(image_status=Post.IMAGE_PROCESSING)
+            .order_by('created_at')[:batch_size]
+        )
+        jobs = []
+
+        for post in posts:
+            try:
+                with post.image.open('rb') as image:
+                    data = image.read()
+            except (ValueError, OSError):
+                logger.exception('Could not read image for post %s', post.pk)
+                post.image_status = Post.IMAGE_FAILED
+                post.save(update_fields=['image_status'])
+                continue
+
+            digest = content_hash(data)
+            if digest == post.image_hash and post.image_renditions:
+                post.image_status = Post.IMAGE_READY
+                post.save(update_fields=['image_status'])
+                continue
+
+            jobs.append((post, digest, pool.submit(render, data)))
+
+        for post, digest, future in jobs:
+            try:
+                renditions = _store(post, digest, future.result())
+            except Exception:
+                logger.exception('Could not render image for post %s', post.pk)
+                post.image_status = Post.IMAGE_FAILED
+                post.save(update_fields=['image_status'])
+                continue
+
+            old, post.image_renditions = post.image_renditions, renditions
+            post.image_hash, post.image_status = digest, Post.IMAGE_READY
+            post.save(update_fields=['image_renditions', 'image_hash', 'image_status'])
+            transaction.on_commit(lambda old=old, new=renditions: _discard(old, new))
+
+    return len(posts)
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import counters
+from .frames import frame
+from .metrics import MeasuredChannelLayer
+from .models import Likes
+from .redis_client import get_redis_connection
+from .routers import primary
+
+logger = logging.getLogger(__name__)
+
+TICK_KEY = 'live:likes:tick:{}'
+
+
+def group_name(post_id):
+    return f'post_{post_id}'
+
+
+def count_interval():
+    return getattr(settings, 'LIVE_COUNT_INTERVAL', 0.25)
+
+
+async def _group_send_all(events):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    layer = MeasuredChannelLayer(layer)
+    for post_id, event in events:
+        await layer.group_send(group_name(post_id), event)
+
+
+def send(events):
+    async_to_sync(_group_send_all)(events)
+
+
+def publish(post_id, payload):
+    """
+    Send `payload` to the post's subscribers once the current transaction
+    commits. Best effort: the write has already committed, so a failure is
+    logged rather than failing the request.
+    """
+    event = frame(payload)
+
+    def deliver():
+        try:
+            send([(post_id, event)])
+        except Exception:
+            logger.exception('Could not publish %s to post %s', payload['type'], post_id)
+
+    transaction.on_commit(deliver)
+
+
+def comment_created(comment, data):
+    publish(comment.post_id, {'type': 'comment_created', 'post': str(comment.post_id), 'comment': data})
+
+
+def comment_updated(comment, data):
+    publish(comment.post_id, {'type': 'comment_updated', 'post': str(comment.post_id), 'comment': data})
+
+
+def comment_deleted(post_id, comment_id):
+    publish(post_id, {'type': 'comment_deleted', 'post': str(post_id), 'comment': str(comment_id)})
+
+
+class LikeCountCoalescer:
+    """
+    Turns bursts of likes into at most one `like_count` event per post per
+    `LIVE_COUNT_INTERVAL` (a falsy interval turns them off).
+
+    Posts whose likes changed are collected in memory and a daemon thread
+    sends their current counts every interval. With Redis, a post is only
+    sent by the process that claims its tick key for the interval, so other
+    workers keep theirs pending for the next tick instead of repeating it.
+    The count is read when sending, so the last event always has the final
+    value.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._thread = None
+
+    def touch(self, post_ids):
+        if not count_interval():
+            return
+        with self._lock:
+            self._pending.update(post_ids)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='live-like-counts', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(count_interval())
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not send like counts')
+            finally:
+                close_old_connections()
+
+    def _claim(self, post_ids):
+        connection = get_redis_connection()
+        if connection is None:
+            return post_ids
+
+        pipe = connection.pipeline(transaction=False)
+        for post_id in post_ids:
+            pipe.set(TICK_KEY.format(post_id), 1, nx=True, px=max(int(count_interval() * 1000), 1))
+        return [post_id for post_id, claimed in zip(post_ids, pipe.execute()) if claimed]
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = list(self._pending), set()
+        if not pending:
+            return 0
+
+        claimed = self._claim(pending)
+        deferred = set(pending) - set(claimed)
+        if deferred:
+            with self._lock:
+                self._pending.update(deferred)
+
+        if not claimed:
+            return 0
+
+        with primary():
+            counts = counters.current(claimed, counters.FIELDS[Likes])
+        send([
+            (post_id, frame({'type': 'like_count', 'post': str(post_id), 'like_count': count}))
+            for post_id, count in counts.items()
+        ])
+        return len(counts)
+
+
+like_counts = LikeCountCoalescer()
+
+
+def likes_changed(post_ids):
+    post_ids = list(post_ids)
+    if post_ids:
+        transaction.on_commit(lambda: like_counts.touch(post_ids))
@@ -0,0 +1,163 @@
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+
+def max_bytes():
+    """Budget of each process's local cache; 0 turns it off."""
+    return getattr(settings, 'CACHE_L1_MAX_BYTES', 0)
+
+
+def ttl():
+    """Seconds a local entry lives, which bounds staleness if an invalidation message is lost."""
+    return getattr(settings, 'CACHE_L1_TTL', 30)
+
+
+def sizeof(value):
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LocalCache:
+    """
+    Process-local LRU in front of the shared cache, bounded by the bytes of
+    its values and with a TTL.
+
+    Keys other processes invalidate arrive over Redis pub/sub, so with Redis
+    the cache is only used while subscribed. A fill passes the `epoch` taken
+    before the shared cache was read and is dropped when anything was
+    invalidated in between, so a value read just before an invalidation
+    can't outlive it here.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._epoch = 0
+        self._listener = None
+        self._subscribed = threading.Event()
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def enabled(self):
+        if max_bytes() <= 0:
+            return False
+        if self._listener is None:
+            self._start()
+        return self._subscribed.is_set()
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires, _, value = entry
+                if expires < now:
+                    self._evict(key)
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values, epoch=None):
+        """Store `values`; with an `epoch`, only if nothing was invalidated since it was taken."""
+        limit = max_bytes()
+        expires = time.monotonic() + ttl()
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+            for key, value in values.items():
+                if key in self._entries:
+                    self._evict(key)
+                size = sizeof(value)
+                if size <= limit:
+                    self._entries[key] = (expires, size, value)
+                    self._bytes += size
+            while self._bytes > limit:
+                self._evict(next(iter(self._entries)))
+
+    def delete_many(self, keys):
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if key in self._entries:
+                    self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def invalidate(self, keys):
+        """Evict `keys` here and, through pub/sub, in every other process."""
+        self.delete_many(keys)
+        connection = get_redis_connection()
+        if connection is not None and max_bytes() > 0:
+            connection.publish(INVALIDATION_CHANNEL, json.dumps(list(keys)))
+
+    def _evict(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def _start(self):
+        # Started on first use, so forked workers each get their own thread.
+        with self._lock:
+            if self._listener is not None:
+                return
+            if get_redis_connection() is None:
+                # Nothing is shared with other processes, so nothing to hear.
+                self._listener = False
+                self._subscribed.set()
+                return
+            self._listener = threading.Thread(target=self._listen, name='cache-invalidation', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis_connection().pubsub()
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    self.handle(message)
+            except Exception:
+                logger.exception('Cache invalidation subscription lost')
+            self._subscribed.clear()
+            time.sleep(1)
+
+    def handle(self, message):
+        if message['type'] == 'subscribe':
+            # Invalidations published while unsubscribed are lost.
+            self.clear()
+            self._subscribed.set()
+        elif message['type'] == 'message':
+            self.delete_many(json.loads(message['data']))
+
+
+local_cache = LocalCache()
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import suggestions
+
+
+class Command(BaseCommand):
+    help = 'Compute friends-of-friends follow suggestions from the Follow graph and store them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true', help='Only recompute users whose follows changed.')
+        parser.add_argument('--top', type=int, default=None, help='Suggestions kept per user.')
+        parser.add_argument('--budget', type=int, default=None, help='Max matrix entries computed per batch.')
+        parser.add_argument('--interval', type=float, default=None, help='Keep running, refreshing stale users every N seconds.')
+
+    def handle(self, *args, **options):
+        stale_only = options['stale']
+
+        while True:
+            started = time.monotonic()
+            written = suggestions.refresh(stale_only=stale_only, top=options['top'], budget=options['budget'])
+            self.stdout.write(f'Stored suggestions for {written} users in {time.monotonic() - started:.1f}s.')
+
+            if options['interval'] is None:
+                return
+
+            stale_only = True
+            time.sleep(options['interval'])
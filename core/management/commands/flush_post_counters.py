@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import counters
+
+
+class Command(BaseCommand):
+    help = 'Flush like/comment increments buffered in Redis to the Post counter columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between flushes.')
+        parser.add_argument('--once', action='store_true', help='Flush once and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = counters.flush()
+            if flushed:
+                self.stdout.write(f'Flushed counters for {flushed} posts.')
+
+            if options['once']:
+                return
+
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core import images
+
+
+class Command(BaseCommand):
+    help = 'Render thumbnail, feed and full-size WebP/JPEG renditions for posts waiting on image processing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Pool processes (defaults to the CPU count).')
+        parser.add_argument('--batch', type=int, default=8, help='Posts claimed per batch.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit.')
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                processed = images.process_pending(pool, batch_size=options['batch'])
+                if processed:
+                    self.stdout.write(f'Processed {processed} posts.')
+                    continue
+
+                if options['once']:
+                    return
+
+                time.sleep(options['interval'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core import counters
+
+
+class Command(BaseCommand):
+    help = 'Recount likes and comments and repair Post counter columns that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted posts without fixing them.')
+
+    def handle(self, *args, **options):
+        repaired = counters.reconcile(dry_run=options['dry_run'])
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(f'{verb} {len(repaired)} drifted posts.')
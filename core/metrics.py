@@ -0,0 +1,253 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from .redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'metrics'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def flush_interval():
+    return getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+
+class Registry:
+    """
+    Process-local counters and histograms, aggregated across processes in Redis.
+
+    Recording a sample only touches a dict under a lock. When the cache is
+    Redis, a daemon thread adds each process's deltas to one hash every
+    `METRICS_FLUSH_INTERVAL` seconds with HINCRBYFLOAT, so every worker's
+    `/metrics` shows the totals of all of them, at most one interval late.
+    Otherwise the process's own values are rendered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._values = defaultdict(float)
+        self._flusher = None
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add(self, samples):
+        """Add `((name, labels, slot), amount)` pairs; the slot is a bucket index, 'sum' or None."""
+        with self._lock:
+            for key, amount in samples:
+                self._values[key] += amount
+
+        if self._flusher is None:
+            self._start()
+
+    def _start(self):
+        # Started on first use, so forked workers each get their own thread.
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = False
+            if get_redis_connection() is not None:
+                self._flusher = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(flush_interval())
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            values, self._values = self._values, defaultdict(float)
+        return values
+
+    def flush(self, connection=None):
+        connection = connection or get_redis_connection()
+        if connection is None:
+            return
+
+        values = self._take()
+        if not values:
+            return
+
+        pipe = connection.pipeline(transaction=False)
+        for key, amount in values.items():
+            pipe.hincrbyfloat(METRICS_KEY, json.dumps(key), amount)
+        try:
+            pipe.execute()
+        except Exception:
+            logger.exception('Could not flush metrics')
+            self.add(values.items())
+
+    def collect(self, connection=None):
+        """Current `{(name, labels, slot): value}` across processes when aggregated, else of this process."""
+        connection = connection or get_redis_connection()
+        if connection is None:
+            with self._lock:
+                return dict(self._values)
+
+        self.flush(connection)
+        values = {}
+        for field, value in connection.hgetall(METRICS_KEY).items():
+            name, labels, slot = json.loads(field)
+            values[name, tuple(labels), slot] = float(value)
+        return values
+
+    def render(self, connection=None):
+        samples = defaultdict(dict)
+        for (name, labels, slot), value in self.collect(connection).items():
+            samples[name].setdefault(labels, {})[slot] = value
+
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labels, slots in sorted(samples.get(name, {}).items()):
+                lines.extend(metric.lines(labels, slots))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(int(value)) if value == int(value) else repr(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        registry.add([((self.name, labels, None), amount)])
+
+    def lines(self, labels, slots):
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(slots.get(None, 0))}']
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        # One bucket per sample; they are made cumulative when rendered.
+        registry.add([
+            ((self.name, labels, bisect_left(self.buckets, value)), 1),
+            ((self.name, labels, 'sum'), value),
+        ])
+
+    def lines(self, labels, slots):
+        lines, total = [], 0
+        for index, bound in enumerate([*self.buckets, '+Inf']):
+            total += slots.get(index, 0)
+            bucket_labels = _format_labels(self.labelnames, labels, [('le', bound)])
+            lines.append(f'{self.name}_bucket{bucket_labels} {_format_value(total)}')
+        label_text = _format_labels(self.labelnames, labels)
+        lines.append(f'{self.name}_sum{label_text} {_format_value(slots.get("sum", 0))}')
+        lines.append(f'{self.name}_count{label_text} {_format_value(total)}')
+        return lines
+
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ['view', 'method', 'status']
+)
+db_queries = Counter('db_queries_total', 'SQL queries run while handling HTTP requests.', ['view'])
+db_query_duration = Counter('db_query_seconds_total', 'Time spent in SQL queries while handling HTTP requests.', ['view'])
+cache_requests = Counter('cache_requests_total', 'Cached response lookups.', ['region', 'result'])
+cache_bytes = Counter('cache_bytes_total', 'Bytes of cached responses read and written.', ['region', 'operation'])
+cache_tier_requests = Counter(
+    'cache_tier_requests_total', 'Lookups in each cache tier; l2 only sees what l1 missed.', ['region', 'tier', 'result']
+)
+ws_connections = Counter('ws_connections_total', 'WebSocket connections accepted.', ['consumer'])
+ws_disconnections = Counter('ws_disconnections_total', 'WebSocket connections closed.', ['consumer'])
+ws_frames = Counter('ws_frames_total', 'WebSocket frames received and sent.', ['consumer', 'direction'])
+ws_handler_duration = Histogram(
+    'ws_handler_duration_seconds', 'Time consumers spend handling each event.', ['consumer', 'event']
+)
+channel_layer_send_duration = Histogram(
+    'channel_layer_send_duration_seconds', 'Latency of channel layer sends.', ['method']
+)
+
+
+def region_of(key):
+    return key.split(':', 1)[0]
+
+
+def record_cache_read(key, payload):
+    region = region_of(key)
+    if payload is None:
+        cache_requests.inc(region, 'miss')
+    else:
+        cache_requests.inc(region, 'hit')
+        cache_bytes.inc(region, 'read', amount=len(payload))
+
+
+def record_tier_read(region, tier, hit):
+    cache_tier_requests.inc(region, tier, 'hit' if hit else 'miss')
+
+
+def record_cache_write(key, payload):
+    cache_bytes.inc(region_of(key), 'write', amount=len(payload))
+
+
+class MeasuredChannelLayer:
+    """Channel layer proxy that times `send` and `group_send`."""
+
+    def __init__(self, layer):
+        self._layer = layer
+
+    def __getattr__(self, name):
+        return getattr(self._layer, name)
+
+    async def send(self, channel, message):
+        started = time.perf_counter()
+        try:
+            return await self._layer.send(channel, message)
+        finally:
+            channel_layer_send_duration.observe(time.perf_counter() - started, 'send')
+
+    async def group_send(self, group, message):
+        started = time.perf_counter()
+        try:
+            return await self._layer.group_send(group, message)
+        finally:
+            channel_layer_send_duration.observe(time.perf_counter() - started, 'group_send')
+
+
+class MeasuredConsumerMixin:
+    """Times every event a consumer handles and its channel layer sends."""
+
+    async def dispatch(self, message):
+        # The layer is attached in __call__, before the first event arrives.
+        if self.channel_layer is not None and not isinstance(self.channel_layer, MeasuredChannelLayer):
+            self.channel_layer = MeasuredChannelLayer(self.channel_layer)
+
+        started = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            ws_handler_duration.observe(time.perf_counter() - started, type(self).__name__, message['type'])
@@ -0,0 +1,199 @@
+import time
+from contextlib import ExitStack, nullcontext
+
+import jwt
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.settings import api_settings
+
+from . import metrics, routers
+
+PRIMARY_COOKIE = 'primary_until'
+
+
+class QueryTimer:
+    """`connection.execute_wrapper` hook that counts queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """Records the latency of each request and the SQL it ran, labelled by URL name."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with self.time_queries(queries):
+            response = self.get_response(request)
+        self.record(request, response, started, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryTimer()
+        started = time.perf_counter()
+        # The ORM calls of the request, async views included, run in its
+        # sync thread, so that is where the wrappers have to be installed.
+        stack = await sync_to_async(self.time_queries)(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, started, queries)
+        return response
+
+    def time_queries(self, queries):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(queries))
+        return stack
+
+    def record(self, request, response, started, queries):
+        view = view_name(request)
+        metrics.http_request_duration.observe(time.perf_counter() - started, view, request.method, response.status_code)
+        if queries.count:
+            metrics.db_queries.inc(view, amount=queries.count)
+            metrics.db_query_duration.inc(view, amount=queries.duration)
+
+
+def bearer_user_id(request):
+    # Not verified: the id only picks a database, so a forged token can at
+    # most send its own reads to the primary. Authentication happens later.
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        return jwt.decode(header[len('Bearer '):], options={'verify_signature': False}).get(api_settings.USER_ID_CLAIM)
+    except jwt.PyJWTError:
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Reads of safe-method requests go to the replicas, except for clients
+    that wrote in the last READ_YOUR_WRITES_WINDOW seconds: a write sets a
+    cookie and, for API clients that don't keep cookies, a per-user marker
+    in the cache that is looked up through the bearer token.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not routers.replicas():
+            return self.get_response(request)
+
+        writing = request.method not in SAFE_METHODS
+        if writing or self.has_fresh_cookie(request):
+            recent = True
+        else:
+            user_id = bearer_user_id(request)
+            recent = user_id is not None and routers.is_recent_writer(user_id)
+
+        with routers.primary() if recent else nullcontext():
+            response = self.get_response(request)
+
+        if writing:
+            user_id = self.remember_write(request, response)
+            if user_id is not None:
+                routers.mark_writers([user_id])
+        return response
+
+    async def __acall__(self, request):
+        if not routers.replicas():
+            return await self.get_response(request)
+
+        writing = request.method not in SAFE_METHODS
+        if writing or self.has_fresh_cookie(request):
+            recent = True
+        else:
+            user_id = bearer_user_id(request)
+            recent = user_id is not None and await routers.ais_recent_writer(user_id)
+
+        with routers.primary() if recent else nullcontext():
+            response = await self.get_response(request)
+
+        if writing:
+            user_id = self.remember_write(request, response)
+            if user_id is not None:
+                await routers.amark_writers([user_id])
+        return response
+
+    def has_fresh_cookie(self, request):
+        try:
+            return float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def remember_write(self, request, response):
+        """Set the cookie; returns the id of the user to mark as a writer, if any."""
+        response.set_cookie(
+            PRIMARY_COOKIE, str(time.time() + routers.window()), max_age=routers.window(), httponly=True, samesite='Lax'
+        )
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.pk
+        return None
+
+
+class WebSocketMetricsMiddleware:
+    """ASGI wrapper around a consumer that counts its connections and frames."""
+
+    def __init__(self, inner, name=None):
+        self.inner = inner
+        self.name = name or getattr(inner, 'consumer_class', type(inner)).__name__
+
+    async def __call__(self, scope, receive, send):
+        accepted = False
+
+        async def measured_receive():
+            message = await receive()
+            if message['type'] == 'websocket.receive':
+                metrics.ws_frames.inc(self.name, 'in')
+            return message
+
+        async def measured_send(message):
+            nonlocal accepted
+            if message['type'] == 'websocket.send':
+                metrics.ws_frames.inc(self.name, 'out')
+            elif message['type'] == 'websocket.accept':
+                accepted = True
+                metrics.ws_connections.inc(self.name)
+            await send(message)
+
+        try:
+            return await self.inner(scope, measured_receive, measured_send)
+        finally:
+            if accepted:
+                metrics.ws_disconnections.inc(self.name)
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+def queue_existing_images(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Post.objects.exclude(image='').exclude(image=None).update(image_status='processing')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_post_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_status',
+            field=models.CharField(blank=True, choices=[('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, max_length=20),
+        ),
+        migrations.RunPython(queue_existing_images, migrations.RunPython.noop),
+    ]
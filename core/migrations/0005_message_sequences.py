@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+def number_existing_messages(apps, schema_editor):
+    PrivateChat = apps.get_model('core', 'PrivateChat')
+    Message = apps.get_model('core', 'Message')
+
+    for chat in PrivateChat.objects.iterator():
+        messages = list(Message.objects.filter(chat=chat).order_by('created_at', 'id'))
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+        Message.objects.bulk_update(messages, ['seq'], batch_size=1000)
+        PrivateChat.objects.filter(pk=chat.pk).update(last_seq=len(messages))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='privatechat',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(number_existing_messages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('chat', 'seq'), name='message_chat_seq_uniq'),
+        ),
+    ]
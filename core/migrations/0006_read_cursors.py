@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+def mark_history_read(apps, schema_editor):
+    PrivateChat = apps.get_model('core', 'PrivateChat')
+    PrivateChat.objects.update(user1_last_read_seq=models.F('last_seq'), user2_last_read_seq=models.F('last_seq'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_message_sequences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privatechat',
+            name='user1_last_read_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='privatechat',
+            name='user2_last_read_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_history_read, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_last_message(apps, schema_editor):
+    PrivateChat = apps.get_model('core', 'PrivateChat')
+    Message = apps.get_model('core', 'Message')
+
+    for chat in PrivateChat.objects.all().iterator():
+        message = Message.objects.filter(chat=chat).order_by('-seq').first()
+        chat.last_message = message
+        chat.last_message_at = message.created_at if message else chat.created_at
+        chat.save(update_fields=['last_message', 'last_message_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_read_cursors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privatechat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.message'),
+        ),
+        migrations.AddField(
+            model_name='privatechat',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='privatechat',
+            index=models.Index(fields=['user1', 'last_message_at', 'id'], name='chat_user1_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='privatechat',
+            index=models.Index(fields=['user2', 'last_message_at', 'id'], name='chat_user2_activity_idx'),
+        ),
+    ]
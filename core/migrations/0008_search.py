@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The stored vectors are kept current by triggers, so writes through the ORM
+# (and bulk_create) never need to compute them. Queryset.update() calls that
+# do not touch the indexed columns, like the counter updates, skip them.
+CREATE_SQL = [
+    """
+    CREATE FUNCTION core_post_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.content, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER core_post_search_vector BEFORE INSERT OR UPDATE OF title, content ON core_post
+    FOR EACH ROW EXECUTE FUNCTION core_post_search_vector()
+    """,
+    """
+    CREATE FUNCTION core_comment_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('simple', coalesce(NEW.texto, ''));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER core_comment_search_vector BEFORE INSERT OR UPDATE OF texto ON core_comment
+    FOR EACH ROW EXECUTE FUNCTION core_comment_search_vector()
+    """,
+    "UPDATE core_post SET title = title",
+    "UPDATE core_comment SET texto = texto",
+    "CREATE INDEX post_search_vector_idx ON core_post USING gin (search_vector)",
+    "CREATE INDEX comment_search_vector_idx ON core_comment USING gin (search_vector)",
+    "CREATE INDEX customuser_username_trgm_idx ON core_customuser USING gin (username gin_trgm_ops)",
+    # istartswith compiles to UPPER(username) LIKE UPPER('q%').
+    "CREATE INDEX customuser_username_upper_trgm_idx ON core_customuser USING gin (upper(username) gin_trgm_ops)",
+]
+
+DROP_SQL = [
+    "DROP INDEX IF EXISTS customuser_username_upper_trgm_idx",
+    "DROP INDEX IF EXISTS customuser_username_trgm_idx",
+    "DROP INDEX IF EXISTS comment_search_vector_idx",
+    "DROP INDEX IF EXISTS post_search_vector_idx",
+    "DROP TRIGGER IF EXISTS core_comment_search_vector ON core_comment",
+    "DROP FUNCTION IF EXISTS core_comment_search_vector()",
+    "DROP TRIGGER IF EXISTS core_post_search_vector ON core_post",
+    "DROP FUNCTION IF EXISTS core_post_search_vector()",
+]
+
+
+def run_on_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_inbox'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_on_postgres(CREATE_SQL), run_on_postgres(DROP_SQL)),
+    ]
@@ -1,45 +1,81 @@
-from django.core.cache import cache
 from rest_framework.response import Response
+from .caching import tag_for, invalidate_tags, is_cacheable, cached_response, validators, not_modified, set_validators, CachePolicy, stale_grace, early_refresh
+from .routers import fresh_reads
 
 class CacheMixin:
-    cache_timeout = 60 * 60  
+    cache_timeout = 60 * 60
+    # Seconds an expired response may still be served while it is rebuilt,
+    # and the scale of the early refresh (0 disables it); None uses the
+    # CACHE_STALE_GRACE and CACHE_EARLY_REFRESH settings.
+    cache_grace = None
+    cache_early_refresh = None
+    cache_tags = None
+    object_cache_tags = None
 
     def get_cache_key(self, request):
         region = getattr(self, 'cache_region', 'default')
         return f"{region}:cache{request.path}?{request.META.get('QUERY_STRING', '')}"
 
+    def get_cache_tags(self, request):
+        if self.cache_tags is not None:
+            return list(self.cache_tags)
+        return [tag_for(self.get_queryset().model)]
+
     def list(self, request, *args, **kwargs):
-        cache_key = self.get_cache_key(request)
-        cache_data = cache.get(cache_key)
+        if not is_cacheable(request):
+            return Response(self.get_list_data(request))
+
+        cache_key, etag, last_modified = validators(self.get_cache_key(request), self.get_cache_tags(request))
+        response = not_modified(request, etag, last_modified)
+
+        if response is None:
+            def build():
+                with fresh_reads(last_modified):
+                    return Response(self.get_list_data(request))
+
+            response = cached_response(cache_key, request, self, build, self.get_cache_policy())
+
+        return set_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not is_cacheable(request):
+            return super().retrieve(request, *args, **kwargs)
+
+        tags = [tag.format_map(kwargs) for tag in self.get_object_cache_tags(request)]
+        _, etag, last_modified = validators(f'object:{request.path}', tags)
+        response = not_modified(request, etag, last_modified)
+
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
 
-        if cache_data:
-            return Response(cache_data)
-        
+        return set_validators(response, etag, last_modified)
+
+    def get_cache_policy(self):
+        return CachePolicy(
+            self.cache_timeout,
+            stale_grace() if self.cache_grace is None else self.cache_grace,
+            early_refresh() if self.cache_early_refresh is None else self.cache_early_refresh,
+        )
+
+    def get_object_cache_tags(self, request):
+        if self.object_cache_tags is not None:
+            return list(self.object_cache_tags)
+        return [tag_for(self.get_queryset().model, '{pk}')]
+
+    def get_list_data(self, request):
         queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data).data
+
         serializer = self.get_serializer(queryset, many=True)
+        return serializer.data
 
-        if isinstance(serializer.data, (dict, list)):
-            cache.set(cache_key, serializer.data, timeout=self.cache_timeout)
-        
-        return Response(serializer.data)
-    
     def invalidate_cache(self, request, *args, **kwargs):
-        cache_key = self.get_cache_key(request)
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-        cache.set(cache_key, serializer.data, timeout=self.cache_timeout)
-
-    def create(self, request, *args, **kwargs):
-        response = super().create(request, *args, **kwargs)
-        self.invalidate_cache(request, *args, **kwargs)
-        return response
-
-    def update(self, request, *args, **kwargs):
-        response = super().update(request, *args, **kwargs)
-        self.invalidate_cache(request, *args, **kwargs)
-        return response
-
-    def destroy(self, request, *args, **kwargs):
-        response = super().destroy(request, *args, **kwargs)
-        self.invalidate_cache(request, *args, **kwargs)
-        return response
+        # Model writes already bump their tags through core.signals; this is
+        # for views that change state the signals can't see.
+        invalidate_tags(self.get_cache_tags(request))
@@ -1,5 +1,9 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, UserManager
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from collections import defaultdict
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
 from django.conf import settings
 import uuid
 
@@ -44,11 +48,46 @@ class CustomUser(BaseModel, AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.username
     
+class SearchVectorDeferredManager(models.Manager):
+    """Leaves `search_vector` unloaded; only the search backend reads it, inside its queries."""
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+class PostQuerySet(models.QuerySet):
+    def with_actual_counts(self):
+        return self.annotate(actual_like_count = _count_per_post(Likes), actual_comment_count = _count_per_post(Comment))
+
+def _count_per_post(model):
+    rows = model.objects.filter(post = models.OuterRef('pk')).order_by().values('post').annotate(total = models.Count('pk')).values('total')
+    return Coalesce(models.Subquery(rows, output_field = models.IntegerField()), 0)
+
 class Post(BaseModel):
+    IMAGE_PROCESSING = 'processing'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUS_CHOICES = [
+        (IMAGE_PROCESSING, 'Processing'),
+        (IMAGE_READY, 'Ready'),
+        (IMAGE_FAILED, 'Failed'),
+    ]
+
     title = models.CharField(max_length = 100)
     image = models.ImageField(upload_to = "images/%Y/%m/", blank = True, null = True)
+    image_status = models.CharField(max_length = 20, choices = IMAGE_STATUS_CHOICES, blank = True, db_index = True)
+    image_hash = models.CharField(max_length = 64, blank = True)
+    image_renditions = models.JSONField(default = dict, blank = True)
     content = models.TextField()
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete = models.CASCADE)
+    like_count = models.PositiveIntegerField(default = 0)
+    comment_count = models.PositiveIntegerField(default = 0)
+    search_vector = SearchVectorField(null = True, editable = False)
+
+    objects = SearchVectorDeferredManager.from_queryset(PostQuerySet)()
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['created_at', 'id'], name = 'post_created_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -57,6 +96,14 @@ class Comment(BaseModel):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     texto = models.TextField()
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SearchVectorDeferredManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Comment of {self.author.username} in post {self.post.title}"
@@ -81,20 +128,120 @@ class Follow(BaseModel):
     def __str__(self):
         return f"{self.follower.username} follow {self.followed.username}"
     
+class SuggestedFollowsQuerySet(models.QuerySet):
+    def mark_changed(self, user_ids):
+        """Flag users whose follows changed so the next incremental run recomputes them."""
+        now = timezone.now()
+        self.bulk_create(
+            [SuggestedFollows(user_id=user_id, changed_at=now) for user_id in user_ids],
+            update_conflicts=True, unique_fields=['user'], update_fields=['changed_at'],
+        )
+
+    def stale(self):
+        return self.filter(models.Q(computed_at__isnull=True) | models.Q(changed_at__gt=models.F('computed_at')))
+
+class SuggestedFollows(BaseModel):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='suggested_follows')
+    candidates = models.JSONField(default=list, blank=True)
+    computed_at = models.DateTimeField(null=True, blank=True)
+    changed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = SuggestedFollowsQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Suggestions for {self.user.username}"
+
+class PrivateChatQuerySet(models.QuerySet):
+    def for_user(self, user):
+        return self.filter(models.Q(user1=user) | models.Q(user2=user))
+
+    def with_unread(self, user):
+        return self.annotate(unread=models.Case(
+            models.When(user1=user, then=models.F('last_seq') - models.F('user1_last_read_seq')),
+            default=models.F('last_seq') - models.F('user2_last_read_seq'),
+        ))
+
+    def mark_read(self, chat_id, user_id, seq):
+        """Move `user_id`'s read cursor forward to `seq` (never backwards, never past the last message)."""
+        def advance(field, participant):
+            target = Greatest(models.F(field), Least(models.Value(seq, output_field=models.PositiveBigIntegerField()), models.F('last_seq')))
+            return models.Case(models.When(**{participant: user_id}, then=target), default=models.F(field))
+
+        return self.filter(models.Q(user1_id=user_id) | models.Q(user2_id=user_id), pk=chat_id).update(
+            user1_last_read_seq=advance('user1_last_read_seq', 'user1_id'),
+            user2_last_read_seq=advance('user2_last_read_seq', 'user2_id'),
+        )
+
+    def record_last_messages(self, messages):
+        latest = {message.chat_id: message for message in messages}
+
+        for chat_id, message in latest.items():
+            self.filter(pk=chat_id, last_message_at__lte=message.created_at).update(
+                last_message=message, last_message_at=message.created_at
+            )
+
 class PrivateChat(BaseModel):
     user1 = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='private_chats_user1')
     user2 = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='private_chats_user2')
+    last_seq = models.PositiveBigIntegerField(default=0)
+    user1_last_read_seq = models.PositiveBigIntegerField(default=0)
+    user2_last_read_seq = models.PositiveBigIntegerField(default=0)
+    last_message = models.ForeignKey('Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    last_message_at = models.DateTimeField(default=timezone.now)
+
+    objects = PrivateChatQuerySet.as_manager()
 
     class Meta:
         unique_together = ('user1', 'user2')
+        indexes = [
+            models.Index(fields=['user1', 'last_message_at', 'id'], name='chat_user1_activity_idx'),
+            models.Index(fields=['user2', 'last_message_at', 'id'], name='chat_user2_activity_idx'),
+        ]
 
     def __str__(self):
         return f"Chat between {self.user1.username} and {self.user2.username}"
 
+class MessageManager(models.Manager):
+    def allocate_sequences(self, messages):
+        """Give unsaved messages consecutive per-chat `seq` numbers, in list order."""
+        pending = defaultdict(list)
+        for message in messages:
+            if message.seq is None:
+                pending[message.chat_id].append(message)
+
+        with transaction.atomic():
+            for chat_id, chat_messages in pending.items():
+                chats = PrivateChat.objects.filter(pk=chat_id)
+                chats.update(last_seq=models.F('last_seq') + len(chat_messages))
+                last_seq = chats.values_list('last_seq', flat=True).first()
+
+                if last_seq is None:
+                    continue
+
+                first_seq = last_seq - len(chat_messages) + 1
+                for offset, message in enumerate(chat_messages):
+                    message.seq = first_seq + offset
+
+                # Senders have read everything up to their own last message.
+                last_sent = {message.sender_id: message.seq for message in chat_messages}
+                for sender_id, seq in last_sent.items():
+                    PrivateChat.objects.mark_read(chat_id, sender_id, seq)
+
 class Message(BaseModel):
     chat = models.ForeignKey(PrivateChat, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
+    seq = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+
+    objects = MessageManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', 'created_at', 'id'], name='message_chat_created_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['chat', 'seq'], name='message_chat_seq_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
\ No newline at end of file
@@ -0,0 +1,120 @@
+import json
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+Cursor = namedtuple('Cursor', ['position', 'pk', 'reverse'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque cursor pagination over `(ordering_field, id)`.
+
+    Every page is a single index range scan on the composite index, so page N
+    costs the same as page 1. `previous` cursors walk the index the other way.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    descending = True
+    ordering_field = 'created_at'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_rows(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.paginate_rows([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """The unevaluated query for the requested page, plus one row to tell whether there are more."""
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = cursor = self.decode_cursor(request)
+
+        reverse = cursor is not None and cursor.reverse
+        walk_descending = self.descending != reverse
+        op = 'lt' if walk_descending else 'gt'
+        field = self.ordering_field
+
+        if walk_descending:
+            queryset = queryset.order_by(f'-{field}', '-id')
+        else:
+            queryset = queryset.order_by(field, 'id')
+
+        if cursor is not None:
+            queryset = queryset.filter(
+                Q(**{f'{field}__{op}e': cursor.position}),
+                Q(**{f'{field}__{op}': cursor.position}) | Q(**{field: cursor.position, f'id__{op}': cursor.pk}),
+            )
+
+        return queryset[:self.page_size + 1]
+
+    def paginate_rows(self, rows):
+        reverse = self.cursor is not None and self.cursor.reverse
+        has_more = len(rows) > self.page_size
+        self.page = rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            return Cursor(datetime.fromisoformat(payload['t']), uuid.UUID(str(payload['i'])), bool(payload['r']))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        payload = json.dumps({'t': getattr(obj, self.ordering_field).isoformat(), 'i': str(obj.pk), 'r': int(reverse)}, separators=(',', ':'))
+        encoded = urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class ChronologicalKeysetPagination(KeysetPagination):
+    descending = False
+
+
+class InboxPagination(KeysetPagination):
+    ordering_field = 'last_message_at'
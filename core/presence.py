@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .redis_client import get_redis_connection
+
+PRESENCE_KEY = 'presence:user:{}'
+
+
+def presence_ttl():
+    return getattr(settings, 'PRESENCE_TTL', 75)
+
+
+class RedisPresenceStore:
+    """
+    One sorted set per user holding their open sockets, scored by the time
+    each socket's heartbeat expires. A user is online while any score is in
+    the future, so sockets of a crashed worker age out on their own.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def touch(self, user_id, connection_id):
+        key = PRESENCE_KEY.format(user_id)
+        now = time.time()
+        pipe = self.connection.pipeline()
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zadd(key, {connection_id: now + presence_ttl()})
+        pipe.expire(key, presence_ttl())
+        pipe.execute()
+
+    def leave(self, user_id, connection_id):
+        self.connection.zrem(PRESENCE_KEY.format(user_id), connection_id)
+
+    def online(self, user_ids):
+        now = time.time()
+        pipe = self.connection.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcount(PRESENCE_KEY.format(user_id), now, '+inf')
+        return {str(user_id): count > 0 for user_id, count in zip(user_ids, pipe.execute())}
+
+
+class LocalPresenceStore:
+    """In-process stand-in for RedisPresenceStore, used when the cache is not Redis."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets = {}
+
+    def touch(self, user_id, connection_id):
+        with self._lock:
+            self._sockets.setdefault(str(user_id), {})[connection_id] = time.time() + presence_ttl()
+
+    def leave(self, user_id, connection_id):
+        with self._lock:
+            self._sockets.get(str(user_id), {}).pop(connection_id, None)
+
+    def online(self, user_ids):
+        now = time.time()
+        with self._lock:
+            return {
+                str(user_id): any(expires > now for expires in self._sockets.get(str(user_id), {}).values())
+                for user_id in user_ids
+            }
+
+
+_local_store = LocalPresenceStore()
+
+
+def get_store():
+    connection = get_redis_connection()
+    if connection is None:
+        return _local_store
+    return RedisPresenceStore(connection)
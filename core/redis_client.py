@@ -0,0 +1,12 @@
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+
+def get_redis_connection(alias='default'):
+    """Raw redis-py client behind a Django cache alias, or None when it isn't Redis."""
+    backend = caches[alias]
+
+    if isinstance(backend, RedisCache):
+        return backend._cache.get_client(write=True)
+
+    return None
@@ -0,0 +1,94 @@
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .async_cache import async_cache
+
+WRITER_KEY = 'db:primary:{}'
+
+_use_primary = ContextVar('use_primary', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def window():
+    """Seconds a client's reads stay on the primary after it writes; should exceed the replication lag."""
+    return getattr(settings, 'READ_YOUR_WRITES_WINDOW', 5)
+
+
+@contextmanager
+def primary():
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def fresh_reads(last_modified):
+    """Read from the primary when the data was modified within the window, e.g. before filling a shared cache entry."""
+    if last_modified is None or time.time() - last_modified < window():
+        return primary()
+    return nullcontext()
+
+
+def retry_on_primary(read):
+    """Call `read()` on a replica and again on the primary when it finds nothing, e.g. a row created a moment ago."""
+    result = read()
+    if not result and replicas() and not _use_primary.get():
+        with primary():
+            result = read()
+    return result
+
+
+def mark_writers(user_ids):
+    cache.set_many({WRITER_KEY.format(user_id): 1 for user_id in user_ids}, timeout=window())
+
+
+def is_recent_writer(user_id):
+    return cache.get(WRITER_KEY.format(user_id)) is not None
+
+
+async def amark_writers(user_ids):
+    await async_cache.set_many({WRITER_KEY.format(user_id): 1 for user_id in user_ids}, timeout=window())
+
+
+async def ais_recent_writer(user_id):
+    return await async_cache.get(WRITER_KEY.format(user_id)) is not None
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a random alias of `DATABASE_REPLICAS` and writes to the
+    primary. Reads stay on the primary inside `primary()`, which
+    ReplicaRoutingMiddleware enters for clients that wrote recently, and in
+    transactions, so a transaction never reads from a connection it didn't
+    write to.
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
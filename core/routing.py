@@ -1,7 +1,9 @@
 from django.urls import path
-from .consumers import ChatConsumer
+from .consumers import ChatConsumer, PostConsumer
+from .middleware import WebSocketMetricsMiddleware
 
 websocket_urlpatterns = [
-    path(r"ws/chat/<uuid:chat_id>", ChatConsumer.as_asgi()),
+    path(r"ws/chat/<uuid:chat_id>", WebSocketMetricsMiddleware(ChatConsumer.as_asgi())),
+    path(r"ws/posts/<uuid:post_id>", WebSocketMetricsMiddleware(PostConsumer.as_asgi())),
 ]
 
@@ -0,0 +1,267 @@
+import json
+import math
+import re
+import threading
+import unicodedata
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import defaultdict, namedtuple
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+from rest_framework.exceptions import NotFound
+
+from .models import CustomUser, Post, Comment
+
+SEARCH_CONFIG = 'simple'
+TRIGRAM_THRESHOLD = 0.3
+KINDS = ('post', 'comment', 'user')
+INDEXED_FIELDS = {
+    Post: {'title': 2.0, 'content': 1.0},
+    Comment: {'texto': 1.0},
+    CustomUser: {'username': 1.0},
+}
+
+Hit = namedtuple('Hit', ['kind', 'rank', 'obj'])
+Cursor = namedtuple('Cursor', ['rank', 'kind', 'pk'])
+
+WORD_RE = re.compile(r'\w+')
+
+
+def sort_key(kind, rank, pk):
+    """Results are ordered by this key, descending, across every kind."""
+    return rank, KINDS.index(kind), pk
+
+
+def _posts():
+    return Post.objects.select_related('author')
+
+
+def _comments():
+    return Comment.objects.all()
+
+
+def _users():
+    return CustomUser.objects.filter(is_active=True)
+
+
+QUERYSETS = {'post': _posts, 'comment': _comments, 'user': _users}
+
+
+class PostgresSearchBackend:
+    """
+    Ranked search on the stored `search_vector` columns (GIN indexed, kept
+    current by triggers, see migration 0008) and trigram matching on
+    usernames. Ranks are cast to double precision so cursors round-trip
+    exactly.
+    """
+
+    def search(self, kind, q, cursor, limit):
+        if kind == 'user':
+            rank = Case(
+                When(username__istartswith=q, then=Value(1.0)),
+                default=TrigramSimilarity('username', q),
+                output_field=FloatField(),
+            )
+            queryset = _users().filter(Q(username__istartswith=q) | Q(username__trigram_similar=q))
+        else:
+            query = SearchQuery(q, search_type='websearch', config=SEARCH_CONFIG)
+            rank = SearchRank(F('search_vector'), query, normalization=32)
+            queryset = QUERYSETS[kind]().filter(search_vector=query)
+
+        queryset = queryset.annotate(rank=Cast(rank, FloatField()))
+        queryset = self._after(queryset, kind, cursor).order_by('-rank', '-id')
+        return [Hit(kind, obj.rank, obj) for obj in queryset[:limit]]
+
+    @staticmethod
+    def _after(queryset, kind, cursor):
+        if cursor is None:
+            return queryset
+
+        order, cursor_order = KINDS.index(kind), KINDS.index(cursor.kind)
+        if order < cursor_order:
+            return queryset.filter(rank__lte=cursor.rank)
+        if order > cursor_order:
+            return queryset.filter(rank__lt=cursor.rank)
+        return queryset.filter(Q(rank__lt=cursor.rank) | Q(rank=cursor.rank, id__lt=cursor.pk))
+
+    def index(self, instance):
+        pass
+
+    def remove(self, model, pk):
+        pass
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return WORD_RE.findall(text)
+
+
+def trigrams(text):
+    grams = set()
+    for word in tokenize(text):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """Trigram similarity as computed by pg_trgm; takes strings or trigram sets."""
+    a = trigrams(a) if isinstance(a, str) else a
+    b = trigrams(b) if isinstance(b, str) else b
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class LocalSearchIndex:
+    """
+    In-process inverted index used when the database is not PostgreSQL.
+
+    It is built from the database on first use and kept current by
+    core.signals, so each process only sees other processes' writes after a
+    restart; that is fine for tests and SQLite development setups. Documents
+    match when they contain every query term and are ranked by weighted
+    tf-idf, squashed to [0, 1) like the PostgreSQL backend's ranks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._postings = {'post': defaultdict(dict), 'comment': defaultdict(dict)}
+        self._terms = {'post': {}, 'comment': {}}
+        self._usernames = {}
+
+    def _ensure_built(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            for post in Post.objects.only('id', 'title', 'content').iterator():
+                self._add('post', post.pk, self._weights(post))
+            for comment in Comment.objects.only('id', 'texto').iterator():
+                self._add('comment', comment.pk, self._weights(comment))
+            for pk, username in _users().values_list('id', 'username').iterator():
+                self._add_username(pk, username)
+            self._built = True
+
+    @staticmethod
+    def _weights(instance):
+        weights = defaultdict(float)
+        for field, weight in INDEXED_FIELDS[type(instance)].items():
+            for term in tokenize(getattr(instance, field) or ''):
+                weights[term] += weight
+        return weights
+
+    def _add_username(self, pk, username):
+        self._usernames[pk] = (username.lower(), trigrams(username))
+
+    def _add(self, kind, pk, weights):
+        self._discard(kind, pk)
+        for term, weight in weights.items():
+            self._postings[kind][term][pk] = weight
+        self._terms[kind][pk] = list(weights)
+
+    def _discard(self, kind, pk):
+        for term in self._terms[kind].pop(pk, []):
+            postings = self._postings[kind][term]
+            postings.pop(pk, None)
+            if not postings:
+                del self._postings[kind][term]
+
+    def index(self, instance):
+        if not self._built:
+            return
+        with self._lock:
+            if isinstance(instance, CustomUser):
+                if instance.is_active:
+                    self._add_username(instance.pk, instance.username)
+                else:
+                    self._usernames.pop(instance.pk, None)
+            else:
+                kind = 'post' if isinstance(instance, Post) else 'comment'
+                self._add(kind, instance.pk, self._weights(instance))
+
+    def remove(self, model, pk):
+        if not self._built:
+            return
+        with self._lock:
+            if model is CustomUser:
+                self._usernames.pop(pk, None)
+            else:
+                self._discard('post' if model is Post else 'comment', pk)
+
+    def _rank_documents(self, kind, q):
+        terms = set(tokenize(q))
+        postings = [self._postings[kind].get(term, {}) for term in terms]
+        if not postings or not all(postings):
+            return []
+
+        total = len(self._terms[kind])
+        matches = set.intersection(*(set(documents) for documents in postings))
+        ranked = []
+        for pk in matches:
+            score = sum(documents[pk] * math.log(1 + total / len(documents)) for documents in postings)
+            ranked.append((score / (score + 1), pk))
+        return ranked
+
+    def _rank_users(self, q):
+        q, grams = q.lower(), trigrams(q)
+        ranked = []
+        for pk, (username, username_grams) in self._usernames.items():
+            rank = 1.0 if username.startswith(q) else similarity(username_grams, grams)
+            if rank >= TRIGRAM_THRESHOLD:
+                ranked.append((rank, pk))
+        return ranked
+
+    def search(self, kind, q, cursor, limit):
+        self._ensure_built()
+        with self._lock:
+            ranked = self._rank_users(q) if kind == 'user' else self._rank_documents(kind, q)
+
+        if cursor is not None:
+            bound = sort_key(cursor.kind, cursor.rank, cursor.pk)
+            ranked = [(rank, pk) for rank, pk in ranked if sort_key(kind, rank, pk) < bound]
+
+        ranked = sorted(ranked, reverse=True)[:limit]
+        objects = QUERYSETS[kind]().in_bulk([pk for _, pk in ranked])
+        return [Hit(kind, rank, objects[pk]) for rank, pk in ranked if pk in objects]
+
+
+_local_index = LocalSearchIndex()
+
+
+def get_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return _local_index
+
+
+def search(q, kinds=KINDS, cursor=None, limit=20):
+    """Return one page of hits across `kinds`, best first, and whether more follow."""
+    backend = get_backend()
+    hits = []
+    for kind in kinds:
+        hits.extend(backend.search(kind, q, cursor, limit + 1))
+
+    hits.sort(key=lambda hit: sort_key(hit.kind, hit.rank, hit.obj.pk), reverse=True)
+    return hits[:limit], len(hits) > limit
+
+
+def encode_cursor(hit):
+    payload = json.dumps({'r': hit.rank, 'k': hit.kind, 'i': str(hit.obj.pk)}, separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(encoded):
+    try:
+        payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+        if payload['k'] not in KINDS:
+            raise ValueError(payload['k'])
+        return Cursor(float(payload['r']), payload['k'], uuid.UUID(payload['i']))
+    except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+        raise NotFound('Invalid cursor')
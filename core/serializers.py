@@ -1,12 +1,14 @@
 from rest_framework import serializers
 from .models import CustomUser, Post, Comment, Likes, Message, PrivateChat
 from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['id', 'username', 'email', 'created_at', 'updated_at', 'password']
+        extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
         password = validated_data.pop('password', None)
@@ -16,16 +18,36 @@ class CustomUserSerializer(serializers.ModelSerializer):
         return user
 
 
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ['id', 'username']
+
+
 class PostSerializer(serializers.ModelSerializer):
+    author = AuthorSerializer(read_only=True)
+    renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = Post 
-        depth = 1
-        fields = '__all__'
+        fields = ['id', 'title', 'image', 'image_status', 'renditions', 'content', 'author', 'like_count', 'comment_count', 'created_at', 'updated_at']
+        read_only_fields = ['image_status', 'like_count', 'comment_count']
+
+    def get_renditions(self, obj):
+        renditions = {}
+        for name, rendition in obj.image_renditions.items():
+            renditions[name] = {
+                **rendition,
+                'webp': default_storage.url(rendition['webp']),
+                'jpeg': default_storage.url(rendition['jpeg']),
+            }
+        return renditions
 
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = '__all__'
+        fields = ['id', 'created_at', 'updated_at', 'texto', 'post', 'author']
+        read_only_fields = ['post', 'author']
 
 class LikesSerializer(serializers.ModelSerializer):
     class Meta:
@@ -39,5 +61,33 @@ class MessageSerializer(serializers.ModelSerializer):
 
 class PrivateChatSerializer(serializers.ModelSerializer):
     class Meta:
-        model: PrivateChat
-        fields = '__all__'
\ No newline at end of file
+        model = PrivateChat
+        fields = '__all__'
+
+class InboxSerializer(serializers.ModelSerializer):
+    """One inbox row: expects `user1`, `user2` and `last_message` selected and `unread` annotated."""
+    preview_length = 100
+
+    participant = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = PrivateChat
+        fields = ['id', 'participant', 'last_message', 'last_message_at', 'unread']
+
+    def get_participant(self, obj):
+        user = self.context['request'].user
+        other = obj.user2 if obj.user1_id == user.pk else obj.user1
+        return AuthorSerializer(other).data
+
+    def get_last_message(self, obj):
+        message = obj.last_message
+        if message is None:
+            return None
+        return {
+            'id': str(message.pk),
+            'seq': message.seq,
+            'sender': str(message.sender_id),
+            'content': message.content[:self.preview_length],
+        }
\ No newline at end of file
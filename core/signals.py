@@ -1,19 +1,87 @@
-from django.db.models.signals import pre_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from PIL import Image
-from io import BytesIO
-from django.core.files.base import ContentFile
-from .models import Post
+from .models import CustomUser, Post, Follow, Likes, Comment, Message, PrivateChat, SuggestedFollows
+from . import feed, counters, images, search
+from .caching import TAGGED_MODELS, tags_for_instance, invalidate_tags
+from .authentication import user_cache
 
 @receiver(pre_save, sender = Post)
-def resize_image_on_save(sender, instance, **kwargs):
-
-    if instance.image:
-        image = Image.open(instance.image)
-        size = (800, 600)
-        image.thumbnail(size, Image.LANCZOS)
-        buffer = BytesIO()
-        image.save(buffer, format='JPEG')
-        file_name = instance.image.name.split('/')[-1]
-        new_image = ContentFile(buffer.getvalue(), file_name)
-        instance.image.save(file_name, new_image, save=False)
\ No newline at end of file
+def queue_image_processing(sender, instance, **kwargs):
+
+    if not instance.image:
+        instance.image_status = ''
+        if instance.image_renditions:
+            renditions = instance.image_renditions
+            transaction.on_commit(lambda: images.delete_files(renditions))
+        instance.image_renditions = {}
+        instance.image_hash = ''
+    elif not instance.image._committed:
+        instance.image_status = Post.IMAGE_PROCESSING
+
+@receiver(pre_save, sender = Message)
+def assign_message_sequence(sender, instance, **kwargs):
+    if instance._state.adding and instance.seq is None:
+        Message.objects.allocate_sequences([instance])
+
+@receiver(post_save, sender = Message)
+def record_last_message(sender, instance, created, **kwargs):
+    if created:
+        PrivateChat.objects.record_last_messages([instance])
+
+@receiver(post_save, sender = Post)
+def fan_out_post_on_create(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: feed.fan_out_post(instance))
+
+@receiver(post_delete, sender = Post)
+def remove_post_from_timelines(sender, instance, **kwargs):
+    author_id, post_id = instance.author_id, instance.pk
+    transaction.on_commit(lambda: feed.remove_post(author_id, post_id))
+
+@receiver(post_delete, sender = Post)
+def delete_image_files(sender, instance, **kwargs):
+    if instance.image or instance.image_renditions:
+        renditions, original = instance.image_renditions, instance.image.name
+        transaction.on_commit(lambda: images.delete_files(renditions, original))
+
+@receiver([post_save, post_delete], sender = Follow)
+def rebuild_timeline_on_follow_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: feed.invalidate_home_timeline(instance.follower_id))
+
+@receiver([post_save, post_delete], sender = Follow)
+def mark_suggestions_stale(sender, instance, **kwargs):
+    transaction.on_commit(lambda: SuggestedFollows.objects.mark_changed([instance.follower_id]))
+
+@receiver([post_save, post_delete])
+def invalidate_cache_tags(sender, instance, **kwargs):
+    if sender in TAGGED_MODELS:
+        tags = tags_for_instance(instance)
+        transaction.on_commit(lambda: invalidate_tags(tags))
+
+@receiver(post_save)
+def index_for_search(sender, instance, update_fields=None, **kwargs):
+    fields = search.INDEXED_FIELDS.get(sender)
+    if fields and (update_fields is None or set(update_fields) & {*fields, 'is_active'}):
+        transaction.on_commit(lambda: search.get_backend().index(instance))
+
+@receiver(post_delete)
+def remove_from_search(sender, instance, **kwargs):
+    if sender in search.INDEXED_FIELDS:
+        pk = instance.pk
+        transaction.on_commit(lambda: search.get_backend().remove(sender, pk))
+
+@receiver(post_save, sender = Likes)
+@receiver(post_save, sender = Comment)
+def count_on_create(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.post_id, counters.FIELDS[sender], 1)
+
+@receiver(post_delete, sender = Likes)
+@receiver(post_delete, sender = Comment)
+def count_on_delete(sender, instance, **kwargs):
+    counters.increment(instance.post_id, counters.FIELDS[sender], -1)
+
+@receiver([post_save, post_delete], sender = CustomUser)
+def evict_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
@@ -0,0 +1,166 @@
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from .models import CustomUser, Follow, SuggestedFollows
+
+Graph = namedtuple('Graph', ['ids', 'index', 'adjacency'])
+
+WRITE_BATCH = 1000
+
+
+def top_k():
+    return getattr(settings, 'SUGGESTIONS_TOP_K', 20)
+
+
+def batch_budget():
+    return getattr(settings, 'SUGGESTIONS_BATCH_BUDGET', 5_000_000)
+
+
+def load_graph(chunk_size=50000):
+    """Read every Follow edge into a CSR matrix where row i holds the accounts user i follows."""
+    index, ids = {}, []
+    followers, followed = [], []
+
+    for follower_id, followed_id in Follow.objects.values_list('follower_id', 'followed_id').iterator(chunk_size=chunk_size):
+        for user_id, column in ((follower_id, followers), (followed_id, followed)):
+            position = index.get(user_id)
+            if position is None:
+                position = index[user_id] = len(ids)
+                ids.append(user_id)
+            column.append(position)
+
+    size = len(ids)
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(followers), dtype=np.int32), (np.array(followers, dtype=np.int64), np.array(followed, dtype=np.int64))),
+        shape=(size, size),
+    )
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1
+    return Graph(ids, index, adjacency)
+
+
+def batches(rows, work, budget):
+    """Split `rows` so that each batch's product has at most about `budget` entries."""
+    cumulative = np.cumsum(work[rows])
+    start = 0
+    while start < len(rows):
+        base = cumulative[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(cumulative, base + budget, side='right')))
+        yield rows[start:stop]
+        start = stop
+
+
+def id_ranks(ids):
+    """Position of each id in sorted order, to break ties by pk."""
+    ranks = np.empty(len(ids), dtype=np.int64)
+    ranks[sorted(range(len(ids)), key=ids.__getitem__)] = np.arange(len(ids))
+    return ranks
+
+
+def second_degree(adjacency, rows, top, popularity, ranks):
+    """
+    Top-`top` friends-of-friends for each user in `rows`, scored by how many
+    of the accounts they follow follow the candidate (ties go to the more
+    followed candidate, then to the lower pk by `ranks`). Returns one list of
+    (column, score) pairs per row.
+    """
+    block = adjacency[rows]
+    scores = (block @ adjacency).tocsr()
+
+    # Drop the users themselves and the accounts they already follow.
+    known = block + sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (np.arange(len(rows)), rows)), shape=block.shape
+    )
+    known.data[:] = 1
+    scores = (scores - scores.multiply(known)).tocsr()
+    scores.eliminate_zeros()
+
+    counts = np.diff(scores.indptr)
+    row_of = np.repeat(np.arange(len(rows)), counts)
+    order = np.lexsort((ranks[scores.indices], -popularity[scores.indices], -scores.data, row_of))
+    rank = np.arange(len(order)) - np.repeat(scores.indptr[:-1], counts)
+    keep = order[rank < top]
+
+    kept = np.minimum(counts, top)
+    columns = np.split(scores.indices[keep], np.cumsum(kept)[:-1])
+    values = np.split(scores.data[keep], np.cumsum(kept)[:-1])
+    return [list(zip(c.tolist(), v.tolist())) for c, v in zip(columns, values)]
+
+
+def _save(results, computed_at):
+    SuggestedFollows.objects.bulk_create(
+        [
+            SuggestedFollows(user_id=user_id, candidates=candidates, computed_at=computed_at)
+            for user_id, candidates in results
+        ],
+        update_conflicts=True, unique_fields=['user'], update_fields=['candidates', 'computed_at', 'updated_at'],
+    )
+
+
+def refresh(stale_only=False, top=None, budget=None):
+    """
+    Recompute stored suggestions and return how many users were written.
+
+    A full run covers every user in the follow graph. With `stale_only`,
+    only users flagged by `SuggestedFollows.objects.mark_changed` since
+    their last computation are redone, together with their followers,
+    whose friends-of-friends go through them.
+    """
+    top, budget = top or top_k(), budget or batch_budget()
+    started = timezone.now()
+    graph = load_graph()
+    adjacency = graph.adjacency
+    size = len(graph.ids)
+    orphans = []
+
+    if stale_only:
+        changed = list(SuggestedFollows.objects.stale().values_list('user_id', flat=True))
+        positions = np.array([graph.index[user_id] for user_id in changed if user_id in graph.index], dtype=np.int64)
+        # Users that no longer follow or are followed by anyone.
+        orphans = [user_id for user_id in changed if user_id not in graph.index]
+        followers = adjacency.T.tocsr()[positions].indices if len(positions) else np.array([], dtype=np.int64)
+        rows = np.unique(np.concatenate([positions, followers])).astype(np.int64)
+    else:
+        rows = np.arange(size, dtype=np.int64)
+
+    popularity = np.asarray(adjacency.sum(axis=0)).ravel()
+    ranks = id_ranks(graph.ids)
+    work = adjacency @ np.diff(adjacency.indptr)
+    written = 0
+
+    for batch in batches(rows, work, budget):
+        suggested = second_degree(adjacency, batch, top, popularity, ranks)
+        results = [
+            (graph.ids[row], [[str(graph.ids[column]), score] for column, score in candidates])
+            for row, candidates in zip(batch.tolist(), suggested)
+        ]
+        for start in range(0, len(results), WRITE_BATCH):
+            with transaction.atomic():
+                _save(results[start:start + WRITE_BATCH], started)
+        written += len(results)
+
+    if orphans:
+        _save([(user_id, []) for user_id in orphans], started)
+
+    return written + len(orphans)
+
+
+def suggestions_for(user, limit=None):
+    """Stored suggestions for `user`, minus accounts followed or deactivated since they were computed."""
+    row = SuggestedFollows.objects.filter(user=user).values_list('candidates', flat=True).first()
+    if not row:
+        return []
+
+    row = row[:limit] if limit else row
+    candidate_ids = [user_id for user_id, _ in row]
+    users = CustomUser.objects.filter(is_active=True).in_bulk(candidate_ids)
+    following = set(
+        Follow.objects.filter(follower=user, followed_id__in=candidate_ids).values_list('followed_id', flat=True)
+    )
+    users = {str(pk): candidate for pk, candidate in users.items() if pk not in following}
+    return [(users[user_id], mutual) for user_id, mutual in row if user_id in users]
@@ -1,3 +1,1225 @@
-from django.test import TestCase
+import json
+import time
+import tempfile
+import uuid
+from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import bulk, caching, counters, feed, frames, images, live, metrics, routers, search, suggestions
+from .authentication import JWTAuthMiddleware, user_cache
+from .buffers import message_buffer
+from .local_cache import INVALIDATION_CHANNEL, LocalCache, local_cache
+from .middleware import PRIMARY_COOKIE
+from .models import CustomUser, Post, Comment, Likes, Follow, PrivateChat, Message, SuggestedFollows
+from .routing import websocket_urlpatterns
+from .serializers import PostSerializer
+from .views import PostViewSet
+
+TEST_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'PASSWORD_HASHERS': ['django.contrib.auth.hashers.MD5PasswordHasher'],
+    'LIVE_COUNT_INTERVAL': None,
+}
+TEST_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def make_user(name):
+    return CustomUser.objects.create_user(username=name, email=f'{name}@example.com', password='secret')
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryCountTests(APITestCase):
+    """Each endpoint issues a fixed number of queries however many rows it returns."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(feed, '_local_store', feed.LocalTimelineStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = make_user('reader')
+        self.other = make_user('writer')
+        self.chat = PrivateChat.objects.create(user1=self.user, user2=self.other)
+        self.client.force_authenticate(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.user, followed=self.other)
+        feed.read_feed(self.user)
+
+    def populate(self, size):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(size):
+                author = make_user(f'author{Post.objects.count()}')
+                post = Post.objects.create(title=f'post {i}', content='content', author=self.other)
+                Comment.objects.create(post=post, author=author, texto='comment')
+                Likes.objects.create(post=post, user=author)
+                Message.objects.create(chat=self.chat, sender=self.other, content='hello')
+                chat = PrivateChat.objects.create(user1=author, user2=self.user)
+                Message.objects.create(chat=chat, sender=author, content='hi')
+        cache.clear()
+        return post
+
+    def assertConstantQueries(self, expected, url_for):
+        counts = []
+        for size in (2, 10):
+            url = url_for(self.populate(size))
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            counts.append(len(context))
+        self.assertEqual(counts, [expected, expected])
+
+    def test_post_list(self):
+        self.assertConstantQueries(1, lambda post: '/api/posts/')
+
+    def test_post_detail(self):
+        self.assertConstantQueries(1, lambda post: f'/api/posts/{post.pk}/')
+
+    def test_post_comments(self):
+        self.assertConstantQueries(2, lambda post: f'/api/posts/{post.pk}/comments/')
+
+    def test_feed(self):
+        self.assertConstantQueries(1, lambda post: '/api/posts/feed/')
+
+    def test_chat_messages(self):
+        self.assertConstantQueries(1, lambda post: f'/api/chat/messages/?conversation={self.chat.pk}')
+
+    def test_chat_conversations(self):
+        self.assertConstantQueries(1, lambda post: '/api/chat/conversations/')
+
+    def test_inbox_is_ordered_by_last_message(self):
+        quiet = PrivateChat.objects.create(user1=make_user('quiet'), user2=self.user)
+        Message.objects.create(chat=self.chat, sender=self.other, content='x' * 300)
+
+        results = self.client.get('/api/chat/conversations/').json()['results']
+
+        self.assertEqual([row['id'] for row in results], [str(self.chat.pk), str(quiet.pk)])
+        self.assertEqual(results[0]['participant'], {'id': str(self.other.pk), 'username': 'writer'})
+        self.assertEqual(len(results[0]['last_message']['content']), 100)
+        self.assertEqual(results[0]['unread'], 1)
+        self.assertIsNone(results[1]['last_message'])
+
+    def test_cached_list_issues_no_queries(self):
+        self.populate(3)
+        self.client.get('/api/posts/')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/posts/')
+
+        self.assertEqual(len(response.json()['results']), 3)
+
+
+@override_settings(**TEST_SETTINGS)
+class FeedTests(APITestCase):
+    """Home timelines, on the in-process store used when the cache is not Redis."""
+
+    def setUp(self):
+        cache.clear()
+        self.store = feed.LocalTimelineStore()
+        patcher = mock.patch.object(feed, '_local_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.reader = make_user('reader')
+        self.writer = make_user('writer')
+        self.client.force_authenticate(self.reader)
+
+    def follow(self, follower, followed):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Follow.objects.create(follower=follower, followed=followed)
+
+    def publish(self, author, count=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [str(Post.objects.create(title='post', content='content', author=author).pk) for _ in range(count)]
+
+    def timeline(self, user):
+        return [member for member, _ in self.store.range([feed.HOME_KEY.format(user.pk)], None, 100)[0]]
+
+    def read(self, **params):
+        body = self.client.get('/api/posts/feed/', params).json()
+        return [post['id'] for post in body['results']], body['next']
+
+    @override_settings(FEED_MAX_LENGTH=2)
+    def test_posts_are_pushed_to_materialized_timelines_and_trimmed(self):
+        self.follow(self.reader, self.writer)
+        self.follow(make_user('idle'), self.writer)
+        self.assertEqual(self.read(), ([], None))
+
+        posts = self.publish(self.writer, 3)
+
+        self.assertEqual(self.timeline(self.reader), posts[:0:-1])
+        self.assertFalse(self.store.touch(feed.HOME_KEY.format(CustomUser.objects.get(username='idle').pk)))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.read()[0], posts[:0:-1])
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_celebrity_posts_are_merged_at_read_time(self):
+        celebrity = make_user('celebrity')
+        self.follow(self.reader, celebrity)
+        self.follow(make_user('fan'), celebrity)
+        self.follow(self.reader, self.writer)
+        self.read()
+
+        older = self.publish(self.writer)
+        famous = self.publish(celebrity)
+        newer = self.publish(self.writer)
+
+        self.assertEqual(self.store.celebrities(), {str(celebrity.pk)})
+        self.assertEqual(self.timeline(self.reader), newer + older)
+        self.assertEqual(self.read()[0], newer + famous + older)
+
+    def test_before_and_limit_page_through_the_feed(self):
+        self.follow(self.reader, self.writer)
+        posts = self.publish(self.writer, 5)[::-1]
+
+        pages, before = [], None
+        while True:
+            page, before = self.read(limit=2, **({'before': before} if before is not None else {}))
+            pages.append(page)
+            if before is None:
+                break
+
+        self.assertEqual(pages, [posts[:2], posts[2:4], posts[4:]])
+        self.assertEqual(self.client.get('/api/posts/feed/', {'limit': 0}).status_code, 400)
+        for before in ('soon', 'nan', 'inf', '-inf'):
+            self.assertEqual(self.client.get('/api/posts/feed/', {'before': before}).status_code, 400)
+
+    def test_pages_do_not_skip_posts_sharing_a_timestamp(self):
+        self.follow(self.reader, self.writer)
+        self.read()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now()):
+            posts = sorted(self.publish(self.writer, 3), reverse=True)
+
+        first, before = self.read(limit=2)
+        second, last = self.read(limit=2, before=before)
+        self.assertEqual((first, second, last), (posts[:2], posts[2:], None))
+
+    def test_follow_and_unfollow_rebuild_the_timeline(self):
+        posts = self.publish(self.writer, 2)[::-1]
+        self.assertEqual(self.read()[0], [])
+
+        follow = self.follow(self.reader, self.writer)
+        self.assertEqual(self.read()[0], posts)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.assertEqual(self.read()[0], [])
+        self.assertEqual(self.timeline(self.reader), [])
+
+
+@override_settings(**TEST_SETTINGS)
+class PostSerializerTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('author')
+        self.client.force_authenticate(self.user)
+
+    def test_post_exposes_slim_author_and_counts(self):
+        post = Post.objects.create(title='title', content='content', author=self.user)
+        Likes.objects.create(post=post, user=self.user)
+        Comment.objects.create(post=post, author=self.user, texto='first')
+        Comment.objects.create(post=post, author=self.user, texto='second')
+
+        data = self.client.get(f'/api/posts/{post.pk}/').json()
+
+        self.assertEqual(data['author'], {'id': str(self.user.pk), 'username': 'author'})
+        self.assertEqual((data['like_count'], data['comment_count']), (1, 2))
+
+    def test_user_endpoints_never_return_password(self):
+        data = self.client.get(f'/api/users/{self.user.pk}/').json()
+        self.assertNotIn('password', data)
+
+    def test_create_comment(self):
+        post = Post.objects.create(title='title', content='content', author=self.user)
+
+        response = self.client.post(f'/api/posts/{post.pk}/comments/', {'texto': 'hello'})
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['author'], str(self.user.pk))
+
+
+@override_settings(**TEST_SETTINGS)
+class KeysetPaginationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('reader')
+        self.client.force_authenticate(self.user)
+        for i in range(5):
+            Post.objects.create(title=f'post {i}', content='content', author=self.user)
+        self.expected = [str(pk) for pk in Post.objects.order_by('-created_at', '-id').values_list('pk', flat=True)]
+
+    def page(self, url):
+        body = self.client.get(url).json()
+        return [post['id'] for post in body['results']], body['next'], body['previous']
+
+    def test_next_and_previous_links_walk_the_ordering(self):
+        first, next_url, previous_url = self.page('/api/posts/?page_size=2')
+        self.assertEqual((first, previous_url), (self.expected[:2], None))
+
+        second, next_url, _ = self.page(next_url)
+        third, last_url, previous_url = self.page(next_url)
+        self.assertEqual((second, third, last_url), (self.expected[2:4], self.expected[4:], None))
+
+        self.assertEqual(self.page(previous_url)[0], self.expected[2:4])
+
+    def test_malformed_cursors_are_rejected(self):
+        payload = json.dumps({'t': timezone.now().isoformat(), 'i': 'nope', 'r': 0}).encode()
+        for cursor in ('garbage', urlsafe_b64encode(payload).decode()):
+            response = self.client.get('/api/posts/', {'cursor': cursor})
+            self.assertEqual((response.status_code, response.json()), (404, {'detail': 'Invalid cursor'}))
+
+
+@override_settings(**TEST_SETTINGS)
+class PostCounterTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('author')
+        self.post = Post.objects.create(title='title', content='content', author=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_like_and_comment_writes_update_counters(self):
+        self.client.post(f'/api/posts/{self.post.pk}/like/')
+        comment = Comment.objects.create(post=self.post, author=self.user, texto='hi')
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 1))
+
+        self.client.delete(f'/api/posts/{self.post.pk}/like/')
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (0, 0))
+
+    def test_reconcile_repairs_drift(self):
+        Comment.objects.create(post=self.post, author=self.user, texto='hi')
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, comment_count=0)
+
+        out = StringIO()
+        call_command('reconcile_post_counters', stdout=out)
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (0, 1))
+        self.assertIn('Repaired 1 drifted posts.', out.getvalue())
+
+    def test_reconcile_counts_buffered_increments_and_settles_the_ones_it_replaces(self):
+        Likes.objects.create(post=self.post, user=self.user)
+        drifted = Post.objects.create(title='drifted', content='content', author=self.user)
+        Post.objects.filter(pk=self.post.pk).update(like_count=0)
+        Post.objects.filter(pk=drifted.pk).update(like_count=5)
+
+        connection = mock.Mock()
+        connection.hgetall.side_effect = lambda key: (
+            {str(self.post.pk).encode(): b'1', str(drifted.pk).encode(): b'1'} if key == 'counters:post:like_count' else {}
+        )
+        with self.settings(POST_COUNTERS_BUFFERED=True), mock.patch('core.counters.get_redis_connection', return_value=connection):
+            self.assertEqual(counters.reconcile(), [drifted.pk])
+
+        connection.register_script.return_value.assert_called_once_with(
+            keys=['counters:post:like_count'], args=[str(drifted.pk), 1]
+        )
+        self.assertEqual(Post.objects.get(pk=drifted.pk).like_count, 0)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 0)
+
+
+@override_settings(**TEST_SETTINGS)
+class ImagePipelineTests(APITestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        patcher = override_settings(MEDIA_ROOT=media.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+        self.user = make_user('author')
+        self.client.force_authenticate(self.user)
+
+    def upload(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 1200), (200, 30, 30)).save(buffer, format='PNG')
+        image = SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+        return self.client.post('/api/posts/', {'title': 'photo', 'content': 'content', 'image': image}, format='multipart')
+
+    def test_create_returns_before_processing(self):
+        response = self.upload()
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['image_status'], Post.IMAGE_PROCESSING)
+        self.assertEqual(response.json()['renditions'], {})
+
+    def test_worker_renders_and_skips_unchanged_images(self):
+        post = Post.objects.get(pk=self.upload().json()['id'])
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            self.assertEqual(images.process_pending(pool), 1)
+            post.refresh_from_db()
+            self.assertEqual(post.image_status, Post.IMAGE_READY)
+            self.assertEqual(set(post.image_renditions), set(images.RENDITIONS))
+            self.assertEqual(post.image_renditions['thumbnail']['width'], 320)
+
+            renditions = post.image_renditions
+            Post.objects.filter(pk=post.pk).update(image_status=Post.IMAGE_PROCESSING)
+            with mock.patch.object(pool, 'submit') as submit:
+                images.process_pending(pool)
+            submit.assert_not_called()
+            post.refresh_from_db()
+            self.assertEqual((post.image_status, post.image_renditions), (Post.IMAGE_READY, renditions))
+
+    def test_deleting_a_post_removes_its_image_files(self):
+        post = Post.objects.get(pk=self.upload().json()['id'])
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            images.process_pending(pool)
+        post.refresh_from_db()
+        files = [post.image.name, *(rendition[key] for rendition in post.image_renditions.values() for key in images.EXTENSIONS)]
+        self.assertTrue(all(default_storage.exists(path) for path in files))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/posts/{post.pk}/').status_code, 204)
+
+        self.assertFalse(any(default_storage.exists(path) for path in files))
+
+    def test_clearing_the_image_drops_its_renditions(self):
+        post = Post.objects.get(pk=self.upload().json()['id'])
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            images.process_pending(pool)
+        post.refresh_from_db()
+        files = [rendition[key] for rendition in post.image_renditions.values() for key in images.EXTENSIONS]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/posts/{post.pk}/', {'image': None}, format='json')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.json()['image'], response.json()['image_status'], response.json()['renditions']), (None, '', {}))
+        post.refresh_from_db()
+        self.assertEqual((post.image_hash, post.image_renditions), ('', {}))
+        self.assertFalse(any(default_storage.exists(path) for path in files))
+
+
+@override_settings(**TEST_SETTINGS, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class ChatConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('sender')
+        self.other = make_user('receiver')
+        self.chat = PrivateChat.objects.create(user1=self.user, user2=self.other)
+
+    def communicator(self, user, chat_id=None):
+        token = AccessToken.for_user(user)
+        return WebsocketCommunicator(
+            JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+            f'/ws/chat/{chat_id or self.chat.pk}',
+            headers=[(b'authorization', f'Bearer {token}'.encode())],
+        )
+
+    async def next_message(self, communicator):
+        while True:
+            event = await communicator.receive_json_from()
+            if 'type' not in event:
+                return event
+
+    async def test_messages_are_broadcast_then_persisted_in_one_batch(self):
+        sender, receiver = self.communicator(self.user), self.communicator(self.other)
+        self.assertTrue((await sender.connect())[0])
+        self.assertTrue((await receiver.connect())[0])
+
+        with mock.patch.object(message_buffer, 'max_delay', 60):
+            for i in range(3):
+                await sender.send_to(text_data=json.dumps({'message': f'hello {i}'}))
+                event = await self.next_message(receiver)
+                self.assertEqual((event['message'], event['sender']), (f'hello {i}', 'sender'))
+
+            self.assertEqual(await Message.objects.acount(), 0)
+
+            with mock.patch.object(Message.objects, 'bulk_create', wraps=Message.objects.bulk_create) as bulk_create:
+                await sender.disconnect()
+            bulk_create.assert_called_once()
+
+        stored = [(message.seq, message.content) async for message in Message.objects.order_by('created_at')]
+        self.assertEqual(stored, [(1, 'hello 0'), (2, 'hello 1'), (3, 'hello 2')])
+        chat = await PrivateChat.objects.select_related('last_message').aget(pk=self.chat.pk)
+        self.assertEqual(chat.last_message.content, 'hello 2')
+
+        event = await receiver.receive_json_from()
+        while event.get('type') != 'sequenced':
+            event = await receiver.receive_json_from()
+        self.assertEqual([item['seq'] for item in event['messages']], [1, 2, 3])
+        await receiver.disconnect()
+
+    @override_settings(CHAT_REPLAY_BATCH=2)
+    async def test_reconnect_replays_only_missing_messages(self):
+        for i in range(5):
+            await Message.objects.acreate(chat=self.chat, sender=self.other, content=f'missed {i}')
+
+        communicator = self.communicator(self.user)
+        communicator.scope['query_string'] = b'since=2'
+        await communicator.connect()
+
+        frames = []
+        while not frames or frames[-1]['type'] != 'replay_done':
+            event = await communicator.receive_json_from()
+            if event['type'].startswith('replay'):
+                frames.append(event)
+
+        batches = [[message['seq'] for message in frame['messages']] for frame in frames[:-1]]
+        self.assertEqual(batches, [[3, 4], [5]])
+        self.assertEqual(frames[-1], {'type': 'replay_done', 'seq': 5, 'complete': True})
+        await communicator.disconnect()
+
+    async def test_presence_follows_connections(self):
+        api = APIClient()
+        await database_sync_to_async(api.force_authenticate)(self.other)
+        url = f'/api/users/presence/?ids={self.user.pk},{self.other.pk}'
+
+        sender = self.communicator(self.user)
+        await sender.connect()
+        online = (await database_sync_to_async(api.get)(url)).json()
+        self.assertEqual(online, {str(self.user.pk): True, str(self.other.pk): False})
+
+        await sender.disconnect()
+        online = (await database_sync_to_async(api.get)(url)).json()
+        self.assertEqual(online[str(self.user.pk)], False)
+
+    async def test_typing_events_are_coalesced(self):
+        sender, receiver = self.communicator(self.user), self.communicator(self.other)
+        await sender.connect()
+        await receiver.connect()
+        await receiver.receive_json_from()
+
+        for _ in range(5):
+            await sender.send_to(text_data=json.dumps({'type': 'typing'}))
+        await sender.send_to(text_data=json.dumps({'message': 'done'}))
+
+        self.assertEqual(await receiver.receive_json_from(), {'type': 'typing', 'sender': 'sender'})
+        self.assertEqual((await receiver.receive_json_from())['message'], 'done')
+        await sender.disconnect()
+        await receiver.disconnect()
+
+    @override_settings(READ_RECEIPT_DELAY=60)
+    async def test_read_bursts_are_stored_once_and_pushed_to_the_other_participant(self):
+        for i in range(4):
+            await Message.objects.acreate(chat=self.chat, sender=self.other, content=f'unread {i}')
+
+        reader, writer = self.communicator(self.user), self.communicator(self.other)
+        await reader.connect()
+        await writer.connect()
+
+        with mock.patch.object(PrivateChat.objects, 'mark_read', wraps=PrivateChat.objects.mark_read) as mark_read:
+            for seq in (1, 3, 2):
+                await reader.send_to(text_data=json.dumps({'type': 'read', 'seq': seq}))
+            await reader.disconnect()
+        mark_read.assert_called_once_with(self.chat.pk, self.user.pk, 3)
+
+        event = await writer.receive_json_from()
+        while event.get('type') != 'read':
+            event = await writer.receive_json_from()
+        self.assertEqual(event, {'type': 'read', 'user': str(self.user.pk), 'seq': 3})
+        await writer.disconnect()
+
+        api = APIClient()
+        await database_sync_to_async(api.force_authenticate)(self.user)
+        unread = (await database_sync_to_async(api.get)('/api/chat/unread/')).json()
+        self.assertEqual(unread, {'total': 1, 'chats': {str(self.chat.pk): 1}})
+
+    async def test_non_participants_are_rejected(self):
+        outsider = await database_sync_to_async(make_user)('outsider')
+        connected, _ = await self.communicator(outsider).connect()
+        self.assertFalse(connected)
+
+    async def test_broadcasts_are_encoded_once_per_group(self):
+        sockets = [self.communicator(user) for user in (self.user, self.other, self.other)]
+        for socket in sockets:
+            await socket.connect()
+
+        with mock.patch.object(frames, 'dumps', wraps=frames.dumps) as dumps:
+            await sockets[0].send_to(text_data=json.dumps({'message': 'to everyone'}))
+            received = [await self.next_message(socket) for socket in sockets]
+
+        encoded = [call for call in dumps.call_args_list if 'message' in call.args[0]]
+        self.assertEqual(len(encoded), 1)
+        self.assertEqual({event['message'] for event in received}, {'to everyone'})
+        for socket in sockets:
+            await socket.disconnect()
+
+    async def test_connections_frames_and_handlers_are_measured(self):
+        before = metrics.registry.collect()
+        sender = self.communicator(self.user)
+        await sender.connect()
+        await sender.send_to(text_data=json.dumps({'message': 'hi'}))
+        await self.next_message(sender)
+        await sender.disconnect()
+        after = metrics.registry.collect()
+
+        def delta(*key):
+            return after.get(key, 0) - before.get(key, 0)
+
+        self.assertEqual(delta('ws_connections_total', ('ChatConsumer',), None), 1)
+        self.assertEqual(delta('ws_disconnections_total', ('ChatConsumer',), None), 1)
+        self.assertEqual(delta('ws_frames_total', ('ChatConsumer', 'in'), None), 1)
+        self.assertGreaterEqual(delta('ws_frames_total', ('ChatConsumer', 'out'), None), 2)
+        self.assertGreater(delta('ws_handler_duration_seconds', ('ChatConsumer', 'websocket.receive'), 'sum'), 0)
+        self.assertGreater(delta('channel_layer_send_duration_seconds', ('group_send',), 'sum'), 0)
+
+
+@override_settings(**TEST_SETTINGS, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class PostStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = make_user('author')
+        self.post = Post.objects.create(title='post', content='content', author=self.author)
+        self.api = APIClient()
+        self.api.force_authenticate(self.author)
+
+    async def subscribe(self):
+        communicator = WebsocketCommunicator(
+            JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+            f'/ws/posts/{self.post.pk}',
+            headers=[(b'authorization', f'Bearer {AccessToken.for_user(self.author)}'.encode())],
+        )
+        self.assertTrue((await communicator.connect())[0])
+        return communicator
+
+    async def test_comment_events_reach_subscribers(self):
+        communicator = await self.subscribe()
+        url = f'/api/posts/{self.post.pk}/comments/'
+
+        response = await database_sync_to_async(self.api.post)(url, {'texto': 'first'})
+        event = await communicator.receive_json_from()
+        self.assertEqual((event['type'], event['comment']['texto']), ('comment_created', 'first'))
+
+        await database_sync_to_async(self.api.delete)(f'{url}{response.data["id"]}/')
+        event = await communicator.receive_json_from()
+        self.assertEqual(event, {'type': 'comment_deleted', 'post': str(self.post.pk), 'comment': str(response.data['id'])})
+        await communicator.disconnect()
+
+    def test_unreachable_channel_layer_does_not_fail_the_write(self):
+        with mock.patch.object(live, 'send', side_effect=ConnectionError('unreachable')), self.assertLogs('core.live', 'ERROR'):
+            response = self.api.post(f'/api/posts/{self.post.pk}/comments/', {'texto': 'hi'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 1)
+
+    async def test_like_bursts_become_one_count_update(self):
+        communicator = await self.subscribe()
+        likers = [APIClient() for _ in range(3)]
+        for i, client in enumerate(likers):
+            await database_sync_to_async(client.force_authenticate)(await database_sync_to_async(make_user)(f'liker{i}'))
+
+        coalescer = live.LikeCountCoalescer()
+        with self.settings(LIVE_COUNT_INTERVAL=60), mock.patch.object(live, 'like_counts', coalescer), mock.patch.object(coalescer, '_start'):
+            for client in likers:
+                await database_sync_to_async(client.post)(f'/api/posts/{self.post.pk}/like/')
+            await database_sync_to_async(likers[0].delete)(f'/api/posts/{self.post.pk}/like/')
+            self.assertTrue(await communicator.receive_nothing())
+
+            self.assertEqual(await database_sync_to_async(coalescer.flush)(), 1)
+
+        event = await communicator.receive_json_from()
+        self.assertEqual(event, {'type': 'like_count', 'post': str(self.post.pk), 'like_count': 2})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_missing_posts_are_rejected(self):
+        communicator = WebsocketCommunicator(
+            JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+            f'/ws/posts/{uuid.uuid4()}',
+            headers=[(b'authorization', f'Bearer {AccessToken.for_user(self.author)}'.encode())],
+        )
+        self.assertFalse((await communicator.connect())[0])
+
+
+@override_settings(**TEST_SETTINGS)
+class CachedAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.user = make_user('member')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_authenticated_hot_path_issues_no_auth_queries(self):
+        self.client.get('/api/posts/')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/posts/')
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivating_a_user_evicts_it(self):
+        self.client.get('/api/posts/')
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get('/api/posts/').status_code, 401)
+
+
+@override_settings(**TEST_SETTINGS)
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(search, '_local_index', search.LocalSearchIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = make_user('searcher')
+        self.client.force_authenticate(self.user)
+        self.titled = Post.objects.create(title='Sourdough bread', content='flour and water', author=self.user)
+        self.mentioned = Post.objects.create(title='Weekend', content='baked sourdough again', author=self.user)
+        Post.objects.create(title='Unrelated', content='nothing here', author=self.user)
+        self.comment = Comment.objects.create(post=self.titled, author=self.user, texto='Great sourdough!')
+
+    def test_ranks_matches_across_posts_comments_and_users(self):
+        make_user('sourdough_fan')
+        results = self.client.get('/api/search/?q=sourdough').json()['results']
+
+        self.assertEqual(
+            [(row['type'], row['object'].get('title') or row['object'].get('texto') or row['object']['username']) for row in results],
+            [('user', 'sourdough_fan'), ('post', 'Sourdough bread'), ('post', 'Weekend'), ('comment', 'Great sourdough!')],
+        )
+
+    def test_cursor_walks_every_hit_once(self):
+        for i in range(4):
+            Comment.objects.create(post=self.mentioned, author=self.user, texto=f'sourdough number {i}')
+
+        seen, url = [], '/api/search/?q=sourdough&page_size=2'
+        while url:
+            body = self.client.get(url).json()
+            seen.extend(row['object']['id'] for row in body['results'])
+            url = body['next']
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_index_follows_writes(self):
+        self.client.get('/api/search/?q=bread')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Rye bread', content='', author=self.user)
+            Post.objects.get(pk=self.titled.pk).delete()
+
+        results = self.client.get('/api/search/?q=bread&type=post').json()['results']
+        self.assertEqual([row['object']['id'] for row in results], [str(post.pk)])
+        self.assertNotIn(self.titled.pk, search._local_index._terms['post'])
+
+    def test_comment_payloads_leave_out_the_search_vector(self):
+        listed = self.client.get(f'/api/posts/{self.titled.pk}/comments/').json()['results']
+        created = self.client.post(f'/api/posts/{self.titled.pk}/comments/', {'texto': 'more sourdough'}).json()
+        found = self.client.get('/api/search/?q=sourdough&type=comment').json()['results']
+
+        for payload in (*listed, created, *(row['object'] for row in found)):
+            self.assertNotIn('search_vector', payload)
+
+    def test_reads_outside_search_do_not_load_the_search_vector(self):
+        other = make_user('baker')
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.user, followed=other)
+            Post.objects.create(title='Rye', content='content', author=other)
+
+        with CaptureQueriesContext(connection) as context, mock.patch.object(feed, '_local_store', feed.LocalTimelineStore()):
+            for url in ('/api/posts/', f'/api/posts/{self.titled.pk}/', f'/api/posts/{self.titled.pk}/comments/', '/api/posts/feed/'):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertTrue(context.captured_queries)
+        self.assertFalse([query['sql'] for query in context.captured_queries if 'search_vector' in query['sql']])
+
+    def test_username_similarity_matches_pg_trgm(self):
+        self.assertAlmostEqual(search.similarity('word', 'two words'), 4 / 11)
+
+
+@override_settings(**TEST_SETTINGS)
+class SuggestionTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.users = {name: make_user(name) for name in ('ana', 'bia', 'caio', 'duda', 'edu')}
+        self.client.force_authenticate(self.users['ana'])
+
+    def follow(self, follower, *followed):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in followed:
+                Follow.objects.create(follower=self.users[follower], followed=self.users[name])
+
+    def suggested(self):
+        return [(row['username'], row['mutual']) for row in self.client.get('/api/users/suggestions/').json()['results']]
+
+    def test_ranks_friends_of_friends_by_mutual_follows(self):
+        self.follow('ana', 'bia', 'caio')
+        self.follow('bia', 'duda', 'edu', 'caio')
+        self.follow('caio', 'duda', 'ana')
+
+        self.assertEqual(suggestions.refresh(), 5)
+        self.assertEqual(self.suggested(), [('duda', 2), ('edu', 1)])
+
+    def test_stale_refresh_recomputes_changed_users_and_their_followers(self):
+        self.follow('ana', 'bia')
+        self.follow('bia', 'caio')
+        suggestions.refresh()
+        self.assertEqual(self.suggested(), [('caio', 1)])
+
+        self.follow('bia', 'duda')
+        self.assertEqual(list(SuggestedFollows.objects.stale().values_list('user__username', flat=True)), ['bia'])
+        self.assertEqual(suggestions.refresh(stale_only=True), 2)
+        tied = sorted(['caio', 'duda'], key=lambda name: self.users[name].pk)
+        self.assertEqual(self.suggested(), [(name, 1) for name in tied])
+
+    def test_hides_accounts_followed_since_the_last_run(self):
+        self.follow('ana', 'bia')
+        self.follow('bia', 'caio', 'duda')
+        suggestions.refresh()
+
+        self.follow('ana', 'caio')
+        self.assertEqual(self.suggested(), [('duda', 1)])
+
+
+@override_settings(**TEST_SETTINGS)
+class BulkEndpointTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('bulk')
+        self.author = make_user('author')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(title=f'post {i}', content='content', author=self.author) for i in range(3)]
+
+    def test_batch_serves_cached_posts_and_fetches_the_rest_in_one_query(self):
+        first, second, third = (str(post.pk) for post in self.posts)
+        unknown = '00000000-0000-0000-0000-000000000000'
+
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/posts/batch/?ids={first},{second}')
+
+        with self.assertNumQueries(1):
+            body = self.client.get(f'/api/posts/batch/?ids={third},{first},{unknown},{second}').json()
+
+        self.assertEqual([post['id'] for post in body['results']], [third, first, second])
+        self.assertEqual(body['missing'], [unknown])
+        self.assertEqual(body['statuses'], {third: 'found', first: 'found', unknown: 'not_found', second: 'found'})
+
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/posts/batch/?ids={third},{first},{second}')
+
+    def test_batch_reports_every_requested_id(self):
+        post = str(self.posts[0].pk)
+        unknown = '00000000-0000-0000-0000-000000000000'
+        url = f'/api/posts/batch/?ids={post},nope,{unknown}'
+        expected = {post: 'found', 'nope': 'invalid', unknown: 'not_found'}
+
+        self.assertEqual(self.client.get(url).json()['statuses'], expected)
+        with mock.patch('core.views.is_cacheable', return_value=False):
+            self.assertEqual(self.client.get(url).json()['statuses'], expected)
+
+    def test_batch_entries_follow_post_writes(self):
+        post = self.posts[0]
+        self.client.get(f'/api/posts/batch/?ids={post.pk}')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Likes.objects.create(post=post, user=self.user)
+
+        body = self.client.get(f'/api/posts/batch/?ids={post.pk}').json()
+        self.assertEqual(body['results'][0]['like_count'], 1)
+
+    def test_bulk_like_and_unlike_report_each_item(self):
+        liked, fresh, _ = self.posts
+        Likes.objects.create(post=liked, user=self.user)
+        ids = [str(liked.pk), str(fresh.pk), '00000000-0000-0000-0000-000000000000', 'nope']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/likes/', {'ids': ids}, format='json')
+
+        self.assertEqual(response.json(), {
+            str(liked.pk): 'already_liked', str(fresh.pk): 'liked',
+            '00000000-0000-0000-0000-000000000000': 'not_found', 'nope': 'invalid',
+        })
+        self.assertEqual(Post.objects.get(pk=fresh.pk).like_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/posts/likes/', {'ids': ids[:2] + [str(self.posts[2].pk)]}, format='json')
+
+        self.assertEqual(response.json(), {str(liked.pk): 'unliked', str(fresh.pk): 'unliked', str(self.posts[2].pk): 'not_liked'})
+        self.assertFalse(Likes.objects.filter(user=self.user).exists())
+        self.assertEqual(list(Post.objects.values_list('like_count', flat=True)), [0, 0, 0])
+
+    def test_bulk_like_only_counts_rows_it_inserted(self):
+        post = self.posts[0]
+        insert = Likes.objects.bulk_create
+
+        def racing(objs, **kwargs):
+            # Another request likes the post after the existence check.
+            Likes.objects.create(post=post, user=self.user)
+            return insert(objs, **kwargs)
+
+        with mock.patch.object(Likes.objects, 'bulk_create', side_effect=racing), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(bulk.like(self.user, [post.pk]), {str(post.pk): 'already_liked'})
+
+        self.assertEqual(Likes.objects.filter(post=post).count(), 1)
+        self.assertEqual(Post.objects.get(pk=post.pk).like_count, 1)
+
+    def test_bulk_follow_and_unfollow_report_each_item(self):
+        other = make_user('other')
+        Follow.objects.create(follower=self.user, followed=other)
+        ids = [str(self.author.pk), str(other.pk), str(self.user.pk)]
+
+        response = self.client.post('/api/users/follow/', {'ids': ids}, format='json')
+        self.assertEqual(response.json(), {str(self.author.pk): 'followed', str(other.pk): 'already_following', str(self.user.pk): 'self'})
+
+        response = self.client.delete('/api/users/follow/', {'ids': ids[:2]}, format='json')
+        self.assertEqual(response.json(), {str(self.author.pk): 'unfollowed', str(other.pk): 'unfollowed'})
+        self.assertFalse(Follow.objects.exists())
+
+    def test_liking_twice_is_rejected_without_a_failed_insert(self):
+        post = self.posts[0]
+        self.client.post(f'/api/posts/{post.pk}/like/')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f'/api/posts/{post.pk}/like/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(any(query['sql'].startswith('INSERT') for query in context.captured_queries))
+
+
+@override_settings(**TEST_SETTINGS, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('poller')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(title='post', content='content', author=self.user)
+
+    def test_unchanged_list_is_answered_with_304_without_serializing(self):
+        response = self.client.get('/api/posts/')
+        etag = response['ETag']
+
+        with self.assertNumQueries(0), mock.patch.object(PostSerializer, 'to_representation') as serialize:
+            response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        serialize.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title='another', content='content', author=self.user)
+
+        response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since_uses_the_tag_modification_time(self):
+        last_modified = self.client.get(f'/api/posts/{self.post.pk}/')['Last-Modified']
+
+        response = self.client.get(f'/api/posts/{self.post.pk}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        with mock.patch('core.caching.time.time', return_value=time.time() + 5), self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, author=self.user, texto='new')
+
+        response = self.client.get(f'/api/posts/{self.post.pk}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_comment_list_validators_follow_new_comments(self):
+        url = f'/api/posts/{self.post.pk}/comments/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'texto': 'hi'})
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(CACHE_TAG_TTL=60)
+    def test_tags_from_request_input_expire(self):
+        tag = f'privatechat:{uuid.uuid4()}'
+        self.client.get('/api/chat/messages/', {'conversation': tag.split(':')[1]})
+        keys = [caching.GENERATION_KEY.format(tag), caching.MODIFIED_KEY.format(tag)]
+        self.assertEqual(len(cache.get_many(keys)), 2)
+
+        with mock.patch('core.caching.time.time', return_value=time.time() + 61):
+            self.assertEqual(cache.get_many(keys), {})
+
+
+@override_settings(**TEST_SETTINGS)
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('watcher')
+        self.client.force_authenticate(self.user)
+        Post.objects.create(title='post', content='content', author=self.user)
+
+    def test_requests_queries_and_cache_reads_are_recorded(self):
+        before = metrics.registry.collect()
+        self.client.get('/api/posts/')
+        self.client.get('/api/posts/')
+        after = metrics.registry.collect()
+
+        def delta(*key):
+            return after.get(key, 0) - before.get(key, 0)
+
+        self.assertEqual(sum(delta('http_request_duration_seconds', ('post-list', 'GET', 200), i) for i in range(14)), 2)
+        self.assertGreater(delta('db_queries_total', ('post-list',), None), 0)
+        self.assertEqual(delta('cache_requests_total', ('default', 'miss'), None), 1)
+        self.assertEqual(delta('cache_requests_total', ('default', 'hit'), None), 1)
+        self.assertEqual(delta('cache_bytes_total', ('default', 'read'), None), delta('cache_bytes_total', ('default', 'write'), None))
+
+    def test_metrics_endpoint_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram('test_latency_seconds', 'Test.', ['view'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, 'home')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE test_latency_seconds histogram', lines)
+        self.assertIn('test_latency_seconds_bucket{view="home",le="0.1"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{view="home",le="1.0"} 2', lines)
+        self.assertIn('test_latency_seconds_bucket{view="home",le="+Inf"} 3', lines)
+        self.assertIn('test_latency_seconds_count{view="home"} 3', lines)
+        self.assertIn('test_latency_seconds_sum{view="home"} 5.55', lines)
+
+
+@override_settings(**TEST_SETTINGS, DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # A second connection to the test database stands in for the replica.
+        connections.settings['replica'] = {**connections['default'].settings_dict}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.settings['replica']
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('writer')
+        self.post = Post.objects.create(title='post', content='content', author=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def databases_used(self, method, url, client=None):
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica']) as replica:
+            getattr(client or self.client, method)(url)
+        return {alias for alias, captured in (('default', primary), ('replica', replica)) if len(captured)}
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        url = f'/api/posts/{self.post.pk}/'
+        self.assertEqual(self.databases_used('get', url), {'replica'})
+
+        self.assertEqual(self.databases_used('post', f'{url}like/'), {'default'})
+        self.assertIn(PRIMARY_COOKIE, self.client.cookies)
+        self.assertEqual(self.databases_used('get', url), {'default'})
+
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(make_user("reader"))}')
+        self.assertEqual(self.databases_used('get', url, other), {'replica'})
+
+    def test_writers_without_cookies_are_recognised_by_their_token(self):
+        self.client.post(f'/api/posts/{self.post.pk}/like/')
+        self.client.cookies.clear()
+        self.assertEqual(self.databases_used('get', f'/api/posts/{self.post.pk}/'), {'default'})
+
+        cache.delete(routers.WRITER_KEY.format(self.user.pk))
+        self.assertEqual(self.databases_used('get', f'/api/posts/{self.post.pk}/'), {'replica'})
+
+    def test_shared_cache_entries_are_filled_from_the_primary_after_changes(self):
+        with CaptureQueriesContext(connections['default']) as primary:
+            self.client.get('/api/posts/')
+        self.assertTrue(any('core_post' in query['sql'] for query in primary.captured_queries))
+
+        cache.clear()
+        with self.settings(READ_YOUR_WRITES_WINDOW=0):
+            self.assertEqual(self.databases_used('get', '/api/posts/'), {'replica'})
+
+
+@override_settings(**TEST_SETTINGS, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class AsyncViewTests(APITestCase):
+    """Bearer requests to the post endpoints are served by core.async_views, the rest by the viewset."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('async')
+        self.post = Post.objects.create(title='post', content='content', author=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+        self.sync_client = APIClient()
+        self.sync_client.force_authenticate(self.user)
+
+    def test_reads_match_the_sync_views(self):
+        for url in ('/api/posts/', f'/api/posts/{self.post.pk}/', f'/api/posts/{self.post.pk}/comments/'):
+            expected = self.sync_client.get(url)
+            cache.clear()
+            with mock.patch('core.async_views.sync_to_async', side_effect=AssertionError('fell back')):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), json.loads(expected.content))
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_comments_and_likes_are_written_natively(self):
+        with mock.patch.object(PostViewSet, 'comments_list_create') as sync_comments, \
+                mock.patch.object(PostViewSet, 'like_comment') as sync_like, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/posts/{self.post.pk}/comments/', {'texto': 'hi'}, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()['texto'], 'hi')
+            self.assertEqual(self.client.post(f'/api/posts/{self.post.pk}/comments/', {}, format='json').status_code, 400)
+
+            like = f'/api/posts/{self.post.pk}/like/'
+            self.assertEqual(self.client.post(like).status_code, 201)
+            self.assertEqual(self.client.post(like).json(), {'detail': 'Já curtido.'})
+            self.assertEqual(self.client.delete(like).status_code, 204)
+            self.assertEqual(self.client.delete(like).status_code, 404)
+        sync_comments.assert_not_called()
+        sync_like.assert_not_called()
+
+        self.assertEqual(Comment.objects.filter(post=self.post, author=self.user).count(), 1)
+        self.assertFalse(Likes.objects.exists())
+
+    def test_other_requests_fall_back_to_the_viewset(self):
+        missing = uuid.uuid4()
+        self.assertEqual(self.client.get(f'/api/posts/{missing}/').status_code, 404)
+        self.assertEqual(self.client.post(f'/api/posts/{missing}/like/').status_code, 404)
+
+        self.assertIn(b'<html', self.client.get('/api/posts/', HTTP_ACCEPT='text/html').content)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+        self.assertEqual(self.client.get('/api/posts/').status_code, 401)
+
+
+@override_settings(**TEST_SETTINGS)
+class CacheStampedeTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('crowd')
+        self.client.force_authenticate(self.user)
+        Post.objects.create(title='post', content='content', author=self.user)
+        self.key = caching.validators('default:cache/api/posts/?', PostViewSet.cache_tags)[0]
+        self.expected = self.client.get('/api/posts/').content
+
+    def get(self):
+        """GET the post list; returns how many times it was built."""
+        builds = []
+        get_list_data = PostViewSet.get_list_data
+
+        def build(viewset, request):
+            builds.append(request)
+            return get_list_data(viewset, request)
+
+        with mock.patch.object(PostViewSet, 'get_list_data', build):
+            response = self.client.get('/api/posts/')
+        self.assertEqual(response.content, self.expected)
+        return len(builds)
+
+    def test_expired_entries_are_served_stale_while_one_worker_rebuilds(self):
+        expired = time.time() + PostViewSet.cache_timeout + 1
+        cache.add(caching.LOCK_KEY.format(self.key), 1, timeout=None)
+
+        with mock.patch('core.caching.time.time', return_value=expired):
+            self.assertEqual(self.get(), 0)
+            cache.delete(caching.LOCK_KEY.format(self.key))
+            self.assertEqual(self.get(), 1)
+            self.assertEqual(self.get(), 0)
+
+    def test_requests_without_an_entry_wait_for_the_rebuild(self):
+        entry = cache.get(self.key)
+        cache.delete(self.key)
+        cache.add(caching.LOCK_KEY.format(self.key), 1, timeout=None)
+
+        with mock.patch('core.caching.time.sleep', side_effect=lambda seconds: cache.set(self.key, entry)):
+            self.assertEqual(self.get(), 0)
+
+        cache.delete(self.key)
+        with self.settings(CACHE_LOCK_WAIT=0):
+            self.assertEqual(self.get(), 1)
+
+    def test_early_refresh_grows_with_the_build_time(self):
+        entry = (time.time() + 10, 1.0, b'')
+        with mock.patch('core.caching.random.random', return_value=0.0):
+            self.assertFalse(caching.is_due(entry, caching.CachePolicy(60, 60, 1.0)))
+        with mock.patch('core.caching.random.random', return_value=1 - 1e-9):
+            self.assertTrue(caching.is_due(entry, caching.CachePolicy(60, 60, 1.0)))
+            self.assertFalse(caching.is_due(entry, caching.CachePolicy(60, 60, 0)))
+
+
+@override_settings(CACHE_L1_MAX_BYTES=100, CACHE_L1_TTL=30)
+class LocalCacheTests(APITestCase):
+
+    def setUp(self):
+        self.local = LocalCache()
+
+    def test_least_recently_used_entries_go_first_when_over_budget(self):
+        self.local.set_many({'a': b'x' * 40, 'b': b'x' * 40})
+        self.local.get('a')
+        self.local.set_many({'c': b'x' * 40, 'huge': b'x' * 101})
+        self.assertEqual(set(self.local.get_many(['a', 'b', 'c', 'huge'])), {'a', 'c'})
+        self.assertEqual(self.local.size, 80)
+
+        with mock.patch('core.local_cache.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(self.local.get_many(['a', 'c']), {})
+        self.assertEqual(self.local.size, 0)
+
+    def test_fills_racing_an_invalidation_are_dropped(self):
+        epoch = self.local.epoch
+        self.local.handle({'type': 'message', 'data': json.dumps(['gen:post'])})
+        self.local.set_many({'gen:post': 1}, epoch)
+        self.assertIsNone(self.local.get('gen:post'))
+
+        self.local.set_many({'gen:post': 2}, self.local.epoch)
+        self.assertEqual(self.local.get('gen:post'), 2)
+
+    def test_invalidations_are_published_to_other_processes(self):
+        connection = mock.Mock()
+        self.local.set_many({'gen:post': 1})
+        with mock.patch('core.local_cache.get_redis_connection', return_value=connection):
+            self.local.invalidate(['gen:post'])
+        self.assertIsNone(self.local.get('gen:post'))
+        connection.publish.assert_called_once_with(INVALIDATION_CHANNEL, '["gen:post"]')
+
+
+@override_settings(**TEST_SETTINGS, CACHE_L1_MAX_BYTES=1024 * 1024)
+class TwoTierCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.user = make_user('hot')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(title='post', content='content', author=self.user)
+
+    def test_hits_are_served_locally_until_a_tag_is_invalidated(self):
+        first = self.client.get('/api/posts/')
+
+        before = metrics.registry.collect()
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get, mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(self.client.get('/api/posts/').content, first.content)
+        get.assert_not_called()
+        get_many.assert_not_called()
+        after = metrics.registry.collect()
+        hits = ('cache_tier_requests_total', ('default', 'l1', 'hit'), None)
+        self.assertEqual(after.get(hits, 0) - before.get(hits, 0), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, author=self.user, texto='new')
+        self.assertEqual(self.client.get('/api/posts/').json()['results'][0]['comment_count'], 1)
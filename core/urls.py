@@ -1,9 +1,11 @@
 from rest_framework import routers
-from .views import CustomUserViewSet, PostViewSet, Chat
+from . import async_views
+from .views import CustomUserViewSet, PostViewSet, Chat, SearchViewSet
 
 router = routers.SimpleRouter()
 router.register(r'users', CustomUserViewSet)
 router.register(r'posts', PostViewSet)
 router.register(r'chat', Chat)
+router.register(r'search', SearchViewSet, basename='search')
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = async_views.urlpatterns(router) + router.urls
\ No newline at end of file
@@ -2,14 +2,29 @@ from rest_framework import status
 from rest_framework import viewsets
 from rest_framework.response import Response
 from .models import CustomUser, Post, Comment, Likes, Message, PrivateChat
-from .serializers import CustomUserSerializer, PostSerializer,CommentSerializer, LikesSerializer, MessageSerializer
+from .serializers import CustomUserSerializer, PostSerializer,CommentSerializer, LikesSerializer, MessageSerializer, InboxSerializer, AuthorSerializer
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework.decorators import action
+from rest_framework.utils.urls import replace_query_param
 from rest_framework import mixins
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from django.core.cache import cache
 from .mixins import CacheMixin
 from .decorators import cache_action
+from .caching import tag_for, is_cacheable, cached_objects, render
+from django.http import HttpResponse
+from .feed import read_feed, encode_cursor, decode_cursor
+from . import presence, search, suggestions, bulk, metrics, live
+from .pagination import KeysetPagination, ChronologicalKeysetPagination, InboxPagination
+
+def bulk_ids(values):
+    """Parse the ids of a bulk request; returns `(None, error)` when the request itself is invalid."""
+    if not isinstance(values, list) or not values:
+        return None, {'detail': 'IDs not provided.'}
+
+    if len(values) > bulk.MAX_IDS:
+        return None, {'detail': f'At most {bulk.MAX_IDS} IDs per request.'}
+
+    return bulk.parse_ids(values)
 
 class CustomUserViewSet(mixins.RetrieveModelMixin,mixins.UpdateModelMixin,mixins.DestroyModelMixin,mixins.ListModelMixin,viewsets.GenericViewSet):
     
@@ -32,6 +47,36 @@ class CustomUserViewSet(mixins.RetrieveModelMixin,mixins.UpdateModelMixin,mixins
         
         return Response(response_data, status=status.HTTP_200_OK)
     
+    @action(methods=['get'], detail=False, permission_classes=[IsAuthenticated])
+    def presence(self, request, *args, **kwargs):
+        ids = [user_id for user_id in request.query_params.get('ids', '').split(',') if user_id]
+
+        if not ids:
+            return Response({'detail': 'User IDs not provided.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(ids) > 500:
+            return Response({'detail': 'At most 500 user IDs per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(presence.get_store().online(ids))
+
+    @action(methods=['get'], detail=False, permission_classes=[IsAuthenticated])
+    def suggestions(self, request, *args, **kwargs):
+        results = [
+            {**AuthorSerializer(user).data, 'mutual': mutual}
+            for user, mutual in suggestions.suggestions_for(request.user)
+        ]
+        return Response({'results': results})
+
+    @action(methods=['post', 'delete'], detail=False, permission_classes=[IsAuthenticated], url_path='follow', url_name='follow')
+    def follow(self, request, *args, **kwargs):
+        ids, statuses = bulk_ids(request.data.get('ids'))
+
+        if ids is None:
+            return Response(statuses, status=status.HTTP_400_BAD_REQUEST)
+
+        apply = bulk.follow if request.method == 'POST' else bulk.unfollow
+        return Response({**statuses, **apply(request.user, ids)})
+
     @action(methods= ['post'], detail= False)
     def register(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -42,22 +87,82 @@ class CustomUserViewSet(mixins.RetrieveModelMixin,mixins.UpdateModelMixin,mixins
         
 class PostViewSet(CacheMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
-    queryset = Post.objects.all()
+    queryset = Post.objects.select_related('author')
     serializer_class = PostSerializer
+    pagination_class = KeysetPagination
+    cache_tags = ['post', 'customuser', 'comment', 'likes']
+    object_cache_tags = ['post:{pk}', 'customuser']
     
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(methods=['get'], detail=False, url_path='feed', url_name='feed')
+    def feed(self, request, *args, **kwargs):
+        try:
+            before = decode_cursor(request.query_params['before']) if 'before' in request.query_params else None
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response({'detail': 'Invalid pagination parameters.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if limit < 1:
+            return Response({'detail': 'Invalid pagination parameters.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        posts, next_before = read_feed(request.user, before=before, count=limit)
+        serializer = self.get_serializer(posts, many=True)
+        return Response({'next': encode_cursor(next_before) if next_before else None, 'results': serializer.data})
+
+    @action(methods=['get'], detail=False, url_path='batch', url_name='batch')
+    def batch(self, request, *args, **kwargs):
+        ids, statuses = bulk_ids([pk for pk in request.query_params.get('ids', '').split(',') if pk])
+
+        if ids is None:
+            return Response(statuses, status=status.HTTP_400_BAD_REQUEST)
+
+        def load(missed):
+            posts = self.get_queryset().in_bulk(missed)
+            return {pk: self.get_serializer(post).data for pk, post in posts.items()}
+
+        def report(found):
+            return {**statuses, **{str(pk): bulk.FOUND if pk in found else bulk.NOT_FOUND for pk in ids}}
+
+        if not is_cacheable(request):
+            posts = load(ids)
+            return Response({
+                'results': [posts[pk] for pk in ids if pk in posts],
+                'missing': [str(pk) for pk in ids if pk not in posts],
+                'statuses': report(posts),
+            })
+
+        entries = {pk: (f'object:post:{pk}', [tag_for(Post, pk), tag_for(CustomUser)]) for pk in ids}
+        found = cached_objects(request, self, entries, load, self.cache_timeout)
+        missing, content_type = render(request, self, [str(pk) for pk in ids if pk not in found])
+        reported, _ = render(request, self, report(found))
+        content = (
+            b'{"results":[' + b','.join(found[pk] for pk in ids if pk in found) + b'],"missing":' + missing
+            + b',"statuses":' + reported + b'}'
+        )
+        return HttpResponse(content, content_type=content_type)
+
+    @action(methods=['post', 'delete'], detail=False, url_path='likes', url_name='likes')
+    def bulk_like(self, request, *args, **kwargs):
+        ids, statuses = bulk_ids(request.data.get('ids'))
+
+        if ids is None:
+            return Response(statuses, status=status.HTTP_400_BAD_REQUEST)
+
+        apply = bulk.like if request.method == 'POST' else bulk.unlike
+        return Response({**statuses, **apply(request.user, ids)})
+
     @action(methods=['get', 'post'], detail=True, url_path='comments', url_name='comments', permission_classes = [AllowAny])
-    @cache_action
+    @cache_action(tags=['post:{pk}'])
     def comments_list_create(self, request, *args, **kwargs):
         post = self.get_object()
 
         if request.method == 'GET':
-            comments = post.comments.all()
+            paginator = ChronologicalKeysetPagination()
+            comments = paginator.paginate_queryset(post.comments.all(), request, view=self)
             serializer = CommentSerializer(comments, many=True)
-            response_data = serializer.data
-            return Response(response_data)
+            return paginator.get_paginated_response(serializer.data)
         
         if request.method == 'POST':
             if not request.user.is_authenticated:
@@ -65,7 +170,8 @@ class PostViewSet(CacheMixin, viewsets.ModelViewSet):
             
             serializer = CommentSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save(post=post, author=request.user)
+                comment = serializer.save(post=post, author=request.user)
+                live.comment_created(comment, serializer.data)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -82,26 +188,25 @@ class PostViewSet(CacheMixin, viewsets.ModelViewSet):
         
 
         if request.method in ['PUT', 'PATCH']:
-            if comment.author != request.user:
+            if comment.author_id != request.user.pk:
                 return Response({'detail': 'Permissão negada.'}, status=status.HTTP_403_FORBIDDEN)
 
             serializer = CommentSerializer(comment, data=request.data, partial=request.method == 'PATCH')
 
             if serializer.is_valid():
                 serializer.save()
+                live.comment_updated(comment, serializer.data)
                 return Response(serializer.data)
             
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         if request.method == 'DELETE':
-            if comment.author != request.user:
+            if comment.author_id != request.user.pk:
                 return Response({'detail': 'Permissão negada.'}, status=status.HTTP_403_FORBIDDEN)
 
+            comment_id = comment.pk
             comment.delete()
-
-            cache_key = f"post_{post.pk}_comments"
-            cache.delete(cache_key)
-
+            live.comment_deleted(post.pk, comment_id)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response({'detail': 'Método não permitido.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -111,29 +216,22 @@ class PostViewSet(CacheMixin, viewsets.ModelViewSet):
         post = self.get_object()
         user = request.user
 
-        data = {
-                'post': post.id,
-                'user': user.id
-            }
-
         if request.method == 'POST':
             if not user.is_authenticated:
                 return Response({'detail': 'Autenticação necessária.'}, status=status.HTTP_401_UNAUTHORIZED)
    
-            serializer = LikesSerializer(data=data)
-            
-            if serializer.is_valid():
-                try:
-                    serializer.save()
-                    return Response(serializer.data, status=status.HTTP_201_CREATED)
-                except:
-                    return Response({'detail': 'Já curtido.'}, status=status.HTTP_400_BAD_REQUEST)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            like, created = Likes.objects.get_or_create(post=post, user=user)
+
+            if not created:
+                return Response({'detail': 'Já curtido.'}, status=status.HTTP_400_BAD_REQUEST)
+            live.likes_changed([post.pk])
+            return Response(LikesSerializer(like).data, status=status.HTTP_201_CREATED)
         
         elif request.method == 'DELETE':
             try:
                 like = Likes.objects.get(post=post, user=user)
                 like.delete()
+                live.likes_changed([post.pk])
                 return Response(status=status.HTTP_204_NO_CONTENT)
             except Likes.DoesNotExist:
                 return Response({'detail': 'Like não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
@@ -142,29 +240,70 @@ class Chat(CacheMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     @action(methods = ['get'], detail = False, url_path = 'conversations')
-    @cache_action
     def conversations(self, request):
-        user_id = request.query_params.get('user')
-        
-        if user_id:
-            messages = Message.objects.filter(sender=user_id)
-            serializer = self.get_serializer(messages, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        
-        return Response({"detail": "User ID not provided."}, status=status.HTTP_400_BAD_REQUEST)
+        chats = (
+            PrivateChat.objects.for_user(request.user)
+            .with_unread(request.user)
+            .select_related('user1', 'user2', 'last_message')
+        )
+        paginator = InboxPagination()
+        page = paginator.paginate_queryset(chats, request, view=self)
+        serializer = InboxSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
     
+    @action(methods = ['get'], detail = False, url_path = 'unread')
+    def unread(self, request):
+        chats = PrivateChat.objects.for_user(request.user).with_unread(request.user).values_list('id', 'unread')
+        unread = {str(chat_id): count for chat_id, count in chats}
+        return Response({'total': sum(unread.values()), 'chats': unread}, status=status.HTTP_200_OK)
+
     @action(methods = ['get'], detail = False, url_path = 'messages')
-    @cache_action
+    @cache_action(tags=['privatechat:{conversation}'])
     def messages(self, request):
         conversation_id = request.query_params.get('conversation')
 
         if conversation_id:
             try:
-                messages = Message.objects.filter(chat_id=conversation_id) 
+                messages = self.paginate_queryset(Message.objects.filter(chat_id=conversation_id))
                 serializer = MessageSerializer(messages, many=True)  
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                return self.get_paginated_response(serializer.data)
             except PrivateChat.DoesNotExist:
                 return Response({"detail": "Conversation not found."}, status=status.HTTP_404_NOT_FOUND)
-        return Response({"detail": "Conversation ID not provided."}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response({"detail": "Conversation ID not provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+class SearchViewSet(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+    serializers = {'post': PostSerializer, 'comment': CommentSerializer, 'user': AuthorSerializer}
+
+    def list(self, request):
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            return Response({"detail": "Query not provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        kinds = request.query_params.get('type')
+        kinds = [kind for kind in search.KINDS if kind in kinds.split(',')] if kinds else search.KINDS
+        if not kinds:
+            return Response({"detail": "Invalid type."}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = KeysetPagination()
+        cursor = request.query_params.get('cursor')
+        cursor = search.decode_cursor(cursor) if cursor else None
+        hits, has_more = search.search(q, kinds, cursor, paginator.get_page_size(request))
+
+        context = {'request': request}
+        results = [
+            {'type': hit.kind, 'rank': hit.rank, 'object': self.serializers[hit.kind](hit.obj, context=context).data}
+            for hit in hits
+        ]
+        next_link = None
+        if has_more:
+            next_link = replace_query_param(request.build_absolute_uri(), 'cursor', search.encode_cursor(hits[-1]))
+
+        return Response({'next': next_link, 'results': results})
+
+def metrics_view(request):
+    """Prometheus text exposition of core.metrics, aggregated across worker processes."""
+    return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
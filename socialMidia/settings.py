@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     'rest_framework',
     'rest_framework.authtoken',
@@ -27,6 +28,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,9 +69,26 @@ DATABASES = {
         "PASSWORD": env("DJANGO_DATABASE_PASSWORD"),
         "HOST": env("DJANGO_DATABASE_HOST"),
         "PORT": env("DJANGO_DATABASE_PORT"),
+        # psycopg 3 pool, one per worker process; CONN_MAX_AGE must stay 0 with it.
+        "OPTIONS": {
+            "pool": {
+                "min_size": env.int("DJANGO_DATABASE_POOL_MIN_SIZE", default=2),
+                "max_size": env.int("DJANGO_DATABASE_POOL_MAX_SIZE", default=20),
+                "timeout": env.int("DJANGO_DATABASE_POOL_TIMEOUT", default=10),
+            },
+        },
     }
 }
 
+# Read replicas of the default database, e.g. DJANGO_DATABASE_REPLICA_HOSTS=replica1,replica2.
+DATABASE_REPLICAS = []
+for index, host in enumerate(env.list("DJANGO_DATABASE_REPLICA_HOSTS", default=[]), start=1):
+    DATABASES[f"replica{index}"] = {**DATABASES["default"], "HOST": host, "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(f"replica{index}")
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+READ_YOUR_WRITES_WINDOW = 5
+
 AUTH_USER_MODEL = 'core.CustomUser'
 
 ASGI_APPLICATION = 'socialMidia.asgi.application'
@@ -81,6 +101,46 @@ CACHES = {
     }
 }
 
+CACHE_COMPRESS_MIN_BYTES = 1024
+# Tag generations expire so tags built from request input can't pile up.
+CACHE_TAG_TTL = 60 * 60 * 24 * 7
+# Expired responses are served for CACHE_STALE_GRACE more seconds while the
+# worker holding the key's lock rebuilds them.
+CACHE_STALE_GRACE = 60
+CACHE_EARLY_REFRESH = 1.0
+CACHE_LOCK_TIMEOUT = 30
+CACHE_LOCK_WAIT = 2
+# Optional per-process cache in front of Redis, kept coherent over pub/sub;
+# 0 bytes turns it off.
+CACHE_L1_MAX_BYTES = env.int("CACHE_L1_MAX_BYTES", default=0)
+CACHE_L1_TTL = 30
+
+POST_COUNTERS_BUFFERED = env.bool("POST_COUNTERS_BUFFERED", default=False)
+
+FEED_MAX_LENGTH = 800
+FEED_FANOUT_LIMIT = 5000
+FEED_TTL = 60 * 60 * 24 * 7
+
+SUGGESTIONS_TOP_K = 20
+SUGGESTIONS_BATCH_BUDGET = 5_000_000
+
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_TTL = 60
+
+PRESENCE_TTL = 75
+PRESENCE_HEARTBEAT = 30
+TYPING_INTERVAL = 3
+READ_RECEIPT_DELAY = 1.0
+
+CHAT_BUFFER_MAX_BATCH = 100
+CHAT_BUFFER_MAX_DELAY = 0.05
+CHAT_REPLAY_BATCH = 200
+CHAT_REPLAY_LIMIT = 2000
+
+LIVE_COUNT_INTERVAL = 0.25
+
+METRICS_FLUSH_INTERVAL = 5
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -107,7 +167,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.BasicAuthentication'
     ),
 }
@@ -4,8 +4,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from core.urls import urlpatterns as urlpatter
+from core.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(urlpatter)),
+    path('metrics', metrics_view, name='metrics'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)